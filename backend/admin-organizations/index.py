@@ -2,19 +2,15 @@
 API для управления организациями в админ-панели.
 Позволяет просматривать список организаций и редактировать тарифы.
 """
+import base64
 import json
 import os
 import jwt
 import bcrypt
-import psycopg2
 import secrets
 import string
 from datetime import datetime
-
-
-def get_db_connection():
-    dsn = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(dsn)
+from db import get_db_connection
 
 
 def verify_admin_token(token: str) -> dict:
@@ -31,41 +27,114 @@ def verify_admin_token(token: str) -> dict:
         return None
 
 
-def get_all_organizations():
-    """Получить список всех организаций с информацией"""
+ORGANIZATIONS_PAGE_MAX = 200
+
+# Поля сортировки списка организаций и разбор значения из cursor
+ORGANIZATION_SORT_FIELDS = {
+    'created_at': datetime.fromisoformat,
+    'name': str,
+    'users_count': int,
+    'matrices_count': int,
+    'clients_count': int,
+}
+
+ORGANIZATION_FIELDS = (
+    'id', 'name', 'subscription_tier', 'subscription_start_date', 'subscription_end_date',
+    'users_limit', 'matrices_limit', 'clients_limit', 'created_at', 'status',
+    'users_count', 'matrices_count', 'clients_count'
+)
+
+
+def encode_organizations_cursor(sort_value, org_id: int) -> str:
+    """Токен следующей страницы по последней отданной организации"""
+    position = [sort_value.isoformat() if isinstance(sort_value, datetime) else sort_value, org_id]
+    return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('utf-8')
+
+
+def decode_organizations_cursor(token: str, sort: str) -> list:
+    """Разбор токена страницы, ValueError если токен испорчен"""
+    try:
+        sort_value, org_id = json.loads(base64.urlsafe_b64decode(token.encode('utf-8')))
+        return [ORGANIZATION_SORT_FIELDS[sort](sort_value), int(org_id)]
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def get_all_organizations(params: dict = None) -> dict:
+    """
+    Список организаций с использованием (пользователи, матрицы, клиенты)
+    из счётчиков organization_usage - без подсчёта по users, matrices, clients.
+    sort/order - сортировка, limit/cursor - keyset-пагинация по (sort, id);
+    без limit и cursor отдаётся весь список.
+    """
+    params = params or {}
+    sort = params.get('sort') or 'created_at'
+    order = (params.get('order') or 'desc').lower()
+    if sort not in ORGANIZATION_SORT_FIELDS:
+        raise ValueError(f"Invalid sort. Use: {', '.join(ORGANIZATION_SORT_FIELDS)}")
+    if order not in ('asc', 'desc'):
+        raise ValueError('Invalid order. Use: asc or desc')
+    
+    cursor = params.get('cursor')
+    paginate = bool(params.get('limit') or cursor)
+    try:
+        limit = min(max(int(params.get('limit') or 50), 1), ORGANIZATIONS_PAGE_MAX)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid limit')
+    
+    where = ''
+    query_params = []
+    if cursor:
+        where = f"WHERE ({sort}, id) {'<' if order == 'desc' else '>'} (%s, %s)"
+        query_params.extend(decode_organizations_cursor(cursor, sort))
+    
+    limit_sql = ''
+    if paginate:
+        limit_sql = 'LIMIT %s'
+        query_params.append(limit + 1)
+    
     conn = get_db_connection()
     cur = conn.cursor()
     
     try:
         cur.execute(
-            """
-            SELECT 
-                o.id,
-                o.name,
-                o.subscription_tier,
-                CAST(NULL AS DATE) as subscription_start_date,
-                o.subscription_expires_at as subscription_end_date,
-                o.users_limit,
-                o.matrices_limit,
-                o.clients_limit,
-                o.created_at,
-                o.status,
-                COUNT(DISTINCT u.id) as users_count,
-                COUNT(DISTINCT m.id) as matrices_count,
-                COUNT(DISTINCT c.id) as clients_count
-            FROM organizations o
-            LEFT JOIN users u ON u.organization_id = o.id AND u.is_active = true
-            LEFT JOIN matrices m ON m.organization_id = o.id
-            LEFT JOIN clients c ON c.organization_id = o.id AND c.is_active = true
-            GROUP BY o.id, o.name, o.subscription_tier, o.subscription_expires_at,
-                     o.users_limit, o.matrices_limit, 
-                     o.clients_limit, o.created_at, o.status
-            ORDER BY o.created_at DESC
-            """
+            f"""
+            WITH org_usage AS (
+                SELECT 
+                    o.id,
+                    o.name,
+                    o.subscription_tier,
+                    CAST(NULL AS DATE) as subscription_start_date,
+                    o.subscription_expires_at as subscription_end_date,
+                    o.users_limit,
+                    o.matrices_limit,
+                    o.clients_limit,
+                    o.created_at,
+                    o.status,
+                    COALESCE(u.users_count, 0) as users_count,
+                    COALESCE(u.matrices_count, 0) as matrices_count,
+                    COALESCE(u.clients_count, 0) as clients_count
+                FROM organizations o
+                LEFT JOIN organization_usage u ON u.organization_id = o.id
+            )
+            SELECT {', '.join(ORGANIZATION_FIELDS)}
+            FROM org_usage
+            {where}
+            ORDER BY {sort} {order.upper()}, id {order.upper()}
+            {limit_sql}
+            """,
+            query_params
         )
+        rows = cur.fetchall()
+        
+        next_cursor = None
+        if paginate and len(rows) > limit:
+            rows = rows[:limit]
+            last = dict(zip(ORGANIZATION_FIELDS, rows[-1]))
+            next_cursor = encode_organizations_cursor(last[sort], last['id'])
         
         organizations = []
-        for row in cur.fetchall():
+        for row in rows:
             org = {
                 'id': row[0],
                 'name': row[1],
@@ -83,7 +152,10 @@ def get_all_organizations():
             }
             organizations.append(org)
         
-        return organizations
+        result = {'organizations': organizations}
+        if paginate:
+            result['next_cursor'] = next_cursor
+        return result
         
     finally:
         cur.close()
@@ -179,6 +251,12 @@ def create_organization(data: dict):
         user_id = cur.fetchone()[0]
         print(f"[DEBUG] User created with id: {user_id}")
         
+        # Счётчики использования тарифа: owner - первый активный пользователь
+        cur.execute(
+            "INSERT INTO organization_usage (organization_id, users_count) VALUES (%s, 1)",
+            (org_id,)
+        )
+        
         conn.commit()
         print(f"[DEBUG] Transaction committed successfully")
         
@@ -286,7 +364,7 @@ def update_organization_status(org_id: int, status: str):
 def handler(event: dict, context) -> dict:
     """
     Управление организациями в админ-панели.
-    GET /admin-organizations - список всех организаций
+    GET /admin-organizations - список организаций (?sort=users_count&order=desc&limit=50&cursor=...)
     POST /admin-organizations - создать организацию с owner
     PUT /admin-organizations/:id - обновить тариф организации
     PATCH /admin-organizations/:id/status - изменить статус
@@ -319,11 +397,18 @@ def handler(event: dict, context) -> dict:
     try:
         # GET - список организаций
         if method == 'GET':
-            organizations = get_all_organizations()
+            try:
+                result = get_all_organizations(event.get('queryStringParameters') or {})
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': str(e)})
+                }
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'organizations': organizations})
+                'body': json.dumps(result)
             }
         
         # POST - создать организацию
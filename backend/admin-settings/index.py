@@ -6,12 +6,7 @@ import json
 import os
 import jwt
 import bcrypt
-import psycopg2
-
-
-def get_db_connection():
-    dsn = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(dsn)
+from db import get_db_connection
 
 
 def verify_admin_token(token: str) -> dict:
@@ -7,9 +7,9 @@ import json
 import os
 import jwt
 import bcrypt
-import psycopg2
 from datetime import datetime, timedelta
 from typing import Optional
+from db import get_db_connection
 
 
 def hash_password(password: str) -> str:
@@ -47,12 +47,6 @@ def verify_jwt_token(token: str) -> Optional[dict]:
         return None
 
 
-def get_db_connection():
-    """Подключение к базе данных"""
-    dsn = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(dsn)
-
-
 def handler(event: dict, context) -> dict:
     """
     Обработка запросов аутентификации:
@@ -0,0 +1,141 @@
+"""
+Общий пул подключений к PostgreSQL на время жизни тёплого контейнера.
+Одинаковая копия модуля лежит в каждой функции: функции деплоятся независимо.
+
+get_db_connection() возвращает соединение из пула, его close() возвращает
+соединение обратно в пул, поэтому код вида conn = get_db_connection() ...
+conn.close() работает без изменений. Для нового кода - db_connection().
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2 import pool as pg_pool
+
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+
+# Соединение, простоявшее в пуле дольше, проверяется SELECT 1 перед выдачей
+DB_POOL_PING_INTERVAL = 30
+
+_pool = None
+_pool_lock = threading.Lock()
+_last_used = {}
+
+
+def _get_pool() -> pg_pool.ThreadedConnectionPool:
+    """Ленивая инициализация пула при первом запросе на тёплом контейнере"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = pg_pool.ThreadedConnectionPool(0, DB_POOL_MAX, os.environ.get('DATABASE_URL'))
+    return _pool
+
+
+def _is_alive(conn) -> bool:
+    """Проверка, что соединение из пула не закрыто сервером или сетью"""
+    if conn.closed:
+        return False
+
+    if time.monotonic() - _last_used.get(id(conn), 0) < DB_POOL_PING_INTERVAL:
+        return True
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _acquire():
+    """Взять живое соединение из пула; при исчерпании пула - прямое подключение"""
+    db_pool = _get_pool()
+
+    for _ in range(DB_POOL_MAX + 1):
+        try:
+            conn = db_pool.getconn()
+        except pg_pool.PoolError:
+            return psycopg2.connect(os.environ.get('DATABASE_URL')), False
+
+        if _is_alive(conn):
+            return conn, True
+
+        _last_used.pop(id(conn), None)
+        db_pool.putconn(conn, close=True)
+
+    return psycopg2.connect(os.environ.get('DATABASE_URL')), False
+
+
+def _release(conn, pooled: bool):
+    """Вернуть соединение в пул, откатив незавершённую транзакцию"""
+    if not pooled:
+        conn.close()
+        return
+
+    db_pool = _get_pool()
+
+    if not conn.closed and conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            pass
+
+    if conn.closed or conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+        _last_used.pop(id(conn), None)
+        db_pool.putconn(conn, close=True)
+        return
+
+    if conn.autocommit:
+        conn.autocommit = False
+
+    _last_used[id(conn)] = time.monotonic()
+    db_pool.putconn(conn)
+
+
+class PooledConnection:
+    """Соединение из пула: close() возвращает его в пул вместо закрытия"""
+
+    _conn = None
+    _pooled = False
+
+    def __init__(self):
+        self._conn, self._pooled = _acquire()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    @property
+    def closed(self) -> int:
+        return 1 if self._conn is None else self._conn.closed
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            _release(conn, self._pooled)
+
+    def __del__(self):
+        # Забытый close() не должен навсегда занимать слот пула
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+def get_db_connection() -> PooledConnection:
+    """Подключение к базе данных из общего пула"""
+    return PooledConnection()
+
+
+@contextmanager
+def db_connection():
+    """Контекстный менеджер: соединение из пула, возврат в пул на выходе"""
+    conn = get_db_connection()
+    try:
+        yield conn
+    finally:
+        conn.close()
@@ -1,8 +1,183 @@
+import base64
 import json
-import os
-import psycopg2
 from datetime import datetime
-import jwt
+from scoring import calculate_client_scores
+from matrix_loader import cached_matrix_definition
+from client_stats import add_clients_to_stats, client_stats_snapshot, record_client_stats_change, load_client_stats
+from db import get_db_connection
+from auth import authenticate, AuthError
+from usage_limits import reserve_usage, release_usage, UsageLimitExceeded
+
+AUTH_ERRORS = {
+    'missing': 'Токен не предоставлен',
+    'expired': 'Токен истёк',
+    'invalid': 'Неверный токен',
+}
+
+CLIENTS_PAGE_DEFAULT = 100
+CLIENTS_PAGE_MAX = 500
+
+# Поле ответа -> (выражение SQL, нужный JOIN)
+CLIENT_LIST_FIELDS = {
+    'id': ('c.id', None),
+    'company_name': ('c.company_name', None),
+    'contact_person': ('c.contact_person', None),
+    'email': ('c.email', None),
+    'phone': ('c.phone', None),
+    'description': ('c.description', None),
+    'score_x': ('c.score_x', None),
+    'score_y': ('c.score_y', None),
+    'quadrant': ('c.quadrant', None),
+    'matrix_id': ('c.matrix_id', None),
+    'matrix_name': ('m.name', 'matrix'),
+    'created_at': ('c.created_at', None),
+    'deleted_at': ('c.deleted_at', None),
+    'deal_status_id': ('c.deal_status_id', None),
+    'deal_status_name': ('ds.name', 'deal_status'),
+    'deal_status_weight': ('ds.weight', 'deal_status'),
+    'responsible_user_id': ('c.responsible_user_id', None),
+    'responsible_user_name': ('u.full_name', 'responsible_user'),
+}
+
+CLIENT_LIST_JOINS = {
+    'matrix': 'LEFT JOIN matrices m ON c.matrix_id = m.id',
+    'deal_status': 'LEFT JOIN deal_statuses ds ON c.deal_status_id = ds.id',
+    'responsible_user': 'LEFT JOIN users u ON c.responsible_user_id = u.id',
+}
+
+# Настройки списков: условие, колонка сортировки, поля по умолчанию, постоянные значения
+CLIENT_LISTS = {
+    'list': {
+        'where': "c.is_active = true AND c.deleted_at IS NULL",
+        'order_field': 'created_at',
+        'fields': ['id', 'company_name', 'contact_person', 'email', 'phone', 'description',
+                   'score_x', 'score_y', 'quadrant', 'matrix_id', 'matrix_name', 'created_at',
+                   'deal_status_id', 'deal_status_name', 'deal_status_weight',
+                   'responsible_user_id', 'responsible_user_name'],
+        'constants': {},
+        'with_count': False,
+    },
+    'list_unrated': {
+        'where': "c.is_active = true AND c.deleted_at IS NULL "
+                 "AND (c.matrix_id IS NULL OR (c.matrix_id IS NOT NULL AND c.score_x = 0 AND c.score_y = 0))",
+        'order_field': 'created_at',
+        'fields': ['id', 'company_name', 'contact_person', 'email', 'phone', 'description',
+                   'created_at', 'deal_status_id', 'deal_status_name', 'deal_status_weight',
+                   'matrix_id', 'matrix_name', 'score_x', 'score_y', 'quadrant'],
+        'constants': {'matrix_id': None, 'matrix_name': None, 'score_x': 0, 'score_y': 0, 'quadrant': None},
+        'with_count': True,
+    },
+    'list_deleted': {
+        'where': "c.deleted_at IS NOT NULL",
+        'order_field': 'deleted_at',
+        'fields': ['id', 'company_name', 'contact_person', 'email', 'phone', 'description',
+                   'score_x', 'score_y', 'quadrant', 'matrix_id', 'matrix_name', 'deleted_at',
+                   'deal_status_id', 'deal_status_name', 'deal_status_weight'],
+        'constants': {},
+        'with_count': True,
+    },
+}
+
+
+def encode_list_cursor(order_value: datetime, client_id: int) -> str:
+    """Токен следующей страницы по последнему отданному клиенту"""
+    position = [order_value.isoformat() if order_value else None, client_id]
+    return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('utf-8')
+
+
+def decode_list_cursor(token: str) -> list:
+    """Разбор токена страницы, ValueError если токен испорчен"""
+    try:
+        order_value, client_id = json.loads(base64.urlsafe_b64decode(token.encode('utf-8')))
+        return [datetime.fromisoformat(order_value), int(client_id)]
+    except Exception:
+        raise ValueError('Неверный cursor')
+
+
+def format_list_value(field: str, value):
+    """Значение поля списка в JSON-представлении"""
+    if field in ('score_x', 'score_y'):
+        return float(value) if value else 0
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def list_clients(cur, organization_id: int, action: str, body: dict) -> dict:
+    """
+    Списки клиентов (list, list_unrated, list_deleted).
+    Без limit/cursor отдаётся весь список, как раньше. С limit или cursor -
+    страница keyset-пагинации по (order_field, id) и next_cursor.
+    fields - необязательный список полей ответа; лишние JOIN не выполняются.
+    """
+    config = CLIENT_LISTS[action]
+    order_field = config['order_field']
+
+    fields = body.get('fields') or config['fields']
+    if isinstance(fields, str):
+        fields = [f.strip() for f in fields.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in CLIENT_LIST_FIELDS]
+    if unknown:
+        raise ValueError(f"Неизвестные поля: {', '.join(map(str, unknown))}")
+
+    paginate = 'limit' in body or 'cursor' in body
+    limit = None
+    after = None
+    if paginate:
+        limit = min(max(int(body.get('limit') or CLIENTS_PAGE_DEFAULT), 1), CLIENTS_PAGE_MAX)
+        after = decode_list_cursor(body['cursor']) if body.get('cursor') else None
+
+    # id и колонка сортировки нужны для курсора, даже если их не запросили
+    select_fields = list(dict.fromkeys(list(fields) + (['id', order_field] if paginate else [])))
+    query_fields = [f for f in select_fields if f not in config['constants']]
+
+    joins = []
+    for field in query_fields:
+        join = CLIENT_LIST_FIELDS[field][1]
+        if join and CLIENT_LIST_JOINS[join] not in joins:
+            joins.append(CLIENT_LIST_JOINS[join])
+
+    query = "SELECT " + ', '.join(CLIENT_LIST_FIELDS[f][0] for f in query_fields)
+    query += " FROM clients c" + ''.join(' ' + join for join in joins)
+    query += " WHERE c.organization_id = %s AND " + config['where']
+    params = [organization_id]
+
+    if action == 'list':
+        for key, column in (('quadrant', 'c.quadrant'), ('matrix_id', 'c.matrix_id'), ('deal_status_id', 'c.deal_status_id')):
+            if body.get(key):
+                query += f" AND {column} = %s"
+                params.append(body[key])
+
+    order_column = CLIENT_LIST_FIELDS[order_field][0]
+    if after:
+        query += f" AND ({order_column}, c.id) < (%s, %s)"
+        params.extend(after)
+
+    if paginate:
+        query += f" ORDER BY {order_column} DESC, c.id DESC LIMIT %s"
+        params.append(limit)
+    else:
+        query += f" ORDER BY {order_column} DESC"
+
+    cur.execute(query, tuple(params))
+    rows = cur.fetchall()
+
+    clients = []
+    for row in rows:
+        values = dict(zip(query_fields, row))
+        clients.append({
+            field: config['constants'][field] if field in config['constants'] else format_list_value(field, values[field])
+            for field in fields
+        })
+
+    result = {'clients': clients}
+    if config['with_count']:
+        result['count'] = len(clients)
+    if paginate:
+        last = dict(zip(query_fields, rows[-1])) if rows else None
+        result['next_cursor'] = encode_list_cursor(last[order_field], last['id']) if last and len(rows) == limit else None
+
+    return result
 
 def handler(event: dict, context) -> dict:
     """API для управления клиентами с оценкой по критериям матрицы"""
@@ -20,38 +195,20 @@ def handler(event: dict, context) -> dict:
             'isBase64Encoded': False
         }
     
-    auth_header = event.get('headers', {}).get('X-Authorization', '')
-    token = auth_header.replace('Bearer ', '') if auth_header else ''
-    if not token:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Токен не предоставлен'}),
-            'isBase64Encoded': False
-        }
-    
     try:
-        secret = os.environ.get('JWT_SECRET')
-        payload = jwt.decode(token, secret, algorithms=['HS256'])
-        user_id = payload['user_id']
-        organization_id = payload['organization_id']
-    except jwt.ExpiredSignatureError:
+        auth = authenticate(event)
+    except AuthError as e:
         return {
             'statusCode': 401,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Токен истёк'}),
-            'isBase64Encoded': False
-        }
-    except jwt.InvalidTokenError:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Неверный токен'}),
+            'body': json.dumps({'error': AUTH_ERRORS[e.reason]}),
             'isBase64Encoded': False
         }
     
-    dsn = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(dsn)
+    user_id = auth.user_id
+    organization_id = auth.organization_id
+    
+    conn = get_db_connection()
     cur = conn.cursor()
     
     try:
@@ -59,65 +216,20 @@ def handler(event: dict, context) -> dict:
         action = body.get('action', 'list')
         
         if action == 'list':
-            quadrant_filter = body.get('quadrant')
-            matrix_filter = body.get('matrix_id')
-            deal_status_filter = body.get('deal_status_id')
-            
-            query = """
-                SELECT c.id, c.company_name, c.contact_person, c.email, c.phone,
-                       c.description, c.score_x, c.score_y, c.quadrant,
-                       c.matrix_id, m.name as matrix_name, c.created_at,
-                       c.deal_status_id, ds.name as deal_status_name, ds.weight as deal_status_weight,
-                       c.responsible_user_id, u.full_name as responsible_user_name
-                FROM clients c
-                LEFT JOIN matrices m ON c.matrix_id = m.id
-                LEFT JOIN deal_statuses ds ON c.deal_status_id = ds.id
-                LEFT JOIN users u ON c.responsible_user_id = u.id
-                WHERE c.organization_id = %s AND c.is_active = true AND c.deleted_at IS NULL
-            """
-            params = [organization_id]
-            
-            if quadrant_filter:
-                query += " AND c.quadrant = %s"
-                params.append(quadrant_filter)
-            if matrix_filter:
-                query += " AND c.matrix_id = %s"
-                params.append(matrix_filter)
-            if deal_status_filter:
-                query += " AND c.deal_status_id = %s"
-                params.append(deal_status_filter)
-            
-            query += " ORDER BY c.created_at DESC"
-            
-            cur.execute(query, tuple(params))
-            rows = cur.fetchall()
-            
-            clients = []
-            for row in rows:
-                clients.append({
-                    'id': row[0],
-                    'company_name': row[1],
-                    'contact_person': row[2],
-                    'email': row[3],
-                    'phone': row[4],
-                    'description': row[5],
-                    'score_x': float(row[6]) if row[6] else 0,
-                    'score_y': float(row[7]) if row[7] else 0,
-                    'quadrant': row[8],
-                    'matrix_id': row[9],
-                    'matrix_name': row[10],
-                    'created_at': row[11].isoformat() if row[11] else None,
-                    'deal_status_id': row[12],
-                    'deal_status_name': row[13],
-                    'deal_status_weight': row[14],
-                    'responsible_user_id': row[15],
-                    'responsible_user_name': row[16]
-                })
+            try:
+                result = list_clients(cur, organization_id, action, body)
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': str(e)}),
+                    'isBase64Encoded': False
+                }
             
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'clients': clients}),
+                'body': json.dumps(result),
                 'isBase64Encoded': False
             }
         
@@ -218,6 +330,16 @@ def handler(event: dict, context) -> dict:
             
             deal_status_id = body.get('deal_status_id')
             
+            try:
+                reserve_usage(cur, organization_id, 'clients')
+            except UsageLimitExceeded as e:
+                return {
+                    'statusCode': 403,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': str(e)}),
+                    'isBase64Encoded': False
+                }
+            
             cur.execute("""
                 INSERT INTO clients (organization_id, matrix_id, company_name, contact_person, 
                                      email, phone, description, notes, deal_status_id, created_by, responsible_user_id)
@@ -251,8 +373,7 @@ def handler(event: dict, context) -> dict:
                 """, (client_id, criterion_id, score, comment))
             
             if matrix_id and scores:
-                score_x, score_y = calculate_scores(cur, client_id)
-                quadrant = determine_quadrant(cur, matrix_id, score_x, score_y)
+                score_x, score_y, quadrant = calculate_client_scores(cur, client_id, matrix_id, cached_matrix_definition(cur, matrix_id))
                 
                 cur.execute("""
                     UPDATE clients 
@@ -260,6 +381,8 @@ def handler(event: dict, context) -> dict:
                     WHERE id = %s
                 """, (score_x, score_y, quadrant, client_id))
             
+            add_clients_to_stats(cur, [client_id])
+            
             conn.commit()
             
             return {
@@ -292,6 +415,8 @@ def handler(event: dict, context) -> dict:
                     'isBase64Encoded': False
                 }
             
+            stats_before = client_stats_snapshot(cur, [client_id], lock=True)
+            
             update_fields = []
             update_values = []
             
@@ -345,8 +470,7 @@ def handler(event: dict, context) -> dict:
                 cur.execute("SELECT matrix_id FROM clients WHERE id = %s", (client_id,))
                 client_matrix_id = cur.fetchone()[0]
                 
-                score_x, score_y = calculate_scores(cur, client_id)
-                quadrant = determine_quadrant(cur, client_matrix_id, score_x, score_y) if client_matrix_id else None
+                score_x, score_y, quadrant = calculate_client_scores(cur, client_id, client_matrix_id, cached_matrix_definition(cur, client_matrix_id))
                 
                 cur.execute("""
                     UPDATE clients 
@@ -354,6 +478,8 @@ def handler(event: dict, context) -> dict:
                     WHERE id = %s
                 """, (score_x, score_y, quadrant, client_id))
             
+            record_client_stats_change(cur, stats_before, client_stats_snapshot(cur, [client_id]))
+            
             conn.commit()
             
             return {
@@ -390,6 +516,7 @@ def handler(event: dict, context) -> dict:
                 }
             
             matrix_id = client_row[1]
+            stats_before = client_stats_snapshot(cur, [client_id], lock=True)
             
             for score_item in scores:
                 criterion_id = score_item.get('criterion_id')
@@ -403,8 +530,7 @@ def handler(event: dict, context) -> dict:
                     DO UPDATE SET score = %s, comment = %s, updated_at = CURRENT_TIMESTAMP
                 """, (client_id, criterion_id, score, comment, score, comment))
             
-            score_x, score_y = calculate_scores(cur, client_id)
-            quadrant = determine_quadrant(cur, matrix_id, score_x, score_y)
+            score_x, score_y, quadrant = calculate_client_scores(cur, client_id, matrix_id, cached_matrix_definition(cur, matrix_id))
             
             cur.execute("""
                 UPDATE clients 
@@ -412,6 +538,8 @@ def handler(event: dict, context) -> dict:
                 WHERE id = %s
             """, (score_x, score_y, quadrant, client_id))
             
+            record_client_stats_change(cur, stats_before, client_stats_snapshot(cur, [client_id]))
+            
             conn.commit()
             
             return {
@@ -436,11 +564,21 @@ def handler(event: dict, context) -> dict:
                     'isBase64Encoded': False
                 }
             
+            stats_before = client_stats_snapshot(cur, [client_id], lock=True)
+            
             cur.execute("""
                 UPDATE clients SET deleted_at = CURRENT_TIMESTAMP 
                 WHERE id = %s AND organization_id = %s AND deleted_at IS NULL
+                RETURNING is_active
             """, (client_id, organization_id))
             
+            # Клиент в корзине не занимает место в лимите тарифа
+            row = cur.fetchone()
+            if row and row[0]:
+                release_usage(cur, organization_id, 'clients')
+            
+            record_client_stats_change(cur, stats_before, client_stats_snapshot(cur, [client_id]))
+            
             conn.commit()
             
             return {
@@ -451,85 +589,38 @@ def handler(event: dict, context) -> dict:
             }
         
         elif action == 'list_unrated':
-            cur.execute("""
-                SELECT c.id, c.company_name, c.contact_person, c.email, c.phone,
-                       c.description, c.created_at, c.deal_status_id,
-                       ds.name as deal_status_name, ds.weight as deal_status_weight
-                FROM clients c
-                LEFT JOIN deal_statuses ds ON c.deal_status_id = ds.id
-                WHERE c.organization_id = %s AND c.is_active = true AND c.deleted_at IS NULL 
-                      AND (c.matrix_id IS NULL OR (c.matrix_id IS NOT NULL AND c.score_x = 0 AND c.score_y = 0))
-                ORDER BY c.created_at DESC
-            """, (organization_id,))
-            
-            rows = cur.fetchall()
-            
-            clients = []
-            for row in rows:
-                clients.append({
-                    'id': row[0],
-                    'company_name': row[1],
-                    'contact_person': row[2],
-                    'email': row[3],
-                    'phone': row[4],
-                    'description': row[5],
-                    'created_at': row[6].isoformat() if row[6] else None,
-                    'deal_status_id': row[7],
-                    'deal_status_name': row[8],
-                    'deal_status_weight': row[9],
-                    'matrix_id': None,
-                    'matrix_name': None,
-                    'score_x': 0,
-                    'score_y': 0,
-                    'quadrant': None
-                })
+            try:
+                result = list_clients(cur, organization_id, action, body)
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': str(e)}),
+                    'isBase64Encoded': False
+                }
             
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'clients': clients, 'count': len(clients)}),
+                'body': json.dumps(result),
                 'isBase64Encoded': False
             }
         
         elif action == 'list_deleted':
-            cur.execute("""
-                SELECT c.id, c.company_name, c.contact_person, c.email, c.phone,
-                       c.description, c.score_x, c.score_y, c.quadrant,
-                       c.matrix_id, m.name as matrix_name, c.deleted_at,
-                       c.deal_status_id, ds.name as deal_status_name, ds.weight as deal_status_weight
-                FROM clients c
-                LEFT JOIN matrices m ON c.matrix_id = m.id
-                LEFT JOIN deal_statuses ds ON c.deal_status_id = ds.id
-                WHERE c.organization_id = %s AND c.deleted_at IS NOT NULL
-                ORDER BY c.deleted_at DESC
-            """, (organization_id,))
-            
-            rows = cur.fetchall()
-            
-            clients = []
-            for row in rows:
-                clients.append({
-                    'id': row[0],
-                    'company_name': row[1],
-                    'contact_person': row[2],
-                    'email': row[3],
-                    'phone': row[4],
-                    'description': row[5],
-                    'score_x': float(row[6]) if row[6] else 0,
-                    'score_y': float(row[7]) if row[7] else 0,
-                    'quadrant': row[8],
-                    'matrix_id': row[9],
-                    'matrix_name': row[10],
-                    'deleted_at': row[11].isoformat() if row[11] else None,
-                    'deal_status_id': row[12],
-                    'deal_status_name': row[13],
-                    'deal_status_weight': row[14]
-                })
+            try:
+                result = list_clients(cur, organization_id, action, body)
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': str(e)}),
+                    'isBase64Encoded': False
+                }
             
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'clients': clients, 'count': len(clients)}),
+                'body': json.dumps(result),
                 'isBase64Encoded': False
             }
         
@@ -546,9 +637,11 @@ def handler(event: dict, context) -> dict:
             cur.execute("""
                 UPDATE clients SET deleted_at = NULL 
                 WHERE id = %s AND organization_id = %s AND deleted_at IS NOT NULL
+                RETURNING is_active
             """, (client_id, organization_id))
+            row = cur.fetchone()
             
-            if cur.rowcount == 0:
+            if row is None:
                 return {
                     'statusCode': 404,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -556,6 +649,20 @@ def handler(event: dict, context) -> dict:
                     'isBase64Encoded': False
                 }
             
+            if row[0]:
+                try:
+                    reserve_usage(cur, organization_id, 'clients')
+                except UsageLimitExceeded as e:
+                    conn.rollback()
+                    return {
+                        'statusCode': 403,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': str(e)}),
+                        'isBase64Encoded': False
+                    }
+            
+            add_clients_to_stats(cur, [client_id])
+            
             conn.commit()
             
             return {
@@ -590,12 +697,16 @@ def handler(event: dict, context) -> dict:
                     'isBase64Encoded': False
                 }
             
+            stats_before = client_stats_snapshot(cur, [client_id], lock=True)
+            
             cur.execute("""
                 UPDATE clients 
                 SET deal_status_id = %s, updated_at = CURRENT_TIMESTAMP
                 WHERE id = %s
             """, (deal_status_id, client_id))
             
+            record_client_stats_change(cur, stats_before, client_stats_snapshot(cur, [client_id]))
+            
             conn.commit()
             
             return {
@@ -605,6 +716,16 @@ def handler(event: dict, context) -> dict:
                 'isBase64Encoded': False
             }
         
+        elif action == 'stats':
+            stats = load_client_stats(cur, organization_id, body.get('matrix_id'))
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'stats': stats}),
+                'isBase64Encoded': False
+            }
+        
         else:
             return {
                 'statusCode': 400,
@@ -624,67 +745,3 @@ def handler(event: dict, context) -> dict:
     finally:
         cur.close()
         conn.close()
-
-
-def calculate_scores(cur, client_id: int) -> tuple:
-    """Рассчитывает итоговые оценки по осям X и Y на основе критериев с взвешенной суммой"""
-    cur.execute("""
-        SELECT mc.axis, cs.score, mc.weight, mc.max_value
-        FROM client_scores cs
-        JOIN matrix_criteria mc ON cs.criterion_id = mc.id
-        WHERE cs.client_id = %s AND mc.axis IN ('x', 'y')
-    """ % client_id)
-    
-    rows = cur.fetchall()
-    
-    x_weighted_sum = 0
-    x_max_possible = 0
-    y_weighted_sum = 0
-    y_max_possible = 0
-    
-    for row in rows:
-        axis = row[0]
-        score = float(row[1])
-        weight = float(row[2])
-        max_value = float(row[3])
-        
-        weighted_score = score * weight
-        max_weighted = max_value * weight
-        
-        if axis == 'x':
-            x_weighted_sum += weighted_score
-            x_max_possible += max_weighted
-        elif axis == 'y':
-            y_weighted_sum += weighted_score
-            y_max_possible += max_weighted
-    
-    score_x = (x_weighted_sum / x_max_possible * 10) if x_max_possible > 0 else 0
-    score_y = (y_weighted_sum / y_max_possible * 10) if y_max_possible > 0 else 0
-    
-    return round(score_x, 2), round(score_y, 2)
-
-
-def determine_quadrant(cur, matrix_id: int, score_x: float, score_y: float) -> str:
-    """Определяет квадрант на основе правил матрицы (гибкая логика)"""
-    cur.execute("""
-        SELECT quadrant, x_min, y_min, x_operator
-        FROM matrix_quadrant_rules
-        WHERE matrix_id = %s
-        ORDER BY priority ASC
-    """, (matrix_id,))
-    
-    rules = cur.fetchall()
-    
-    for rule in rules:
-        quadrant, x_min, y_min, x_operator = rule
-        x_min = float(x_min)
-        y_min = float(y_min)
-        
-        if x_operator == 'AND':
-            if score_x >= x_min and score_y >= y_min:
-                return quadrant
-        else:  # OR
-            if score_x >= x_min or score_y >= y_min:
-                return quadrant
-    
-    return 'archive'  # fallback на случай если правил нет
\ No newline at end of file
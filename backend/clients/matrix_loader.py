@@ -0,0 +1,162 @@
+"""
+Загрузка критериев матрицы со статусами и правил квадрантов за фиксированное
+число запросов, без запроса на каждый критерий.
+Одинаковая копия модуля лежит в clients, import, matrices и telegram-bot:
+функции деплоятся независимо.
+
+Определения матриц кэшируются в процессе по (matrix_id, definition_version).
+Любая запись в критерии, статусы или правила квадрантов должна вызывать
+bump_matrix_version() в той же транзакции - иначе кэш не увидит изменений.
+"""
+import copy
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from scoring import load_matrix_definition
+
+MATRIX_CACHE_SIZE = int(os.environ.get('MATRIX_CACHE_SIZE', '128'))
+
+_cache: 'OrderedDict[tuple, object]' = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def load_matrix_criteria(cur, matrix_id: int) -> List[dict]:
+    """
+    Критерии матрицы (по axis, sort_order) со списком статусов в каждом.
+    Два запроса: критерии и статусы всех критериев через criterion_id = ANY.
+    """
+    cur.execute(
+        """
+        SELECT id, axis, name, description, weight, min_value, max_value, sort_order
+        FROM matrix_criteria
+        WHERE matrix_id = %s
+        ORDER BY axis, sort_order
+        """,
+        (matrix_id,)
+    )
+
+    criteria = []
+    by_id: Dict[int, dict] = {}
+    for row in cur.fetchall():
+        criterion = {
+            'id': row[0],
+            'axis': row[1],
+            'name': row[2],
+            'description': row[3],
+            'weight': row[4],
+            'min_value': row[5],
+            'max_value': row[6],
+            'sort_order': row[7],
+            'statuses': []
+        }
+        criteria.append(criterion)
+        by_id[criterion['id']] = criterion
+
+    if not by_id:
+        return criteria
+
+    cur.execute(
+        """
+        SELECT criterion_id, id, label, weight, sort_order
+        FROM criterion_statuses
+        WHERE criterion_id = ANY(%s)
+        ORDER BY criterion_id, sort_order
+        """,
+        (list(by_id),)
+    )
+
+    for criterion_id, status_id, label, weight, sort_order in cur.fetchall():
+        by_id[criterion_id]['statuses'].append({
+            'id': status_id,
+            'label': label,
+            'weight': weight,
+            'sort_order': sort_order
+        })
+
+    return criteria
+
+
+def load_quadrant_rules(cur, matrix_id: int) -> List[dict]:
+    """Правила квадрантов матрицы в порядке priority"""
+    cur.execute(
+        """
+        SELECT quadrant, x_min, y_min, x_operator, priority
+        FROM matrix_quadrant_rules
+        WHERE matrix_id = %s
+        ORDER BY priority
+        """,
+        (matrix_id,)
+    )
+
+    return [
+        {
+            'quadrant': row[0],
+            'x_min': float(row[1]),
+            'y_min': float(row[2]),
+            'x_operator': row[3],
+            'priority': row[4]
+        }
+        for row in cur.fetchall()
+    ]
+
+
+def get_matrix_version(cur, matrix_id: int) -> Optional[int]:
+    """Текущая версия определения матрицы, None если матрицы нет"""
+    cur.execute("SELECT definition_version FROM matrices WHERE id = %s", (matrix_id,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def bump_matrix_version(cur, matrix_id: int):
+    """Инвалидировать закэшированные определения матрицы во всех процессах"""
+    cur.execute(
+        """
+        UPDATE matrices
+        SET definition_version = definition_version + 1, updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s
+        """,
+        (matrix_id,)
+    )
+
+
+def _cached(cur, kind: str, matrix_id: int, loader, version: Optional[int] = None):
+    """LRU-кэш по (kind, matrix_id, version); версия проверяется одним запросом"""
+    if version is None:
+        version = get_matrix_version(cur, matrix_id)
+        if version is None:
+            return loader(cur, matrix_id)
+
+    key = (kind, matrix_id, version)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    value = loader(cur, matrix_id)
+
+    with _cache_lock:
+        _cache[key] = value
+        _cache.move_to_end(key)
+        while len(_cache) > MATRIX_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+    return value
+
+
+def cached_matrix_definition(cur, matrix_id: Optional[int], version: Optional[int] = None) -> Optional[dict]:
+    """Определение для scoring (критерии и правила) из кэша; без матрицы - None"""
+    if not matrix_id:
+        return None
+    return _cached(cur, 'definition', matrix_id, load_matrix_definition, version)
+
+
+def cached_matrix_criteria(cur, matrix_id: int, version: Optional[int] = None) -> List[dict]:
+    """Критерии со статусами из кэша; возвращается копия, её можно изменять"""
+    return copy.deepcopy(_cached(cur, 'criteria', matrix_id, load_matrix_criteria, version))
+
+
+def cached_quadrant_rules(cur, matrix_id: int, version: Optional[int] = None) -> List[dict]:
+    """Правила квадрантов из кэша; возвращается копия, её можно изменять"""
+    return copy.deepcopy(_cached(cur, 'rules', matrix_id, load_quadrant_rules, version))
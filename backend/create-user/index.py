@@ -3,12 +3,12 @@ API для создания новых пользователей в орган
 Только для owner и admin с правами на приглашение пользователей.
 """
 import json
-import os
-import jwt
 import bcrypt
-import psycopg2
 import secrets
 import string
+from db import get_db_connection
+from auth import authenticate, AuthError
+from usage_limits import reserve_usage, UsageLimitExceeded
 
 
 def hash_password(password: str) -> str:
@@ -21,19 +21,6 @@ def generate_password(length: int = 12) -> str:
     return ''.join(secrets.choice(alphabet) for _ in range(length))
 
 
-def verify_jwt_token(token: str) -> dict:
-    try:
-        secret = os.environ.get('JWT_SECRET')
-        return jwt.decode(token, secret, algorithms=['HS256'])
-    except:
-        return None
-
-
-def get_db_connection():
-    dsn = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(dsn)
-
-
 def handler(event: dict, context) -> dict:
     """
     Создание нового пользователя в организации.
@@ -59,27 +46,18 @@ def handler(event: dict, context) -> dict:
             'body': json.dumps({'error': 'Method not allowed'})
         }
     
-    auth_header = event.get('headers', {}).get('X-Authorization', '')
-    token = auth_header.replace('Bearer ', '') if auth_header else ''
-    
-    if not token:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Unauthorized'})
-        }
-    
-    payload = verify_jwt_token(token)
-    if not payload:
+    try:
+        auth = authenticate(event)
+    except AuthError as e:
         return {
             'statusCode': 401,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Invalid token'})
+            'body': json.dumps({'error': 'Unauthorized' if e.reason == 'missing' else 'Invalid token'})
         }
     
-    user_id = payload.get('user_id')
-    organization_id = payload.get('organization_id')
-    user_role = payload.get('role')
+    user_id = auth.user_id
+    organization_id = auth.organization_id
+    user_role = auth.role
     
     if user_role not in ['owner', 'admin']:
         return {
@@ -107,40 +85,27 @@ def handler(event: dict, context) -> dict:
         cur = conn.cursor()
         
         try:
-            cur.execute(
-                """
-                SELECT users_limit, 
-                       (SELECT COUNT(*) FROM users WHERE organization_id = %s AND is_active = true) as current_users
-                FROM organizations 
-                WHERE id = %s
-                """ % (organization_id, organization_id)
-            )
-            result = cur.fetchone()
-            
-            if not result:
+            cur.execute("SELECT id FROM users WHERE username = '%s'" % username)
+            if cur.fetchone():
                 return {
-                    'statusCode': 404,
+                    'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Организация не найдена'})
+                    'body': json.dumps({'error': 'Username уже занят'})
                 }
             
-            users_limit, current_users = result
-            
-            if current_users >= users_limit:
+            try:
+                reserve_usage(cur, organization_id, 'users')
+            except UsageLimitExceeded as e:
                 return {
                     'statusCode': 403,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'error': f'Достигнут лимит пользователей ({users_limit}). Обновите тариф.'
-                    })
+                    'body': json.dumps({'error': str(e)})
                 }
-            
-            cur.execute("SELECT id FROM users WHERE username = '%s'" % username)
-            if cur.fetchone():
+            except LookupError as e:
                 return {
-                    'statusCode': 400,
+                    'statusCode': 404,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Username уже занят'})
+                    'body': json.dumps({'error': str(e)})
                 }
             
             password_hash = hash_password(password)
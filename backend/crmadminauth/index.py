@@ -6,13 +6,8 @@ import json
 import os
 import jwt
 import bcrypt
-import psycopg2
 from datetime import datetime, timedelta
-
-
-def get_db_connection():
-    dsn = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(dsn)
+from db import get_db_connection
 
 
 def verify_admin_password(username: str, password: str) -> dict:
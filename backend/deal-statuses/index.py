@@ -1,8 +1,7 @@
 """API для получения списка статусов сделок организации"""
 import json
-import os
-import psycopg2
-import jwt
+from db import get_db_connection
+from auth import authenticate, AuthError
 
 def handler(event: dict, context) -> dict:
     """Получение списка статусов сделок"""
@@ -20,29 +19,19 @@ def handler(event: dict, context) -> dict:
             'isBase64Encoded': False
         }
     
-    token = event.get('headers', {}).get('X-Authorization', '').replace('Bearer ', '')
-    if not token:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Authorization required'}),
-            'isBase64Encoded': False
-        }
-    
     try:
-        secret = os.environ.get('JWT_SECRET')
-        payload = jwt.decode(token, secret, algorithms=['HS256'])
-        organization_id = payload['organization_id']
-    except:
+        auth = authenticate(event)
+    except AuthError as e:
         return {
             'statusCode': 401,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Invalid token'}),
+            'body': json.dumps({'error': 'Authorization required' if e.reason == 'missing' else 'Invalid token'}),
             'isBase64Encoded': False
         }
     
-    dsn = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(dsn)
+    organization_id = auth.organization_id
+    
+    conn = get_db_connection()
     cur = conn.cursor()
     
     try:
@@ -2,12 +2,29 @@
 Экспорт данных клиентов в различные форматы
 """
 import json
-import os
 import csv
 import io
 import base64
+import itertools
+import tempfile
 from datetime import datetime
-import psycopg2
+from db import get_db_connection
+from auth import authenticate, AuthError
+
+EXPORT_CHUNK_ROWS = 5000
+EXPORT_FETCH_SIZE = 1000
+
+CSV_HEADERS = [
+    'Компания', 'Контактное лицо', 'Email', 'Телефон', 'Описание',
+    'Влияние (X)', 'Зрелость (Y)', 'Квадрант', 'Матрица', 'Дата создания'
+]
+
+QUADRANT_NAMES = {
+    'focus': 'Фокус сейчас',
+    'grow': 'Выращивать',
+    'monitor': 'Мониторить',
+    'archive': 'Архив'
+}
 
 def handler(event: dict, context) -> dict:
     """API для экспорта клиентов в CSV и другие форматы"""
@@ -26,28 +43,18 @@ def handler(event: dict, context) -> dict:
             'isBase64Encoded': False
         }
     
-    token = event.get('headers', {}).get('X-Authorization', '').replace('Bearer ', '')
-    if not token:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Требуется авторизация'}),
-            'isBase64Encoded': False
-        }
-    
     try:
-        import jwt
-        secret = os.environ.get('JWT_SECRET')
-        payload = jwt.decode(token, secret, algorithms=['HS256'])
-        organization_id = payload['organization_id']
-    except:
+        auth = authenticate(event)
+    except AuthError as e:
         return {
             'statusCode': 401,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Неверный токен'}),
+            'body': json.dumps({'error': 'Требуется авторизация' if e.reason == 'missing' else 'Неверный токен'}),
             'isBase64Encoded': False
         }
     
+    organization_id = auth.organization_id
+    
     if method != 'POST':
         return {
             'statusCode': 405,
@@ -83,14 +90,12 @@ def handler(event: dict, context) -> dict:
             'isBase64Encoded': False
         }
 
-def export_csv(organization_id: int, body: dict) -> dict:
-    """Экспорт клиентов в CSV формат"""
-    quadrant = body.get('quadrant')
-    matrix_id = body.get('matrix_id')
-    
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor()
-    
+def build_export_query(organization_id: int, body: dict, after: list = None, limit: int = None) -> tuple:
+    """
+    Запрос выгрузки клиентов с фильтрами и keyset-пагинацией.
+    Порядок (score_x DESC, score_y DESC, id DESC), after - позиция последней
+    выгруженной строки. Колонки 0-9 - данные, 10 - id клиента.
+    """
     query = """
         SELECT 
             c.company_name,
@@ -102,49 +107,84 @@ def export_csv(organization_id: int, body: dict) -> dict:
             c.score_y,
             c.quadrant,
             m.name as matrix_name,
-            c.created_at
+            c.created_at,
+            c.id
         FROM clients c
         LEFT JOIN matrices m ON c.matrix_id = m.id
-        WHERE c.organization_id = {org_id}
-    """.format(org_id=organization_id)
-    
-    conditions = []
-    if quadrant:
-        conditions.append("c.quadrant = '{}'".format(quadrant))
-    if matrix_id:
-        conditions.append("c.matrix_id = {}".format(matrix_id))
+        WHERE c.organization_id = %s
+    """
+    params = [organization_id]
+    
+    if body.get('quadrant'):
+        query += " AND c.quadrant = %s"
+        params.append(body['quadrant'])
+    if body.get('matrix_id'):
+        query += " AND c.matrix_id = %s"
+        params.append(body['matrix_id'])
+    if after:
+        query += " AND (COALESCE(c.score_x, 0), COALESCE(c.score_y, 0), c.id) < (%s, %s, %s)"
+        params.extend(after)
+    
+    query += " ORDER BY COALESCE(c.score_x, 0) DESC, COALESCE(c.score_y, 0) DESC, c.id DESC"
+    
+    if limit:
+        query += " LIMIT %s"
+        params.append(limit)
+    
+    return query, params
+
+def iter_export_rows(conn, organization_id: int, body: dict, after: list = None, limit: int = None):
+    """Построчное чтение выгрузки через серверный (именованный) курсор пачками"""
+    query, params = build_export_query(organization_id, body, after, limit)
     
-    if conditions:
-        query += " AND " + " AND ".join(conditions)
+    cur = conn.cursor(name='clients_export')
+    cur.itersize = EXPORT_FETCH_SIZE
     
-    query += " ORDER BY c.score_x DESC, c.score_y DESC"
+    try:
+        cur.execute(query, params)
+        for row in cur:
+            yield row
+    finally:
+        cur.close()
+
+def encode_export_cursor(row: tuple) -> str:
+    """Токен продолжения выгрузки по последней отданной строке"""
+    position = [str(row[5] or 0), str(row[6] or 0), row[10]]
+    return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('utf-8')
+
+def decode_export_cursor(token: str) -> list:
+    """Разбор токена продолжения, ValueError если токен испорчен"""
+    try:
+        score_x, score_y, client_id = json.loads(base64.urlsafe_b64decode(token.encode('utf-8')))
+        return [str(float(score_x)), str(float(score_y)), int(client_id)]
+    except Exception:
+        raise ValueError('Неверный cursor')
+
+def csv_row(row: tuple) -> list:
+    """Строка CSV/Excel из строки выгрузки"""
+    return [
+        row[0], row[1], row[2], row[3], row[4],
+        row[5], row[6], QUADRANT_NAMES.get(row[7], row[7]), row[8], row[9]
+    ]
+
+def export_csv(organization_id: int, body: dict) -> dict:
+    """Экспорт клиентов в CSV формат"""
+    if body.get('stream') or body.get('cursor'):
+        return export_csv_chunk(organization_id, body)
     
-    cur.execute(query)
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    conn = get_db_connection()
     
     output = io.StringIO()
     writer = csv.writer(output)
+    writer.writerow(CSV_HEADERS)
     
-    writer.writerow([
-        'Компания', 'Контактное лицо', 'Email', 'Телефон', 'Описание',
-        'Влияние (X)', 'Зрелость (Y)', 'Квадрант', 'Матрица', 'Дата создания'
-    ])
-    
-    for row in rows:
-        quadrant_names = {
-            'focus': 'Фокус сейчас',
-            'grow': 'Выращивать',
-            'monitor': 'Мониторить',
-            'archive': 'Архив'
-        }
-        quadrant_name = quadrant_names.get(row[7], row[7])
-        
-        writer.writerow([
-            row[0], row[1], row[2], row[3], row[4],
-            row[5], row[6], quadrant_name, row[8], row[9]
-        ])
+    total = 0
+    try:
+        for row in iter_export_rows(conn, organization_id, body):
+            writer.writerow(csv_row(row))
+            total += 1
+    finally:
+        conn.close()
     
     csv_content = output.getvalue()
     csv_base64 = base64.b64encode(csv_content.encode('utf-8-sig')).decode('utf-8')
@@ -160,126 +200,145 @@ def export_csv(organization_id: int, body: dict) -> dict:
         'body': json.dumps({
             'filename': filename,
             'content': csv_base64,
-            'total': len(rows)
+            'total': total
         }),
         'isBase64Encoded': False
     }
 
-def export_excel(organization_id: int, body: dict) -> dict:
-    """Экспорт клиентов в Excel формат"""
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment
+def export_csv_chunk(organization_id: int, body: dict) -> dict:
+    """
+    Потоковый экспорт CSV частями по EXPORT_CHUNK_ROWS строк.
+    Первый вызов (без cursor) отдаёт BOM и заголовок, следующие - только строки.
+    Клиент склеивает декодированные части, пока next_cursor не станет null.
+    """
+    cursor_token = body.get('cursor')
     
-    quadrant = body.get('quadrant')
-    matrix_id = body.get('matrix_id')
+    try:
+        after = decode_export_cursor(cursor_token) if cursor_token else None
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor()
+    conn = get_db_connection()
     
-    query = """
-        SELECT 
-            c.company_name,
-            c.contact_person,
-            c.email,
-            c.phone,
-            c.description,
-            c.score_x,
-            c.score_y,
-            c.quadrant,
-            m.name as matrix_name,
-            c.created_at
-        FROM clients c
-        LEFT JOIN matrices m ON c.matrix_id = m.id
-        WHERE c.organization_id = {org_id}
-    """.format(org_id=organization_id)
-    
-    conditions = []
-    if quadrant:
-        conditions.append("c.quadrant = '{}'".format(quadrant))
-    if matrix_id:
-        conditions.append("c.matrix_id = {}".format(matrix_id))
+    output = io.StringIO()
+    writer = csv.writer(output)
+    if not after:
+        writer.writerow(CSV_HEADERS)
     
-    if conditions:
-        query += " AND " + " AND ".join(conditions)
+    rows_count = 0
+    last_row = None
+    try:
+        for row in iter_export_rows(conn, organization_id, body, after, EXPORT_CHUNK_ROWS):
+            writer.writerow(csv_row(row))
+            rows_count += 1
+            last_row = row
+    finally:
+        conn.close()
     
-    query += " ORDER BY c.score_x DESC, c.score_y DESC"
+    encoding = 'utf-8' if after else 'utf-8-sig'
+    chunk_base64 = base64.b64encode(output.getvalue().encode(encoding)).decode('utf-8')
+    next_cursor = encode_export_cursor(last_row) if rows_count == EXPORT_CHUNK_ROWS else None
     
-    cur.execute(query)
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    filename = 'clients_export_{}.csv'.format(datetime.now().strftime('%Y%m%d_%H%M%S'))
     
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Клиенты"
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps({
+            'filename': filename,
+            'content': chunk_base64,
+            'rows': rows_count,
+            'next_cursor': next_cursor,
+            'done': next_cursor is None
+        }),
+        'isBase64Encoded': False
+    }
+
+def export_excel(organization_id: int, body: dict) -> dict:
+    """
+    Экспорт клиентов в Excel формат в write-only режиме openpyxl:
+    строки пишутся сразу из серверного курсора, без модели всех ячеек.
+    Ширина колонок считается по заголовку и первой пачке строк.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, PatternFill, Alignment
+    from openpyxl.utils import get_column_letter
     
-    headers = [
-        'Компания', 'Контактное лицо', 'Email', 'Телефон', 'Описание',
-        'Влияние (X)', 'Зрелость (Y)', 'Квадрант', 'Матрица', 'Дата создания'
-    ]
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Клиенты")
     
     header_fill = PatternFill(start_color="3B82F6", end_color="3B82F6", fill_type="solid")
     header_font = Font(bold=True, color="FFFFFF")
     header_alignment = Alignment(horizontal="center", vertical="center")
     
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col_num)
-        cell.value = header
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = header_alignment
-    
-    quadrant_names = {
-        'focus': 'Фокус сейчас',
-        'grow': 'Выращивать',
-        'monitor': 'Мониторить',
-        'archive': 'Архив'
-    }
-    
     quadrant_colors = {
         'focus': PatternFill(start_color="10B981", end_color="10B981", fill_type="solid"),
         'grow': PatternFill(start_color="3B82F6", end_color="3B82F6", fill_type="solid"),
         'monitor': PatternFill(start_color="F59E0B", end_color="F59E0B", fill_type="solid"),
         'archive': PatternFill(start_color="6B7280", end_color="6B7280", fill_type="solid")
     }
+    quadrant_font = Font(color="FFFFFF", bold=True)
+    quadrant_alignment = Alignment(horizontal="center")
     
-    for row_num, row_data in enumerate(rows, 2):
-        quadrant = row_data[7]
-        quadrant_name = quadrant_names.get(quadrant, quadrant)
-        
-        ws.cell(row=row_num, column=1, value=row_data[0])
-        ws.cell(row=row_num, column=2, value=row_data[1])
-        ws.cell(row=row_num, column=3, value=row_data[2])
-        ws.cell(row=row_num, column=4, value=row_data[3])
-        ws.cell(row=row_num, column=5, value=row_data[4])
-        ws.cell(row=row_num, column=6, value=row_data[5])
-        ws.cell(row=row_num, column=7, value=row_data[6])
+    def header_cell(value):
+        cell = WriteOnlyCell(ws, value=value)
+        cell.fill = header_fill
+        cell.font = header_font
+        cell.alignment = header_alignment
+        return cell
+    
+    def excel_cells(row):
+        values = csv_row(row)
+        values[9] = str(values[9]) if values[9] is not None else None
         
-        quadrant_cell = ws.cell(row=row_num, column=8, value=quadrant_name)
+        quadrant = row[7]
         if quadrant in quadrant_colors:
+            quadrant_cell = WriteOnlyCell(ws, value=values[7])
             quadrant_cell.fill = quadrant_colors[quadrant]
-            quadrant_cell.font = Font(color="FFFFFF", bold=True)
-            quadrant_cell.alignment = Alignment(horizontal="center")
+            quadrant_cell.font = quadrant_font
+            quadrant_cell.alignment = quadrant_alignment
+            values[7] = quadrant_cell
+        
+        return values
+    
+    conn = get_db_connection()
+    
+    total = 0
+    try:
+        rows = iter_export_rows(conn, organization_id, body)
+        sample = list(itertools.islice(rows, EXPORT_FETCH_SIZE))
+        
+        widths = [len(header) for header in CSV_HEADERS]
+        for row in sample:
+            for idx, value in enumerate(csv_row(row)):
+                if value is not None:
+                    widths[idx] = max(widths[idx], len(str(value)))
         
-        ws.cell(row=row_num, column=9, value=row_data[8])
-        ws.cell(row=row_num, column=10, value=str(row_data[9]))
-    
-    for col in ws.columns:
-        max_length = 0
-        column = col[0].column_letter
-        for cell in col:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = min(max_length + 2, 50)
-        ws.column_dimensions[column].width = adjusted_width
-    
-    excel_buffer = io.BytesIO()
-    wb.save(excel_buffer)
-    excel_content = excel_buffer.getvalue()
-    excel_base64 = base64.b64encode(excel_content).decode('utf-8')
+        # В write-only режиме размеры колонок задаются до первой строки
+        for idx, width in enumerate(widths, 1):
+            ws.column_dimensions[get_column_letter(idx)].width = min(width + 2, 50)
+        
+        ws.append([header_cell(header) for header in CSV_HEADERS])
+        
+        for row in itertools.chain(sample, rows):
+            ws.append(excel_cells(row))
+            total += 1
+    finally:
+        conn.close()
+    
+    with tempfile.TemporaryFile(suffix='.xlsx') as excel_file:
+        wb.save(excel_file)
+        excel_file.seek(0)
+        excel_base64 = base64.b64encode(excel_file.read()).decode('utf-8')
     
     filename = 'clients_export_{}.xlsx'.format(datetime.now().strftime('%Y%m%d_%H%M%S'))
     
@@ -292,55 +351,86 @@ def export_excel(organization_id: int, body: dict) -> dict:
         'body': json.dumps({
             'filename': filename,
             'content': excel_base64,
-            'total': len(rows)
+            'total': total
         }),
         'isBase64Encoded': False
     }
 
-def export_bitrix(organization_id: int, body: dict) -> dict:
-    """Экспорт в формат Bitrix24"""
-    quadrant = body.get('quadrant')
+def to_bitrix_lead(row: tuple) -> dict:
+    """Лид Bitrix24 из строки выгрузки"""
+    return {
+        'TITLE': row[0],
+        'NAME': row[1],
+        'EMAIL': [{'VALUE': row[2], 'VALUE_TYPE': 'WORK'}] if row[2] else [],
+        'PHONE': [{'VALUE': row[3], 'VALUE_TYPE': 'WORK'}] if row[3] else [],
+        'COMMENTS': row[4],
+        'UF_CRM_SCORE_X': row[5],
+        'UF_CRM_SCORE_Y': row[6],
+        'UF_CRM_QUADRANT': row[7],
+        'UF_CRM_MATRIX': row[8]
+    }
+
+def to_amocrm_lead(row: tuple) -> dict:
+    """Лид amoCRM из строки выгрузки"""
+    return {
+        'name': row[0],
+        'contacts': [{
+            'name': row[1],
+            'custom_fields': [
+                {'id': 'EMAIL', 'values': [{'value': row[2], 'enum': 'WORK'}]} if row[2] else None,
+                {'id': 'PHONE', 'values': [{'value': row[3], 'enum': 'WORK'}]} if row[3] else None
+            ]
+        }],
+        'custom_fields': [
+            {'id': 'DESCRIPTION', 'values': [{'value': row[4]}]},
+            {'id': 'SCORE_X', 'values': [{'value': str(row[5])}]},
+            {'id': 'SCORE_Y', 'values': [{'value': str(row[6])}]},
+            {'id': 'QUADRANT', 'values': [{'value': row[7]}]},
+            {'id': 'MATRIX', 'values': [{'value': row[8]}]}
+        ]
+    }
+
+def export_leads(organization_id: int, body: dict, export_format: str, to_lead) -> dict:
+    """
+    Экспорт лидов для внешней CRM. С stream/cursor отдаёт не больше
+    EXPORT_CHUNK_ROWS лидов за вызов и next_cursor для продолжения.
+    """
+    chunked = bool(body.get('stream') or body.get('cursor'))
+    cursor_token = body.get('cursor')
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor()
+    try:
+        after = decode_export_cursor(cursor_token) if cursor_token else None
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
     
-    query = """
-        SELECT 
-            c.company_name,
-            c.contact_person,
-            c.email,
-            c.phone,
-            c.description,
-            c.score_x,
-            c.score_y,
-            c.quadrant,
-            m.name as matrix_name
-        FROM clients c
-        LEFT JOIN matrices m ON c.matrix_id = m.id
-        WHERE c.organization_id = {org_id}
-    """.format(org_id=organization_id)
-    
-    if quadrant:
-        query += " AND c.quadrant = '{}'".format(quadrant)
-    
-    cur.execute(query)
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    
-    bitrix_data = []
-    for row in rows:
-        bitrix_data.append({
-            'TITLE': row[0],
-            'NAME': row[1],
-            'EMAIL': [{'VALUE': row[2], 'VALUE_TYPE': 'WORK'}] if row[2] else [],
-            'PHONE': [{'VALUE': row[3], 'VALUE_TYPE': 'WORK'}] if row[3] else [],
-            'COMMENTS': row[4],
-            'UF_CRM_SCORE_X': row[5],
-            'UF_CRM_SCORE_Y': row[6],
-            'UF_CRM_QUADRANT': row[7],
-            'UF_CRM_MATRIX': row[8]
-        })
+    limit = EXPORT_CHUNK_ROWS if chunked else None
+    
+    conn = get_db_connection()
+    
+    leads = []
+    last_row = None
+    try:
+        for row in iter_export_rows(conn, organization_id, body, after, limit):
+            leads.append(to_lead(row))
+            last_row = row
+    finally:
+        conn.close()
+    
+    result = {
+        'format': export_format,
+        'leads': leads,
+        'total': len(leads)
+    }
+    
+    if chunked:
+        next_cursor = encode_export_cursor(last_row) if len(leads) == EXPORT_CHUNK_ROWS else None
+        result['next_cursor'] = next_cursor
+        result['done'] = next_cursor is None
     
     return {
         'statusCode': 200,
@@ -348,75 +438,14 @@ def export_bitrix(organization_id: int, body: dict) -> dict:
             'Content-Type': 'application/json',
             'Access-Control-Allow-Origin': '*'
         },
-        'body': json.dumps({
-            'format': 'bitrix24',
-            'leads': bitrix_data,
-            'total': len(bitrix_data)
-        }),
+        'body': json.dumps(result, default=str),
         'isBase64Encoded': False
     }
 
+def export_bitrix(organization_id: int, body: dict) -> dict:
+    """Экспорт в формат Bitrix24"""
+    return export_leads(organization_id, body, 'bitrix24', to_bitrix_lead)
+
 def export_amocrm(organization_id: int, body: dict) -> dict:
     """Экспорт в формат amoCRM"""
-    quadrant = body.get('quadrant')
-    
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor()
-    
-    query = """
-        SELECT 
-            c.company_name,
-            c.contact_person,
-            c.email,
-            c.phone,
-            c.description,
-            c.score_x,
-            c.score_y,
-            c.quadrant,
-            m.name as matrix_name
-        FROM clients c
-        LEFT JOIN matrices m ON c.matrix_id = m.id
-        WHERE c.organization_id = {org_id}
-    """.format(org_id=organization_id)
-    
-    if quadrant:
-        query += " AND c.quadrant = '{}'".format(quadrant)
-    
-    cur.execute(query)
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    
-    amo_data = []
-    for row in rows:
-        amo_data.append({
-            'name': row[0],
-            'contacts': [{
-                'name': row[1],
-                'custom_fields': [
-                    {'id': 'EMAIL', 'values': [{'value': row[2], 'enum': 'WORK'}]} if row[2] else None,
-                    {'id': 'PHONE', 'values': [{'value': row[3], 'enum': 'WORK'}]} if row[3] else None
-                ]
-            }],
-            'custom_fields': [
-                {'id': 'DESCRIPTION', 'values': [{'value': row[4]}]},
-                {'id': 'SCORE_X', 'values': [{'value': str(row[5])}]},
-                {'id': 'SCORE_Y', 'values': [{'value': str(row[6])}]},
-                {'id': 'QUADRANT', 'values': [{'value': row[7]}]},
-                {'id': 'MATRIX', 'values': [{'value': row[8]}]}
-            ]
-        })
-    
-    return {
-        'statusCode': 200,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'
-        },
-        'body': json.dumps({
-            'format': 'amocrm',
-            'leads': amo_data,
-            'total': len(amo_data)
-        }),
-        'isBase64Encoded': False
-    }
\ No newline at end of file
+    return export_leads(organization_id, body, 'amocrm', to_amocrm_lead)
@@ -0,0 +1,168 @@
+"""
+Общая авторизация функций CRM по JWT из заголовка X-Authorization.
+
+Подпись токена проверяется один раз: проверенные токены хранятся в LRU
+процесса до своего exp, повторный запрос с тем же токеном - поиск в словаре.
+Роль, активность и права пользователя из БД загружаются лениво и кэшируются
+на AUTH_ACCESS_TTL секунд; invalidate_user_access сбрасывает запись после
+изменения прав или пользователя (на других инстансах запись живёт до TTL).
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import jwt
+
+from db import get_db_connection
+
+VERIFIED_TOKENS_LIMIT = 1024
+AUTH_ACCESS_TTL = int(os.environ.get('AUTH_ACCESS_TTL', '60'))
+AUTH_ACCESS_LIMIT = 1024
+
+PERMISSION_FIELDS = (
+    'client_visibility', 'client_edit', 'matrix_access',
+    'team_access', 'import_export', 'settings_access'
+)
+
+# token -> (payload, exp)
+_verified: 'OrderedDict[str, tuple]' = OrderedDict()
+# (user_id, organization_id) -> (access, когда истекает)
+_access: 'OrderedDict[tuple, tuple]' = OrderedDict()
+_lock = threading.Lock()
+
+
+class AuthError(Exception):
+    """Запрос без токена или с недействительным токеном"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason  # missing | expired | invalid
+
+
+class AuthContext:
+    """Данные авторизованного пользователя для обработчиков"""
+
+    def __init__(self, payload: dict, default_role: str = 'viewer'):
+        self.payload = payload
+        self.user_id = payload.get('user_id')
+        self.organization_id = payload.get('organization_id')
+        # Токен без роли получает роль по умолчанию, а не None
+        self.role = payload.get('role') or default_role
+
+    def has_role(self, *roles: str) -> bool:
+        return self.role in roles
+
+    @property
+    def access(self) -> Optional[dict]:
+        """Роль, активность и права из БД; None - пользователя нет в организации"""
+        return get_user_access(self.user_id, self.organization_id)
+
+    @property
+    def permissions(self) -> Optional[dict]:
+        access = self.access
+        return access['permissions'] if access else None
+
+
+def get_request_token(event: dict) -> str:
+    auth_header = (event.get('headers') or {}).get('X-Authorization', '')
+    return auth_header.replace('Bearer ', '') if auth_header else ''
+
+
+def verify_token(token: str) -> dict:
+    """
+    Проверить JWT. Бросает jwt.ExpiredSignatureError / jwt.InvalidTokenError,
+    как jwt.decode.
+    """
+    now = time.time()
+    with _lock:
+        entry = _verified.get(token)
+        if entry is not None:
+            payload, exp = entry
+            if exp is not None and exp <= now:
+                del _verified[token]
+                raise jwt.ExpiredSignatureError('Signature has expired')
+            _verified.move_to_end(token)
+            return payload
+
+    secret = os.environ.get('JWT_SECRET')
+    payload = jwt.decode(token, secret, algorithms=['HS256'])
+
+    with _lock:
+        _verified[token] = (payload, payload.get('exp'))
+        while len(_verified) > VERIFIED_TOKENS_LIMIT:
+            _verified.popitem(last=False)
+    return payload
+
+
+def authenticate(event: dict, default_role: str = 'viewer') -> AuthContext:
+    """
+    Контекст пользователя из заголовка запроса или AuthError. default_role -
+    роль для токена без claim role
+    """
+    token = get_request_token(event)
+    if not token:
+        raise AuthError('missing')
+    try:
+        payload = verify_token(token)
+    except jwt.ExpiredSignatureError:
+        raise AuthError('expired')
+    except jwt.InvalidTokenError:
+        raise AuthError('invalid')
+    if 'user_id' not in payload or 'organization_id' not in payload:
+        raise AuthError('invalid')
+    return AuthContext(payload, default_role)
+
+
+def get_user_access(user_id: int, organization_id: int) -> Optional[dict]:
+    key = (user_id, organization_id)
+    now = time.monotonic()
+    with _lock:
+        entry = _access.get(key)
+        if entry is not None and entry[1] > now:
+            _access.move_to_end(key)
+            return entry[0]
+
+    access = load_user_access(user_id, organization_id)
+
+    with _lock:
+        _access[key] = (access, now + AUTH_ACCESS_TTL)
+        _access.move_to_end(key)
+        while len(_access) > AUTH_ACCESS_LIMIT:
+            _access.popitem(last=False)
+    return access
+
+
+def load_user_access(user_id: int, organization_id: int) -> Optional[dict]:
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            f"""
+            SELECT u.role, u.is_active, {', '.join('p.' + f for f in PERMISSION_FIELDS)}, p.user_id IS NOT NULL
+            FROM users u
+            LEFT JOIN user_permissions p ON p.user_id = u.id AND p.organization_id = u.organization_id
+            WHERE u.id = %s AND u.organization_id = %s
+            """,
+            (user_id, organization_id)
+        )
+        row = cur.fetchone()
+    finally:
+        cur.close()
+        conn.close()
+
+    if not row:
+        return None
+    return {
+        'role': row[0],
+        'is_active': row[1],
+        'permissions': dict(zip(PERMISSION_FIELDS, row[2:-1])) if row[-1] else None
+    }
+
+
+def invalidate_user_access(user_id: int, organization_id: int = None):
+    """Сбросить закэшированные роль и права пользователя"""
+    with _lock:
+        for key in [k for k in _access if k[0] == user_id and organization_id in (None, k[1])]:
+            del _access[key]
@@ -0,0 +1,125 @@
+"""
+Счётчики клиентов по (organization, matrix, quadrant, deal_status) в таблице
+client_stats. Обновляются инкрементально в той же транзакции, что и изменение
+клиента, поэтому дашборду не нужно выгружать весь список клиентов.
+Одинаковая копия модуля лежит в clients, import, matrices и telegram-bot:
+функции деплоятся независимо.
+
+Учитываются клиенты с is_active = true AND deleted_at IS NULL.
+NULL в ключе хранится как 0 / '' (первичный ключ не допускает NULL).
+"""
+from collections import Counter
+from typing import Iterable, List, Optional
+
+from psycopg2.extras import execute_values
+
+
+def client_stats_snapshot(cur, client_ids: Iterable[int], lock: bool = False) -> Counter:
+    """
+    Вклад клиентов в счётчики: Counter {(org, matrix, quadrant, deal_status): n}.
+    lock=True блокирует строки клиентов до конца транзакции - снимок
+    "до изменения" должен браться с блокировкой.
+    """
+    client_ids = list(client_ids)
+    if not client_ids:
+        return Counter()
+
+    cur.execute(
+        """
+        SELECT organization_id, COALESCE(matrix_id, 0), COALESCE(quadrant, ''), COALESCE(deal_status_id, 0)
+        FROM clients
+        WHERE id = ANY(%s) AND is_active = true AND deleted_at IS NULL
+        """ + (" FOR UPDATE" if lock else ""),
+        (client_ids,)
+    )
+
+    return Counter(tuple(row) for row in cur.fetchall())
+
+
+def apply_client_stats_delta(cur, delta: dict):
+    """Прибавить к счётчикам {(org, matrix, quadrant, deal_status): n}, n может быть < 0"""
+    values = [key + (count,) for key, count in delta.items() if count]
+    if not values:
+        return
+
+    execute_values(cur, """
+        INSERT INTO client_stats (organization_id, matrix_id, quadrant, deal_status_id, clients_count)
+        VALUES %s
+        ON CONFLICT (organization_id, matrix_id, quadrant, deal_status_id)
+        DO UPDATE SET clients_count = client_stats.clients_count + EXCLUDED.clients_count
+    """, values)
+
+
+def record_client_stats_change(cur, before: Counter, after: Counter):
+    """Применить разницу двух снимков client_stats_snapshot"""
+    delta = Counter(after)
+    delta.subtract(before)
+    apply_client_stats_delta(cur, delta)
+
+
+def add_clients_to_stats(cur, client_ids: Iterable[int]):
+    """Учесть только что созданных клиентов"""
+    apply_client_stats_delta(cur, client_stats_snapshot(cur, client_ids))
+
+
+def apply_rescore_moves(cur, matrix_id: int, moves: List[tuple]):
+    """Перенести клиентов между квадрантами после rescore_matrix"""
+    delta = Counter()
+    for organization_id, deal_status_id, old_quadrant, new_quadrant, count in moves:
+        delta[(organization_id, matrix_id, old_quadrant or '', deal_status_id or 0)] -= count
+        delta[(organization_id, matrix_id, new_quadrant or '', deal_status_id or 0)] += count
+    apply_client_stats_delta(cur, delta)
+
+
+def detach_matrix_client_stats(cur, matrix_id: int):
+    """Клиенты удалённой матрицы переходят в счётчики «без матрицы и квадранта»"""
+    cur.execute(
+        """
+        INSERT INTO client_stats (organization_id, matrix_id, quadrant, deal_status_id, clients_count)
+        SELECT organization_id, 0, '', deal_status_id, SUM(clients_count)
+        FROM client_stats
+        WHERE matrix_id = %s
+        GROUP BY organization_id, deal_status_id
+        ON CONFLICT (organization_id, matrix_id, quadrant, deal_status_id)
+        DO UPDATE SET clients_count = client_stats.clients_count + EXCLUDED.clients_count
+        """,
+        (matrix_id,)
+    )
+    cur.execute("DELETE FROM client_stats WHERE matrix_id = %s", (matrix_id,))
+
+
+def load_client_stats(cur, organization_id: int, matrix_id: Optional[int] = None) -> dict:
+    """Распределение клиентов организации по квадрантам и статусам сделок"""
+    query = """
+        SELECT matrix_id, quadrant, deal_status_id, clients_count
+        FROM client_stats
+        WHERE organization_id = %s AND clients_count <> 0
+    """
+    params = [organization_id]
+    if matrix_id:
+        query += " AND matrix_id = %s"
+        params.append(matrix_id)
+
+    cur.execute(query, tuple(params))
+
+    total = 0
+    by_quadrant = Counter()
+    by_deal_status = Counter()
+    rows = []
+    for row_matrix_id, quadrant, deal_status_id, count in cur.fetchall():
+        total += count
+        by_quadrant[quadrant or 'none'] += count
+        by_deal_status[str(deal_status_id) if deal_status_id else 'none'] += count
+        rows.append({
+            'matrix_id': row_matrix_id or None,
+            'quadrant': quadrant or None,
+            'deal_status_id': deal_status_id or None,
+            'count': count
+        })
+
+    return {
+        'total': total,
+        'by_quadrant': dict(by_quadrant),
+        'by_deal_status': dict(by_deal_status),
+        'rows': rows
+    }
@@ -0,0 +1,169 @@
+"""
+Фоновые задачи импорта клиентов (import_jobs).
+
+Задача читает файл upload-сессии и пишет клиентов пачками: каждая пачка
+коммитится вместе с контрольной точкой rows_done и счётчиками, поэтому
+задачу можно продолжать сколько угодно раз - с того места, где остановился
+предыдущий вызов (запрос статуса с advance, повторный import или таймер).
+
+По строкам, которые не попали в базу, копится сводка error_summary
+{причина: число строк} и первые JOB_ERRORS_LIMIT примеров с номерами строк.
+"""
+import json
+import os
+from typing import Optional
+
+IMPORT_JOB_TIME_BUDGET = float(os.environ.get('IMPORT_JOB_TIME_BUDGET', '20'))
+JOB_ERRORS_LIMIT = 100
+
+JOB_FIELDS = (
+    'id', 'organization_id', 'user_id', 'upload_id', 'matrix_id', 'mapping',
+    'status', 'rows_done', 'bytes_done', 'total_bytes', 'imported_count',
+    'skipped_count', 'failed_count', 'error_summary', 'errors', 'error'
+)
+
+# Причины, по которым строка не импортирована
+ROW_ERRORS = {
+    'no_company_name': 'Не указано название компании',
+    'duplicate': 'Клиент с таким названием уже есть',
+    'too_long': 'Слишком длинное значение поля',
+    'db_error': 'Ошибка записи в базу',
+}
+
+
+def job_to_dict(row) -> dict:
+    job = dict(zip(JOB_FIELDS, row))
+    total = job['total_bytes'] or 0
+    job['progress'] = 1.0 if job['status'] == 'done' else (
+        round(min(job['bytes_done'] / total, 0.99), 4) if total else 0.0
+    )
+    job['done'] = job['status'] == 'done'
+    return job
+
+
+def row_error(row_number: int, reason: str, detail: str = None) -> dict:
+    """Пример ошибки строки; row_number - номер строки данных, с 1"""
+    message = ROW_ERRORS[reason]
+    return {'row': row_number, 'reason': reason, 'message': f'{message}: {detail}' if detail else message}
+
+
+def get_import_job(cur, job_id: int, organization_id: int) -> Optional[dict]:
+    cur.execute(
+        f"SELECT {', '.join(JOB_FIELDS)} FROM import_jobs WHERE id = %s AND organization_id = %s",
+        (job_id, organization_id)
+    )
+    row = cur.fetchone()
+    return job_to_dict(row) if row else None
+
+
+def start_import_job(conn, upload: dict, user_id: int, matrix_id: int, mapping: dict) -> dict:
+    """
+    Создать задачу для загруженного файла или вернуть уже существующую.
+    Упавшая задача (например, на лимите тарифа) перезапускается с контрольной
+    точки со своими маппингом и матрицей.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            UPDATE import_jobs SET status = 'running', error = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE upload_id = %s AND status = 'failed'
+            AND NOT EXISTS (SELECT 1 FROM import_jobs WHERE upload_id = %s AND status = 'running')
+            """,
+            (upload['id'], upload['id'])
+        )
+        cur.execute(
+            f"""
+            SELECT {', '.join(JOB_FIELDS)} FROM import_jobs
+            WHERE upload_id = %s
+            ORDER BY status = 'running' DESC, id DESC
+            LIMIT 1
+            """,
+            (upload['id'],)
+        )
+        row = cur.fetchone()
+        if row:
+            conn.commit()
+            return job_to_dict(row)
+
+        cur.execute(
+            f"""
+            INSERT INTO import_jobs (organization_id, user_id, upload_id, matrix_id, mapping, total_bytes)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (upload_id) WHERE status = 'running' DO NOTHING
+            RETURNING {', '.join(JOB_FIELDS)}
+            """,
+            (upload['organization_id'], user_id, upload['id'], matrix_id, json.dumps(mapping), upload['total_bytes'])
+        )
+        row = cur.fetchone()
+        if row is None:
+            # Параллельный запрос успел создать задачу
+            cur.execute(
+                f"SELECT {', '.join(JOB_FIELDS)} FROM import_jobs WHERE upload_id = %s AND status = 'running'",
+                (upload['id'],)
+            )
+            row = cur.fetchone()
+        conn.commit()
+        return job_to_dict(row)
+    finally:
+        cur.close()
+
+
+def lock_running_job(cur, job_id: int) -> Optional[dict]:
+    """Строка задачи под блокировкой; None - её сейчас продвигает другой вызов"""
+    cur.execute(
+        f"SELECT {', '.join(JOB_FIELDS)} FROM import_jobs WHERE id = %s FOR UPDATE SKIP LOCKED",
+        (job_id,)
+    )
+    row = cur.fetchone()
+    return job_to_dict(row) if row else None
+
+
+def save_job_progress(cur, job: dict, rows: int, bytes_done: int, imported: int, skipped: int,
+                      failed: int, errors: list) -> dict:
+    """Сдвинуть контрольную точку и счётчики после пачки (в её транзакции)"""
+    summary = dict(job['error_summary'] or {})
+    for error in errors:
+        summary[error['reason']] = summary.get(error['reason'], 0) + 1
+    samples = (job['errors'] or []) + errors[:max(JOB_ERRORS_LIMIT - len(job['errors'] or []), 0)]
+
+    cur.execute(
+        f"""
+        UPDATE import_jobs
+        SET rows_done = rows_done + %s, bytes_done = GREATEST(bytes_done, %s),
+            imported_count = imported_count + %s, skipped_count = skipped_count + %s,
+            failed_count = failed_count + %s, error_summary = %s, errors = %s,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s
+        RETURNING {', '.join(JOB_FIELDS)}
+        """,
+        (rows, bytes_done, imported, skipped, failed,
+         json.dumps(summary), json.dumps(samples), job['id'])
+    )
+    return job_to_dict(cur.fetchone())
+
+
+def finish_import_job(cur, job: dict) -> dict:
+    cur.execute(
+        f"""
+        UPDATE import_jobs
+        SET status = 'done', bytes_done = total_bytes, finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s
+        RETURNING {', '.join(JOB_FIELDS)}
+        """,
+        (job['id'],)
+    )
+    return job_to_dict(cur.fetchone())
+
+
+def fail_import_job(cur, job_id: int, error: str) -> Optional[dict]:
+    cur.execute(
+        f"""
+        UPDATE import_jobs SET status = 'failed', error = %s, updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s
+        RETURNING {', '.join(JOB_FIELDS)}
+        """,
+        (error[:500], job_id)
+    )
+    row = cur.fetchone()
+    return job_to_dict(row) if row else None
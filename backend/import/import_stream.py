@@ -0,0 +1,149 @@
+"""
+Потоковое чтение файлов импорта: строки отдаются по одной, файл не
+раскладывается в список целиком.
+
+base64 из тела запроса декодируется кусками по мере чтения, CSV читается
+через csv.DictReader поверх потока, поэтому в памяти нет второй полной
+копии файла. JSON (массив объектов) парсится целиком - формат не потоковый.
+XLSX (zip) требует произвольного доступа: поток копируется во временный
+файл, лист читается openpyxl в read_only режиме построчно.
+"""
+import base64
+import csv
+import io
+import json
+import shutil
+import tempfile
+import zipfile
+from datetime import date, datetime
+from typing import Iterator
+
+SUPPORTED_FILE_TYPES = ('csv', 'json', 'xlsx')
+
+XLSX_COPY_CHUNK = 1024 * 1024
+
+# Кратно 4 символам base64 - кусок декодируется независимо от соседних
+BASE64_CHUNK = 64 * 1024
+
+
+class ImportFileError(ValueError):
+    """Файл прочитан, но его содержимое не подходит для импорта"""
+
+
+class Base64Stream(io.RawIOBase):
+    """Бинарный поток поверх base64-строки с декодированием по кускам"""
+
+    def __init__(self, content: str):
+        # Переносы строк в base64 сдвинули бы границы кусков
+        self._content = ''.join(content.split()) if any(c.isspace() for c in content[:1024]) else content
+        self._pos = 0
+        self._buffer = b''
+        self.consumed = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, target) -> int:
+        while not self._buffer and self._pos < len(self._content):
+            chunk = self._content[self._pos:self._pos + BASE64_CHUNK]
+            self._pos += len(chunk)
+            self._buffer = base64.b64decode(chunk)
+        size = min(len(target), len(self._buffer))
+        target[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        self.consumed += size
+        return size
+
+    @property
+    def progress(self) -> float:
+        """Доля файла, отданная читателю, - для оценки числа строк по выборке"""
+        total = len(self._content) * 3 // 4
+        return min(self.consumed / total, 1.0) if total else 1.0
+
+
+def open_text(stream) -> io.TextIOWrapper:
+    """Текст UTF-8 (BOM допускается) поверх бинарного потока"""
+    return io.TextIOWrapper(io.BufferedReader(stream), encoding='utf-8-sig', newline='')
+
+
+def iter_rows(stream, file_type: str) -> Iterator[dict]:
+    """
+    Строки файла как словари {колонка: значение}. ImportFileError - неверная
+    структура файла, прочие ValueError - ошибки base64/UTF-8/JSON.
+    """
+    if file_type == 'csv':
+        yield from csv.DictReader(open_text(stream))
+    elif file_type == 'json':
+        data = json.load(open_text(stream))
+        if not isinstance(data, list):
+            raise ImportFileError('JSON должен содержать массив объектов')
+        for row in data:
+            if isinstance(row, dict):
+                yield row
+    elif file_type == 'xlsx':
+        yield from iter_xlsx_rows(stream)
+    else:
+        raise ImportFileError('Неподдерживаемый тип файла')
+
+
+def iter_xlsx_rows(stream) -> Iterator[dict]:
+    """Строки первого листа; первая строка - заголовки, пустые строки пропускаются"""
+    from openpyxl import load_workbook
+    from openpyxl.utils.exceptions import InvalidFileException
+
+    with tempfile.TemporaryFile() as file:
+        shutil.copyfileobj(stream, file, XLSX_COPY_CHUNK)
+        file.seek(0)
+        try:
+            workbook = load_workbook(file, read_only=True, data_only=True)
+        except (zipfile.BadZipFile, InvalidFileException, KeyError, OSError):
+            raise ImportFileError('Не удалось прочитать файл Excel')
+
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            columns = [
+                xlsx_cell_text(value) or f'Колонка {index + 1}'
+                for index, value in enumerate(header)
+            ]
+            for values in rows:
+                if not any(value not in (None, '') for value in values):
+                    continue
+                yield {column: xlsx_cell_text(value) for column, value in zip(columns, values)}
+        finally:
+            workbook.close()
+
+
+def xlsx_cell_text(value) -> str:
+    """Значение ячейки как текст, как оно пришло бы из CSV"""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, float) and value.is_integer():
+        # Телефоны и коды Excel хранит числами: 79001234567.0 -> 79001234567
+        return str(int(value))
+    if isinstance(value, datetime):
+        return value.date().isoformat() if value.time() == datetime.min.time() else value.isoformat(sep=' ')
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value).strip()
+
+
+def iter_batches(rows, size: int) -> Iterator[list]:
+    """Строки пачками по size, в памяти одна пачка"""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def normalize_company_name(name) -> str:
+    """Ключ сравнения названий компаний при поиске дублей"""
+    return ' '.join(str(name).split()).lower()
@@ -0,0 +1,234 @@
+"""
+Загрузка больших файлов импорта частями (upload-сессии).
+
+Клиент открывает сессию (begin_upload), присылает файл чанками не больше
+UPLOAD_CHUNK_MAX байт (append_chunk; повтор чанка с тем же номером его
+перезаписывает) и закрывает сессию (commit_upload). Чанки лежат в
+import_upload_chunks. UploadStream читает сессию как один бинарный поток,
+держа в памяти один чанк, - поверх него работает тот же разбор строк
+(import_stream.iter_rows), что и для файла в теле запроса.
+
+Ошибки: ValueError - неверный запрос, LookupError - сессии нет.
+"""
+import io
+import os
+from typing import Optional
+
+from import_stream import Base64Stream, SUPPORTED_FILE_TYPES
+
+UPLOAD_CHUNK_MAX = int(os.environ.get('IMPORT_UPLOAD_CHUNK_MAX', str(2 * 1024 * 1024)))
+UPLOAD_MAX_BYTES = int(os.environ.get('IMPORT_UPLOAD_MAX_BYTES', str(500 * 1024 * 1024)))
+UPLOAD_TTL_HOURS = 24
+
+UPLOAD_FIELDS = (
+    'id', 'organization_id', 'user_id', 'file_name', 'file_type', 'status',
+    'chunks_count', 'total_bytes'
+)
+
+
+def upload_to_dict(row) -> dict:
+    return dict(zip(UPLOAD_FIELDS, row))
+
+
+def upload_summary(upload: dict) -> dict:
+    """Состояние сессии для ответа клиенту"""
+    return {
+        'upload_id': upload['id'],
+        'file_name': upload['file_name'],
+        'file_type': upload['file_type'],
+        'status': upload['status'],
+        'chunks_count': upload['chunks_count'],
+        'total_bytes': upload['total_bytes']
+    }
+
+
+def get_upload(cur, upload_id: int, organization_id: int, lock: bool = False) -> Optional[dict]:
+    cur.execute(
+        f"""
+        SELECT {', '.join(UPLOAD_FIELDS)} FROM import_uploads
+        WHERE id = %s AND organization_id = %s
+        {'FOR UPDATE' if lock else ''}
+        """,
+        (upload_id, organization_id)
+    )
+    row = cur.fetchone()
+    return upload_to_dict(row) if row else None
+
+
+def begin_upload(conn, organization_id: int, user_id: int, file_type: str, file_name: str = None) -> dict:
+    """Открыть сессию; заодно удаляются брошенные сессии организации без активного импорта"""
+    if file_type not in SUPPORTED_FILE_TYPES:
+        raise ValueError('Неподдерживаемый тип файла')
+
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            DELETE FROM import_uploads
+            WHERE organization_id = %s
+            AND updated_at < CURRENT_TIMESTAMP - make_interval(hours => %s)
+            AND NOT EXISTS (
+                SELECT 1 FROM import_jobs j WHERE j.upload_id = import_uploads.id AND j.status = 'running'
+            )
+            """,
+            (organization_id, UPLOAD_TTL_HOURS)
+        )
+        cur.execute(
+            f"""
+            INSERT INTO import_uploads (organization_id, user_id, file_name, file_type)
+            VALUES (%s, %s, %s, %s)
+            RETURNING {', '.join(UPLOAD_FIELDS)}
+            """,
+            (organization_id, user_id, (file_name or '')[:255] or None, file_type)
+        )
+        upload = upload_to_dict(cur.fetchone())
+        conn.commit()
+        return upload
+    finally:
+        cur.close()
+
+
+def append_chunk(conn, upload_id: int, organization_id: int, chunk_index: int, data: bytes) -> dict:
+    """Сохранить чанк. Повторная отправка того же номера безопасна"""
+    if chunk_index < 0:
+        raise ValueError('Некорректный номер чанка')
+    if not data or len(data) > UPLOAD_CHUNK_MAX:
+        raise ValueError(f'Размер чанка должен быть от 1 до {UPLOAD_CHUNK_MAX} байт')
+
+    cur = conn.cursor()
+    try:
+        upload = get_upload(cur, upload_id, organization_id, lock=True)
+        if not upload:
+            raise LookupError('Загрузка не найдена')
+        if upload['status'] != 'uploading':
+            raise ValueError('Загрузка уже завершена')
+
+        cur.execute(
+            "SELECT octet_length(data) FROM import_upload_chunks WHERE upload_id = %s AND chunk_index = %s",
+            (upload_id, chunk_index)
+        )
+        row = cur.fetchone()
+        total_bytes = upload['total_bytes'] + len(data) - (row[0] if row else 0)
+        if total_bytes > UPLOAD_MAX_BYTES:
+            raise ValueError(f'Файл больше {UPLOAD_MAX_BYTES // (1024 * 1024)} МБ')
+
+        cur.execute(
+            """
+            INSERT INTO import_upload_chunks (upload_id, chunk_index, data)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (upload_id, chunk_index) DO UPDATE SET data = EXCLUDED.data
+            """,
+            (upload_id, chunk_index, data)
+        )
+        cur.execute(
+            """
+            UPDATE import_uploads
+            SET total_bytes = %s, chunks_count = GREATEST(chunks_count, %s), updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+            """,
+            (total_bytes, chunk_index + 1, upload_id)
+        )
+        conn.commit()
+        return {'upload_id': upload_id, 'chunk_index': chunk_index, 'total_bytes': total_bytes}
+    finally:
+        conn.rollback()
+        cur.close()
+
+
+def commit_upload(conn, upload_id: int, organization_id: int, chunks_count: int = None) -> dict:
+    """
+    Закрыть сессию: все чанки 0..N-1 на месте (N = chunks_count, если передан).
+    Повторный commit возвращает сессию без изменений.
+    """
+    cur = conn.cursor()
+    try:
+        upload = get_upload(cur, upload_id, organization_id, lock=True)
+        if not upload:
+            raise LookupError('Загрузка не найдена')
+        if upload['status'] != 'uploading':
+            return upload
+
+        cur.execute(
+            """
+            SELECT COUNT(*), COALESCE(MAX(chunk_index) + 1, 0), COALESCE(SUM(octet_length(data)), 0)
+            FROM import_upload_chunks WHERE upload_id = %s
+            """,
+            (upload_id,)
+        )
+        received, expected, total_bytes = cur.fetchone()
+        if chunks_count is not None:
+            expected = max(expected, chunks_count)
+        if not received or received != expected:
+            raise ValueError(f'Получено чанков: {received} из {expected}')
+
+        cur.execute(
+            f"""
+            UPDATE import_uploads
+            SET status = 'committed', chunks_count = %s, total_bytes = %s, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+            RETURNING {', '.join(UPLOAD_FIELDS)}
+            """,
+            (expected, total_bytes, upload_id)
+        )
+        upload = upload_to_dict(cur.fetchone())
+        conn.commit()
+        return upload
+    finally:
+        conn.rollback()
+        cur.close()
+
+
+def stage_file_content(conn, organization_id: int, user_id: int, file_type: str, file_content: str,
+                       file_name: str = None) -> dict:
+    """Файл из тела запроса (base64) как закрытая сессия - для фонового импорта"""
+    upload = begin_upload(conn, organization_id, user_id, file_type, file_name)
+    stream = io.BufferedReader(Base64Stream(file_content))
+    chunk_index = 0
+    while True:
+        data = stream.read(UPLOAD_CHUNK_MAX)
+        if not data:
+            break
+        append_chunk(conn, upload['id'], organization_id, chunk_index, data)
+        chunk_index += 1
+    return commit_upload(conn, upload['id'], organization_id, chunk_index)
+
+
+class UploadStream(io.RawIOBase):
+    """Бинарный поток по чанкам сессии; в памяти один чанк"""
+
+    def __init__(self, conn, upload: dict):
+        self._conn = conn
+        self._upload_id = upload['id']
+        self._chunks_count = upload['chunks_count']
+        self._total_bytes = upload['total_bytes']
+        self._next_chunk = 0
+        self._buffer = memoryview(b'')
+        self.consumed = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, target) -> int:
+        while not len(self._buffer) and self._next_chunk < self._chunks_count:
+            cur = self._conn.cursor()
+            try:
+                cur.execute(
+                    "SELECT data FROM import_upload_chunks WHERE upload_id = %s AND chunk_index = %s",
+                    (self._upload_id, self._next_chunk)
+                )
+                row = cur.fetchone()
+            finally:
+                cur.close()
+            if row is None:
+                raise ValueError('Чанк загрузки не найден')
+            self._buffer = memoryview(bytes(row[0]))
+            self._next_chunk += 1
+        size = min(len(target), len(self._buffer))
+        target[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        self.consumed += size
+        return size
+
+    @property
+    def progress(self) -> float:
+        return min(self.consumed / self._total_bytes, 1.0) if self._total_bytes else 1.0
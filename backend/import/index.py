@@ -1,13 +1,43 @@
 """
-Импорт клиентов из CSV/Excel/JSON с визуальным маппингом колонок
+Импорт клиентов из CSV/Excel (xlsx)/JSON с визуальным маппингом колонок
 """
 import json
-import os
 import csv
-import io
 import base64
+import time
+from contextlib import contextmanager
 from datetime import datetime
+from itertools import islice
+from typing import Optional
 import psycopg2
+from psycopg2.extras import execute_values
+from scoring import score_client
+from matrix_loader import cached_matrix_definition, bump_matrix_version
+from client_stats import add_clients_to_stats
+from db import get_db_connection, db_connection
+from usage_limits import reserve_usage, UsageLimitExceeded
+from auth import authenticate, AuthError
+from import_stream import (
+    Base64Stream, ImportFileError, iter_rows, iter_batches, normalize_company_name, SUPPORTED_FILE_TYPES
+)
+from import_uploads import (
+    UploadStream, append_chunk, begin_upload, commit_upload, get_upload,
+    stage_file_content, upload_summary
+)
+from import_jobs import (
+    IMPORT_JOB_TIME_BUDGET, JOB_FIELDS, fail_import_job, finish_import_job, get_import_job,
+    job_to_dict, lock_running_job, row_error, save_job_progress, start_import_job
+)
+
+IMPORT_BATCH_SIZE = 1000
+
+PREVIEW_ROWS = 10
+PREVIEW_ROWS_MAX = 100
+
+CLIENT_FIELDS = ['company_name', 'contact_person', 'email', 'phone', 'description']
+
+# Ограничения длины колонок clients: такие строки пропускаются, а не валят пачку
+FIELD_LIMITS = {'company_name': 255, 'contact_person': 255, 'email': 255, 'phone': 50}
 
 def handler(event: dict, context) -> dict:
     """API для импорта клиентов с гибким маппингом полей"""
@@ -26,29 +56,22 @@ def handler(event: dict, context) -> dict:
             'isBase64Encoded': False
         }
     
-    token = event.get('headers', {}).get('X-Authorization', '').replace('Bearer ', '')
-    if not token:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Требуется авторизация'}),
-            'isBase64Encoded': False
-        }
+    if is_timer_event(event):
+        return handle_timer()
     
     try:
-        import jwt
-        secret = os.environ.get('JWT_SECRET')
-        payload = jwt.decode(token, secret, algorithms=['HS256'])
-        user_id = payload['user_id']
-        organization_id = payload['organization_id']
-    except Exception as e:
+        auth = authenticate(event)
+    except AuthError as e:
         return {
             'statusCode': 401,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Неверный токен'}),
+            'body': json.dumps({'error': 'Требуется авторизация' if e.reason == 'missing' else 'Неверный токен'}),
             'isBase64Encoded': False
         }
     
+    user_id = auth.user_id
+    organization_id = auth.organization_id
+    
     if method != 'POST':
         return {
             'statusCode': 405,
@@ -62,11 +85,15 @@ def handler(event: dict, context) -> dict:
         action = body.get('action')
         
         if action == 'parse':
-            return parse_file(body)
+            return parse_file(organization_id, body)
         elif action == 'preview':
             return preview_import(organization_id, body)
         elif action == 'import':
             return import_clients(organization_id, user_id, body)
+        elif action in ('upload_begin', 'upload_chunk', 'upload_commit', 'upload_status'):
+            return handle_upload(action, organization_id, user_id, body)
+        elif action == 'import_job_status':
+            return handle_import_job_status(organization_id, body)
         elif action == 'save_template':
             return save_template(organization_id, user_id, body)
         elif action == 'load_templates':
@@ -86,12 +113,36 @@ def handler(event: dict, context) -> dict:
             'isBase64Encoded': False
         }
 
-def parse_file(body: dict) -> dict:
-    """Этап 1: Парсинг файла и возврат превью первых 5 строк"""
+@contextmanager
+def open_import_file(organization_id: int, body: dict):
+    """
+    Поток файла и его тип: из upload-сессии (upload_id) или из base64 в теле
+    запроса (file_content). LookupError - сессии нет, ImportFileError - не готова.
+    """
+    upload_id = body.get('upload_id')
+    if not upload_id:
+        file_type = body.get('file_type', 'csv')
+        if file_type not in SUPPORTED_FILE_TYPES:
+            raise ImportFileError('Неподдерживаемый тип файла')
+        yield Base64Stream(body.get('file_content') or ''), file_type
+        return
+    
+    with db_connection() as conn:
+        cur = conn.cursor()
+        upload = get_upload(cur, upload_id, organization_id)
+        cur.close()
+        if not upload:
+            raise LookupError('Загрузка не найдена')
+        if upload['status'] == 'uploading':
+            raise ImportFileError('Загрузка не завершена')
+        yield UploadStream(conn, upload), upload['file_type']
+
+def parse_file(organization_id: int, body: dict) -> dict:
+    """Этап 1: Парсинг файла и возврат превью первых 5 строк (один проход потоком)"""
     file_content = body.get('file_content')
     file_type = body.get('file_type', 'csv')
     
-    if not file_content:
+    if not file_content and not body.get('upload_id'):
         return {
             'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -99,77 +150,59 @@ def parse_file(body: dict) -> dict:
             'isBase64Encoded': False
         }
     
+    columns = []
+    preview_rows = []
+    total_rows = 0
+    
     try:
-        decoded = base64.b64decode(file_content).decode('utf-8-sig')
-    except:
+        with open_import_file(organization_id, body) as (stream, file_type):
+            for row in iter_rows(stream, file_type):
+                if total_rows == 0:
+                    columns = list(row.keys())
+                if total_rows < 5:
+                    preview_rows.append(row)
+                total_rows += 1
+    except LookupError as e:
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+    except ImportFileError as e:
         return {
             'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Ошибка декодирования файла'}),
+            'body': json.dumps({'error': str(e)}),
             'isBase64Encoded': False
         }
-    
-    if file_type == 'csv':
-        reader = csv.DictReader(io.StringIO(decoded))
-        rows = list(reader)
-        
-        if not rows:
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Файл пуст'}),
-                'isBase64Encoded': False
-            }
-        
-        columns = list(rows[0].keys())
-        preview_rows = rows[:5]
-        
-        auto_mapping = auto_match_columns(columns)
-        
+    except (ValueError, csv.Error):
         return {
-            'statusCode': 200,
+            'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({
-                'columns': columns,
-                'preview': preview_rows,
-                'total_rows': len(rows),
-                'auto_mapping': auto_mapping
-            }),
+            'body': json.dumps({'error': 'Ошибка декодирования файла'}),
             'isBase64Encoded': False
         }
-    elif file_type == 'json':
-        data = json.loads(decoded)
-        
-        if isinstance(data, list) and len(data) > 0:
-            columns = list(data[0].keys())
-            preview_rows = data[:5]
-            auto_mapping = auto_match_columns(columns)
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'columns': columns,
-                    'preview': preview_rows,
-                    'total_rows': len(data),
-                    'auto_mapping': auto_mapping
-                }),
-                'isBase64Encoded': False
-            }
-        else:
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'JSON должен содержать массив объектов'}),
-                'isBase64Encoded': False
-            }
-    else:
+    
+    if not total_rows:
         return {
             'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Неподдерживаемый тип файла'}),
+            'body': json.dumps({'error': 'JSON должен содержать массив объектов' if file_type == 'json' else 'Файл пуст'}),
             'isBase64Encoded': False
         }
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'columns': columns,
+            'preview': preview_rows,
+            'total_rows': total_rows,
+            'auto_mapping': auto_match_columns(columns)
+        }),
+        'isBase64Encoded': False
+    }
 
 def auto_match_columns(columns: list) -> dict:
     """Автоматическое сопоставление колонок с полями CRM"""
@@ -199,13 +232,18 @@ def auto_match_columns(columns: list) -> dict:
     return auto_mapping
 
 def preview_import(organization_id: int, body: dict) -> dict:
-    """Этап 3: Превью импорта - показать что будет создано"""
+    """
+    Этап 3: Превью импорта - показать что будет создано.
+    Файл читается потоком за один проход: дубли, валидные строки и новые
+    критерии считаются по ходу, в памяти только первые preview_limit строк.
+    sample_rows > 0 - остановиться после стольких строк и оценить итоги
+    по доле прочитанного файла (estimated: true).
+    """
     file_content = body.get('file_content')
-    file_type = body.get('file_type', 'csv')
     mapping = body.get('mapping', {})
     matrix_id = body.get('matrix_id')
     
-    if not file_content or not mapping:
+    if not (file_content or body.get('upload_id')) or not mapping:
         return {
             'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -213,87 +251,145 @@ def preview_import(organization_id: int, body: dict) -> dict:
             'isBase64Encoded': False
         }
     
-    decoded = base64.b64decode(file_content).decode('utf-8-sig')
-    
-    if file_type == 'csv':
-        reader = csv.DictReader(io.StringIO(decoded))
-        rows = list(reader)
-    elif file_type == 'json':
-        rows = json.loads(decoded)
-    else:
+    try:
+        preview_limit = max(0, min(int(body.get('preview_limit') or PREVIEW_ROWS), PREVIEW_ROWS_MAX))
+        sample_rows = max(0, int(body.get('sample_rows') or 0))
+    except (TypeError, ValueError):
         return {
             'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Неподдерживаемый тип'}),
+            'body': json.dumps({'error': 'Некорректные параметры превью'}),
             'isBase64Encoded': False
         }
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor()
-    
-    cur.execute("""
-        SELECT LOWER(company_name) FROM clients 
-        WHERE organization_id = {org_id} 
-        AND is_active = true 
-        AND deleted_at IS NULL
-    """.format(org_id=organization_id))
+    conn = get_db_connection()
+    try:
+        existing_companies = load_existing_company_keys(conn, organization_id)
+        existing_criteria = set()
+        if matrix_id:
+            cur = conn.cursor()
+            cur.execute("SELECT name FROM matrix_criteria WHERE matrix_id = %s", (matrix_id,))
+            existing_criteria = {row[0] for row in cur.fetchall()}
+            cur.close()
+    finally:
+        conn.close()
     
-    existing_companies = {row[0] for row in cur.fetchall()}
-    cur.close()
-    conn.close()
+    company_columns = [col for col, crm_field in mapping.items() if crm_field == 'company_name']
+    criterion_columns = {
+        col: crm_field.replace('criterion_', '')
+        for col, crm_field in mapping.items()
+        if crm_field.startswith('criterion_')
+    }
     
     preview_clients = []
     new_criteria = set()
+    total = 0
+    valid_count = 0
     duplicates_count = 0
+    complete = True
     
-    for row in rows[:10]:
-        client = {}
-        custom_scores = {}
-        
-        for file_col, crm_field in mapping.items():
-            value = row.get(file_col, '')
-            
-            if crm_field == 'skip' or not value:
-                continue
-            
-            if crm_field in ['company_name', 'contact_person', 'email', 'phone', 'description']:
-                client[crm_field] = value
-            elif crm_field.startswith('criterion_'):
-                criterion_name = crm_field.replace('criterion_', '')
-                new_criteria.add(criterion_name)
-                try:
-                    custom_scores[criterion_name] = float(value)
-                except:
-                    custom_scores[criterion_name] = 0.0
-        
-        if client.get('company_name'):
-            is_duplicate = client['company_name'].lower() in existing_companies
-            if is_duplicate:
-                duplicates_count += 1
-            client['custom_scores'] = custom_scores
-            client['is_duplicate'] = is_duplicate
-            preview_clients.append(client)
-    
-    total_duplicates = sum(1 for row in rows if any(
-        mapping.get(col) == 'company_name' and row.get(col, '').lower() in existing_companies 
-        for col in row.keys()
-    ))
+    try:
+        with open_import_file(organization_id, body) as (stream, file_type):
+            for row in iter_rows(stream, file_type):
+                total += 1
+                
+                if any(row.get(col) for col in mapping):
+                    valid_count += 1
+                
+                for col, criterion_name in criterion_columns.items():
+                    if row.get(col) and criterion_name not in existing_criteria:
+                        new_criteria.add(criterion_name)
+                
+                is_duplicate = any(
+                    row.get(col) and normalize_company_name(row[col]) in existing_companies
+                    for col in company_columns
+                )
+                if is_duplicate:
+                    duplicates_count += 1
+                
+                if total <= preview_limit:
+                    client, custom_scores = map_row(row, mapping)
+                    if client.get('company_name'):
+                        client['custom_scores'] = custom_scores
+                        client['is_duplicate'] = is_duplicate
+                        preview_clients.append(client)
+                
+                if sample_rows and total >= sample_rows:
+                    complete = False
+                    break
+    except LookupError as e:
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+    except ImportFileError as e:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+    except (ValueError, csv.Error):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Ошибка чтения файла'}),
+            'isBase64Encoded': False
+        }
+    
+    result = {
+        'preview': preview_clients,
+        'total': total,
+        'new_criteria': sorted(new_criteria),
+        'valid_count': valid_count,
+        'duplicates_count': duplicates_count,
+        'estimated': False
+    }
+    
+    # Выборка не дочитала файл - экстраполируем по доле прочитанных байт.
+    # XLSX копируется во временный файл целиком, для него итоги только по выборке
+    if not complete:
+        result['estimated'] = True
+        if stream.progress < 1.0:
+            scale = 1.0 / max(stream.progress, 1e-9)
+            result.update({
+                'total': round(total * scale),
+                'valid_count': round(valid_count * scale),
+                'duplicates_count': round(duplicates_count * scale)
+            })
     
     return {
         'statusCode': 200,
         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({
-            'preview': preview_clients,
-            'total': len(rows),
-            'new_criteria': list(new_criteria),
-            'valid_count': len([r for r in rows if mapping and any(r.get(k) for k in mapping.keys())]),
-            'duplicates_count': total_duplicates
-        }),
+        'body': json.dumps(result),
         'isBase64Encoded': False
     }
 
+def load_existing_company_keys(conn, organization_id: int) -> set:
+    """
+    Нормализованные названия активных клиентов (normalize_company_name) -
+    по ним ищутся дубли и в превью, и при импорте
+    """
+    cur = conn.cursor(name='import_preview_companies')
+    cur.itersize = IMPORT_BATCH_SIZE
+    try:
+        cur.execute("""
+            SELECT company_name FROM clients
+            WHERE organization_id = %s
+            AND is_active = true
+            AND deleted_at IS NULL
+        """, (organization_id,))
+        return {normalize_company_name(row[0]) for row in cur if row[0]}
+    finally:
+        cur.close()
+
 def import_clients(organization_id: int, user_id: int, body: dict) -> dict:
-    """Импорт клиентов в базу данных"""
+    """Импорт клиентов в базу данных пакетами (без запросов на каждую строку)"""
+    if body.get('upload_id') or body.get('async'):
+        return import_job(organization_id, user_id, body)
+    
     file_content = body.get('file_content')
     file_type = body.get('file_type', 'csv')
     mapping = body.get('mapping', {})
@@ -307,14 +403,7 @@ def import_clients(organization_id: int, user_id: int, body: dict) -> dict:
             'isBase64Encoded': False
         }
     
-    decoded = base64.b64decode(file_content).decode('utf-8-sig')
-    
-    if file_type == 'csv':
-        reader = csv.DictReader(io.StringIO(decoded))
-        rows = list(reader)
-    elif file_type == 'json':
-        rows = json.loads(decoded)
-    else:
+    if file_type not in SUPPORTED_FILE_TYPES:
         return {
             'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -322,184 +411,543 @@ def import_clients(organization_id: int, user_id: int, body: dict) -> dict:
             'isBase64Encoded': False
         }
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = get_db_connection()
     cur = conn.cursor()
     
-    new_criteria = {}
-    for file_col, crm_field in mapping.items():
-        if crm_field.startswith('criterion_'):
-            criterion_name = crm_field.replace('criterion_', '')
-            
-            cur.execute("""
-                SELECT id FROM matrix_criteria 
-                WHERE matrix_id = {matrix_id} AND name = '{name}'
-            """.format(matrix_id=matrix_id, name=criterion_name.replace("'", "''")))
-            
-            result = cur.fetchone()
-            if result:
-                new_criteria[criterion_name] = result[0]
-            else:
-                cur.execute("""
-                    INSERT INTO matrix_criteria (matrix_id, name, axis, weight, min_value, max_value, created_at)
-                    VALUES ({matrix_id}, '{name}', 'x', 1.0, 0.0, 10.0, NOW())
-                    RETURNING id
-                """.format(matrix_id=matrix_id, name=criterion_name.replace("'", "''")))
-                
-                criterion_id = cur.fetchone()[0]
-                new_criteria[criterion_name] = criterion_id
+    try:
+        criteria_ids = prepare_import_criteria(cur, matrix_id, mapping)
+        # Критерии нужны и при откате импорта: определение грузится уже с ними
+        conn.commit()
+        definition = cached_matrix_definition(cur, matrix_id)
+        existing_companies = load_existing_company_keys(conn, organization_id)
+        
+        imported_count = 0
+        skipped_count = 0
+        total = 0
+        
+        rows = iter_rows(Base64Stream(file_content or ''), file_type)
+        for batch in iter_batches(rows, IMPORT_BATCH_SIZE):
+            imported, skipped = import_batch(
+                cur, organization_id, user_id, matrix_id, mapping,
+                batch, criteria_ids, definition, existing_companies
+            )
+            imported_count += imported
+            skipped_count += skipped
+            total += len(batch)
+        
+        conn.commit()
+    except UsageLimitExceeded as e:
+        # Импорт целиком откатывается: частично загруженный файл хуже отказа
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+    except (ValueError, csv.Error):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Ошибка чтения файла'}),
+            'isBase64Encoded': False
+        }
+    finally:
+        cur.close()
+        conn.close()
     
-    conn.commit()
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'success': True,
+            'imported': imported_count,
+            'skipped': skipped_count,
+            'total': total
+        }),
+        'isBase64Encoded': False
+    }
+
+def import_job(organization_id: int, user_id: int, body: dict) -> dict:
+    """
+    Фоновый импорт: файл из upload-сессии (upload_id) или из тела запроса
+    (file_content, сохраняется как сессия). Задача сразу продвигается в
+    пределах IMPORT_JOB_TIME_BUDGET; дальше клиент опрашивает import_job_status.
+    Повторный вызов для той же сессии возвращает её задачу (упавшая продолжается).
+    """
+    upload_id = body.get('upload_id')
+    matrix_id = body.get('matrix_id')
+    mapping = body.get('mapping') or {}
     
-    imported_count = 0
-    skipped_count = 0
+    if not matrix_id:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Необходимо выбрать матрицу'}),
+            'isBase64Encoded': False
+        }
     
-    for row in rows:
-        client_data = {}
-        custom_scores = {}
+    conn = get_db_connection()
+    try:
+        if upload_id:
+            cur = conn.cursor()
+            upload = get_upload(cur, int(upload_id), organization_id)
+            cur.close()
+            if not upload:
+                raise LookupError('Загрузка не найдена')
+            if upload['status'] != 'committed':
+                raise ValueError('Загрузка не завершена')
+        else:
+            upload = stage_file_content(
+                conn, organization_id, user_id, body.get('file_type', 'csv'),
+                body.get('file_content') or '', body.get('file_name')
+            )
         
-        for file_col, crm_field in mapping.items():
-            value = row.get(file_col, '')
-            
-            if crm_field == 'skip' or not value:
-                continue
-            
-            if crm_field in ['company_name', 'contact_person', 'email', 'phone', 'description']:
-                client_data[crm_field] = value
-            elif crm_field.startswith('criterion_'):
-                criterion_name = crm_field.replace('criterion_', '')
-                try:
-                    custom_scores[criterion_name] = float(value)
-                except:
-                    pass
+        job = start_import_job(conn, upload, user_id, int(matrix_id), mapping)
+        if job['status'] == 'running':
+            job = run_import_job(conn, job['id'])
+    except LookupError as e:
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+    finally:
+        conn.close()
+    
+    return {
+        'statusCode': 202 if job['status'] == 'running' else 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'job': job}),
+        'isBase64Encoded': False
+    }
+
+def handle_import_job_status(organization_id: int, body: dict) -> dict:
+    """Прогресс задачи импорта; незавершённая задача продвигается дальше (advance)"""
+    job_id = body.get('job_id')
+    
+    if not job_id:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Не указана задача импорта'}),
+            'isBase64Encoded': False
+        }
+    
+    conn = get_db_connection()
+    cur = conn.cursor()
+    
+    try:
+        job = get_import_job(cur, int(job_id), organization_id)
         
-        if not client_data.get('company_name'):
-            skipped_count += 1
-            continue
+        if not job:
+            return {
+                'statusCode': 404,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Задача импорта не найдена'}),
+                'isBase64Encoded': False
+            }
         
-        company_name = client_data.get('company_name', '').replace("'", "''")
+        if job['status'] == 'running' and body.get('advance', True):
+            conn.rollback()
+            job = run_import_job(conn, job['id'])
         
-        cur.execute("""
-            SELECT id FROM clients 
-            WHERE organization_id = {org_id} 
-            AND company_name = '{company}' 
-            AND is_active = true 
-            AND deleted_at IS NULL
-        """.format(org_id=organization_id, company=company_name))
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'job': job}),
+            'isBase64Encoded': False
+        }
+    
+    finally:
+        cur.close()
+        conn.close()
+
+def run_import_job(conn, job_id: int, time_budget: float = IMPORT_JOB_TIME_BUDGET) -> Optional[dict]:
+    """
+    Продвинуть задачу пачками по IMPORT_BATCH_SIZE строк, пока не кончится
+    time_budget. Строки до rows_done только разбираются. Каждая пачка -
+    транзакция под блокировкой строки задачи; если задачу уже выполняет
+    другой вызов, возвращается её текущее состояние.
+    """
+    deadline = time.monotonic() + time_budget
+    cur = conn.cursor()
+    job = None
+    try:
+        job = lock_running_job(cur, job_id)
+        if job is None:
+            conn.rollback()
+            cur.execute(f"SELECT {', '.join(JOB_FIELDS)} FROM import_jobs WHERE id = %s", (job_id,))
+            row = cur.fetchone()
+            return job_to_dict(row) if row else None
+        if job['status'] != 'running':
+            conn.rollback()
+            return job
         
-        existing_client = cur.fetchone()
-        if existing_client:
-            skipped_count += 1
-            continue
+        upload = get_upload(cur, job['upload_id'], job['organization_id']) if job['upload_id'] else None
+        if upload is None:
+            job = fail_import_job(cur, job_id, 'Файл импорта не найден')
+            conn.commit()
+            return job
         
-        try:
-            cur.execute("""
-                INSERT INTO clients 
-                (organization_id, matrix_id, company_name, contact_person, email, phone, description, score_x, score_y, quadrant, created_by, responsible_user_id, created_at)
-                VALUES ({org_id}, {matrix_id}, '{company}', '{contact}', '{email}', '{phone}', '{desc}', 0.0, 0.0, 'archive', {user_id}, {user_id}, NOW())
-                RETURNING id
-            """.format(
-                org_id=organization_id,
-                matrix_id=matrix_id,
-                company=company_name,
-                contact=client_data.get('contact_person', '').replace("'", "''"),
-                email=client_data.get('email', '').replace("'", "''"),
-                phone=client_data.get('phone', '').replace("'", "''"),
-                desc=client_data.get('description', '').replace("'", "''"),
-                user_id=user_id
-            ))
-            
-            client_id = cur.fetchone()[0]
-            
-            for criterion_name, score_value in custom_scores.items():
-                criterion_id = new_criteria.get(criterion_name)
-                if criterion_id:
-                    cur.execute("""
-                        INSERT INTO client_scores (client_id, criterion_id, score, created_at)
-                        VALUES ({client_id}, {criterion_id}, {score}, NOW())
-                    """.format(client_id=client_id, criterion_id=criterion_id, score=score_value))
-            
-            score_x, score_y = calculate_scores(cur, client_id)
-            quadrant = determine_quadrant(cur, matrix_id, score_x, score_y)
-            
-            cur.execute("""
-                UPDATE clients
-                SET score_x = {score_x}, score_y = {score_y}, quadrant = '{quadrant}'
-                WHERE id = {client_id}
-            """.format(score_x=score_x, score_y=score_y, quadrant=quadrant, client_id=client_id))
+        criteria_ids = prepare_import_criteria(cur, job['matrix_id'], job['mapping'])
+        conn.commit()
+        definition = cached_matrix_definition(cur, job['matrix_id'])
+        existing_companies = load_existing_company_keys(conn, job['organization_id'])
+        conn.commit()
+        
+        stream = UploadStream(conn, upload)
+        rows = islice(iter_rows(stream, upload['file_type']), job['rows_done'], None)
+        for batch in iter_batches(rows, IMPORT_BATCH_SIZE):
+            if time.monotonic() >= deadline:
+                conn.rollback()
+                return job
             
-            imported_count += 1
+            locked = lock_running_job(cur, job_id)
+            if locked is None or locked['status'] != 'running' or locked['rows_done'] != job['rows_done']:
+                conn.rollback()
+                return locked or job
             
-        except Exception as e:
-            skipped_count += 1
+            imported, skipped, failed, errors = import_job_batch(
+                cur, job, batch, criteria_ids, definition, existing_companies
+            )
+            job = save_job_progress(cur, job, len(batch), stream.consumed, imported, skipped, failed, errors)
+            conn.commit()
+        
+        # Файл дочитан: задача завершена, загруженный файл больше не нужен
+        locked = lock_running_job(cur, job_id)
+        if locked and locked['status'] == 'running' and locked['rows_done'] == job['rows_done']:
+            job = finish_import_job(cur, job)
+            cur.execute("DELETE FROM import_uploads WHERE id = %s", (upload['id'],))
+        conn.commit()
+        return job
+    except UsageLimitExceeded as e:
+        # Импортированные пачки остаются; после смены тарифа задачу можно продолжить
+        conn.rollback()
+        job = fail_import_job(cur, job_id, str(e))
+        conn.commit()
+        return job
+    except (ValueError, csv.Error) as e:
+        conn.rollback()
+        rows_done = job['rows_done'] if job else 0
+        print(f"[IMPORT_JOB] job {job_id} parse error after row {rows_done}: {e}")
+        job = fail_import_job(cur, job_id, f'Ошибка чтения файла после строки {rows_done}')
+        conn.commit()
+        return job
+    except Exception as e:
+        conn.rollback()
+        print(f"[IMPORT_JOB] job {job_id} failed: {type(e).__name__}: {e}")
+        fail_import_job(cur, job_id, str(e))
+        conn.commit()
+        raise
+    finally:
+        cur.close()
+
+def import_job_batch(cur, job: dict, rows: list, criteria_ids: dict, definition: dict,
+                     existing_companies: set) -> tuple:
+    """
+    Пачка задачи с учётом ошибок по строкам. Если пачка падает в базе, она
+    повторяется построчно под savepoint: в отчёт попадают только виновные
+    строки, остальные импортируются. Возвращает (imported, skipped, failed, errors).
+    """
+    first_row = job['rows_done'] + 1
+    params = (job['organization_id'], job['user_id'], job['matrix_id'], job['mapping'])
+    errors = []
+    
+    cur.execute("SAVEPOINT import_batch")
+    try:
+        imported, skipped = import_batch(
+            cur, *params, rows, criteria_ids, definition, existing_companies, errors, first_row
+        )
+        cur.execute("RELEASE SAVEPOINT import_batch")
+        return imported, skipped, 0, errors
+    except psycopg2.Error:
+        cur.execute("ROLLBACK TO SAVEPOINT import_batch")
+    
+    # Названия из откатившейся пачки снова свободны
+    existing_companies.clear()
+    existing_companies.update(load_existing_company_keys(cur.connection, job['organization_id']))
+    
+    imported = skipped = failed = 0
+    errors = []
+    for offset, row in enumerate(rows):
+        cur.execute("SAVEPOINT import_row")
+        try:
+            row_imported, row_skipped = import_batch(
+                cur, *params, [row], criteria_ids, definition, existing_companies, errors, first_row + offset
+            )
+            cur.execute("RELEASE SAVEPOINT import_row")
+            imported += row_imported
+            skipped += row_skipped
+        except psycopg2.Error as e:
+            cur.execute("ROLLBACK TO SAVEPOINT import_row")
+            company_name = map_row(row, job['mapping'])[0].get('company_name')
+            if company_name:
+                existing_companies.discard(normalize_company_name(company_name))
+            failed += 1
+            detail = (e.pgerror or str(e)).strip().splitlines()
+            errors.append(row_error(first_row + offset, 'db_error', detail[0][:200] if detail else None))
+    
+    return imported, skipped, failed, errors
+
+def run_pending_import_jobs(conn, time_budget: float = IMPORT_JOB_TIME_BUDGET) -> list:
+    """Продвинуть незавершённые задачи импорта (вызов по таймеру)"""
+    deadline = time.monotonic() + time_budget
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT id FROM import_jobs WHERE status = 'running' ORDER BY id")
+        job_ids = [row[0] for row in cur.fetchall()]
+    finally:
+        cur.close()
+    
+    jobs = []
+    for job_id in job_ids:
+        left = deadline - time.monotonic()
+        if left <= 0:
+            break
+        try:
+            job = run_import_job(conn, job_id, left)
+        except Exception:
             continue
+        if job:
+            jobs.append(job)
+    return jobs
+
+def is_timer_event(event: dict) -> bool:
+    """Вызов от триггера-таймера, а не HTTP-запрос"""
+    messages = event.get('messages') or []
+    return bool(messages) and all(
+        str((m.get('event_metadata') or {}).get('event_type', '')).endswith('TimerMessage')
+        for m in messages
+    )
+
+def handle_timer() -> dict:
+    """Таймер: продвинуть фоновые задачи импорта"""
+    conn = get_db_connection()
+    try:
+        jobs = run_pending_import_jobs(conn)
+    finally:
+        conn.close()
     
-    conn.commit()
-    cur.close()
-    conn.close()
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'import_jobs': [
+            {key: job[key] for key in ('id', 'status', 'rows_done', 'progress')} for job in jobs
+        ]}),
+        'isBase64Encoded': False
+    }
+
+def handle_upload(action: str, organization_id: int, user_id: int, body: dict) -> dict:
+    """Upload-сессии: upload_begin, upload_chunk, upload_commit, upload_status"""
+    try:
+        upload_id = int(body['upload_id']) if action != 'upload_begin' else None
+        chunk_index = int(body.get('chunk_index') or 0)
+        chunks_count = int(body['chunks_count']) if body.get('chunks_count') is not None else None
+    except (KeyError, TypeError, ValueError):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Некорректные параметры загрузки'}),
+            'isBase64Encoded': False
+        }
+    
+    conn = get_db_connection()
+    try:
+        if action == 'upload_begin':
+            upload = begin_upload(conn, organization_id, user_id, body.get('file_type', 'csv'), body.get('file_name'))
+        elif action == 'upload_chunk':
+            try:
+                data = base64.b64decode(''.join((body.get('data') or '').split()), validate=True)
+            except ValueError:
+                raise ValueError('Ошибка декодирования чанка')
+            chunk = append_chunk(conn, upload_id, organization_id, chunk_index, data)
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps(chunk),
+                'isBase64Encoded': False
+            }
+        elif action == 'upload_commit':
+            upload = commit_upload(conn, upload_id, organization_id, chunks_count)
+        else:
+            cur = conn.cursor()
+            upload = get_upload(cur, upload_id, organization_id)
+            cur.close()
+            if not upload:
+                raise LookupError('Загрузка не найдена')
+    except LookupError as e:
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+    finally:
+        conn.close()
     
     return {
         'statusCode': 200,
         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({
-            'success': True,
-            'imported': imported_count,
-            'skipped': skipped_count,
-            'total': len(rows)
-        }),
+        'body': json.dumps(upload_summary(upload)),
         'isBase64Encoded': False
     }
 
-def calculate_scores(cur, client_id: int) -> tuple:
-    """Расчет score_x и score_y на основе критериев"""
+def prepare_import_criteria(cur, matrix_id: int, mapping: dict) -> dict:
+    """
+    Найти или создать критерии из маппинга, вернуть {имя критерия: id}.
+    Новые критерии поднимают версию матрицы (кэш определений в matrix_loader);
+    вызывающий коммитит до cached_matrix_definition, чтобы в кэш не попала
+    версия, которая может откатиться.
+    """
+    criterion_names = list({
+        crm_field.replace('criterion_', '')
+        for crm_field in mapping.values()
+        if crm_field.startswith('criterion_')
+    })
+    
+    if not criterion_names:
+        return {}
+    
     cur.execute("""
-        SELECT mc.axis, mc.weight, mc.min_value, mc.max_value, cs.score
-        FROM client_scores cs
-        JOIN matrix_criteria mc ON cs.criterion_id = mc.id
-        WHERE cs.client_id = {client_id}
-    """.format(client_id=client_id))
+        SELECT name, id FROM matrix_criteria
+        WHERE matrix_id = %s AND name = ANY(%s)
+    """, (matrix_id, criterion_names))
     
-    scores = cur.fetchall()
+    criteria_ids = dict(cur.fetchall())
+    missing = [name for name in criterion_names if name not in criteria_ids]
     
-    x_scores = []
-    y_scores = []
+    if missing:
+        created = execute_values(cur, """
+            INSERT INTO matrix_criteria (matrix_id, name, axis, weight, min_value, max_value, created_at)
+            VALUES %s
+            RETURNING name, id
+        """, [(matrix_id, name) for name in missing],
+            template="(%s, %s, 'x', 1.0, 0.0, 10.0, NOW())", fetch=True)
+        criteria_ids.update(dict(created))
+        bump_matrix_version(cur, matrix_id)
     
-    for axis, weight, min_val, max_val, score in scores:
-        normalized = ((score - min_val) / (max_val - min_val)) * weight if (max_val - min_val) > 0 else 0
-        
-        if axis == 'x':
-            x_scores.append(normalized)
-        else:
-            y_scores.append(normalized)
+    return criteria_ids
+
+def map_row(row: dict, mapping: dict) -> tuple:
+    """Разложить строку файла на поля клиента и оценки по критериям"""
+    client_data = {}
+    custom_scores = {}
     
-    score_x = sum(x_scores) / len(x_scores) * 10 if x_scores else 0
-    score_y = sum(y_scores) / len(y_scores) * 10 if y_scores else 0
+    for file_col, crm_field in mapping.items():
+        value = row.get(file_col, '')
+        if isinstance(value, str):
+            value = value.strip()
+        
+        if crm_field == 'skip' or not value:
+            continue
+        
+        if crm_field in CLIENT_FIELDS:
+            client_data[crm_field] = str(value)
+        elif crm_field.startswith('criterion_'):
+            criterion_name = crm_field.replace('criterion_', '')
+            try:
+                custom_scores[criterion_name] = float(value)
+            except (TypeError, ValueError):
+                pass
     
-    return round(score_x, 2), round(score_y, 2)
+    return client_data, custom_scores
 
-def determine_quadrant(cur, matrix_id: int, score_x: float, score_y: float) -> str:
-    """Определяет квадрант на основе правил матрицы (гибкая логика)"""
-    cur.execute("""
-        SELECT quadrant, x_min, y_min, x_operator
-        FROM matrix_quadrant_rules
-        WHERE matrix_id = {matrix_id}
-        ORDER BY priority ASC
-    """.format(matrix_id=matrix_id))
-    
-    rules = cur.fetchall()
-    
-    for rule in rules:
-        quadrant, x_min, y_min, x_operator = rule
-        x_min = float(x_min)
-        y_min = float(y_min)
+def import_batch(cur, organization_id: int, user_id: int, matrix_id: int, mapping: dict,
+                 rows: list, criteria_ids: dict, definition: dict, existing_companies: set,
+                 errors: list = None, first_row: int = 1) -> tuple:
+    """
+    Импорт пачки строк: дубли отсекаются по нормализованным названиям
+    existing_companies (пополняется, так ловятся и повторы внутри файла),
+    оценки считаются в памяти, клиенты и client_scores пишутся двумя
+    многострочными INSERT. Возвращает (imported, skipped); причины пропуска
+    строк (с номерами от first_row) добавляются в errors, если он передан.
+    """
+    clients_values = []
+    scores_by_company = {}
+    skipped = 0
+    
+    for offset, row in enumerate(rows):
+        client_data, custom_scores = map_row(row, mapping)
+        company_name = client_data.get('company_name')
+        
+        company_key = normalize_company_name(company_name) if company_name else None
+        
+        if not company_name or company_key in existing_companies:
+            skipped += 1
+            if errors is not None:
+                errors.append(row_error(first_row + offset, 'duplicate' if company_name else 'no_company_name'))
+            continue
+        
+        too_long = [field for field, limit in FIELD_LIMITS.items() if len(client_data.get(field, '')) > limit]
+        if too_long:
+            skipped += 1
+            if errors is not None:
+                errors.append(row_error(first_row + offset, 'too_long', ', '.join(too_long)))
+            continue
         
-        if x_operator == 'AND':
-            if score_x >= x_min and score_y >= y_min:
-                return quadrant
-        else:  # OR
-            if score_x >= x_min or score_y >= y_min:
-                return quadrant
-    
-    return 'archive'  # fallback
+        criterion_scores = [
+            (criteria_ids[criterion_name], score_value)
+            for criterion_name, score_value in custom_scores.items()
+            if criteria_ids.get(criterion_name)
+        ]
+        score_x, score_y, quadrant = score_client(criterion_scores, definition)
+        
+        existing_companies.add(company_key)
+        scores_by_company[company_name] = criterion_scores
+        clients_values.append((
+            organization_id, matrix_id, company_name,
+            client_data.get('contact_person', ''),
+            client_data.get('email', ''),
+            client_data.get('phone', ''),
+            client_data.get('description', ''),
+            score_x, score_y, quadrant, user_id, user_id
+        ))
+    
+    if not clients_values:
+        return 0, skipped
+    
+    # Места в лимите тарифа - одним UPDATE на пачку
+    reserve_usage(cur, organization_id, 'clients', len(clients_values))
+    
+    inserted = execute_values(cur, """
+        INSERT INTO clients
+        (organization_id, matrix_id, company_name, contact_person, email, phone, description, score_x, score_y, quadrant, created_by, responsible_user_id, created_at)
+        VALUES %s
+        RETURNING company_name, id
+    """, clients_values,
+        template="(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())",
+        page_size=IMPORT_BATCH_SIZE, fetch=True)
+    
+    scores_values = [
+        (client_id, criterion_id, score_value)
+        for company_name, client_id in inserted
+        for criterion_id, score_value in scores_by_company[company_name]
+    ]
+    
+    if scores_values:
+        execute_values(cur, """
+            INSERT INTO client_scores (client_id, criterion_id, score, created_at)
+            VALUES %s
+        """, scores_values, template="(%s, %s, %s, NOW())", page_size=IMPORT_BATCH_SIZE * 4)
+    
+    add_clients_to_stats(cur, [client_id for _, client_id in inserted])
+    
+    return len(inserted), skipped
 
 def save_template(organization_id: int, user_id: int, body: dict) -> dict:
     """Сохранение шаблона маппинга для повторного использования"""
@@ -514,7 +962,7 @@ def save_template(organization_id: int, user_id: int, body: dict) -> dict:
             'isBase64Encoded': False
         }
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = get_db_connection()
     cur = conn.cursor()
     
     cur.execute("""
@@ -557,7 +1005,7 @@ def save_template(organization_id: int, user_id: int, body: dict) -> dict:
 
 def load_templates(organization_id: int) -> dict:
     """Загрузка сохраненных шаблонов маппинга"""
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = get_db_connection()
     cur = conn.cursor()
     
     cur.execute("""
@@ -6,25 +6,11 @@ import json
 import os
 import jwt
 import bcrypt
-import psycopg2
 import secrets
 from datetime import datetime, timedelta
-from typing import Optional
-
-
-def verify_jwt_token(token: str) -> Optional[dict]:
-    """Проверка JWT токена"""
-    try:
-        secret = os.environ.get('JWT_SECRET')
-        return jwt.decode(token, secret, algorithms=['HS256'])
-    except:
-        return None
-
-
-def get_db_connection():
-    """Подключение к базе данных"""
-    dsn = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(dsn)
+from db import get_db_connection
+from auth import authenticate, AuthError, AuthContext
+from usage_limits import reserve_usage, UsageLimitExceeded
 
 
 def hash_password(password: str) -> str:
@@ -75,31 +61,22 @@ def handler(event: dict, context) -> dict:
         if action == 'accept':
             return handle_accept(body)
         
-        auth_header = event.get('headers', {}).get('X-Authorization', '')
-        token = auth_header.replace('Bearer ', '') if auth_header else ''
-        
-        if not token:
-            return {
-                'statusCode': 401,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Authorization required'})
-            }
-        
-        payload = verify_jwt_token(token)
-        if not payload:
+        try:
+            auth = authenticate(event)
+        except AuthError as e:
             return {
                 'statusCode': 401,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Invalid token'})
+                'body': json.dumps({'error': 'Authorization required' if e.reason == 'missing' else 'Invalid token'})
             }
         
         if method == 'GET':
-            return handle_list(payload)
+            return handle_list(auth)
         elif method == 'POST':
             if action == 'create':
-                return handle_create(payload, body)
+                return handle_create(auth, body)
             elif action == 'cancel':
-                return handle_cancel(payload, body)
+                return handle_cancel(auth, body)
             else:
                 return {
                     'statusCode': 400,
@@ -121,9 +98,9 @@ def handler(event: dict, context) -> dict:
         }
 
 
-def handle_create(payload: dict, body: dict) -> dict:
+def handle_create(auth: AuthContext, body: dict) -> dict:
     """Создание приглашения"""
-    if payload['role'] not in ['owner', 'admin']:
+    if auth.role not in ['owner', 'admin']:
         return {
             'statusCode': 403,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -147,8 +124,8 @@ def handle_create(payload: dict, body: dict) -> dict:
             'body': json.dumps({'error': 'Invalid role. Use: admin, manager, or department_head'})
         }
     
-    organization_id = payload['organization_id']
-    invited_by = payload['user_id']
+    organization_id = auth.organization_id
+    invited_by = auth.user_id
     
     conn = get_db_connection()
     cur = conn.cursor()
@@ -261,6 +238,15 @@ def handle_accept(body: dict) -> dict:
                 'body': json.dumps({'error': 'User already registered'})
             }
         
+        try:
+            reserve_usage(cur, organization_id, 'users')
+        except UsageLimitExceeded as e:
+            return {
+                'statusCode': 403,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': str(e)})
+            }
+        
         password_hash = hash_password(password)
         cur.execute(
             "INSERT INTO users (organization_id, email, password_hash, full_name, role) VALUES (%s, '%s', '%s', '%s', '%s') RETURNING id" % (organization_id, email, password_hash, full_name, role)
@@ -307,9 +293,9 @@ def handle_accept(body: dict) -> dict:
         conn.close()
 
 
-def handle_list(payload: dict) -> dict:
+def handle_list(auth: AuthContext) -> dict:
     """Список приглашений организации"""
-    organization_id = payload['organization_id']
+    organization_id = auth.organization_id
     
     conn = get_db_connection()
     cur = conn.cursor()
@@ -348,9 +334,9 @@ def handle_list(payload: dict) -> dict:
         conn.close()
 
 
-def handle_cancel(payload: dict, body: dict) -> dict:
+def handle_cancel(auth: AuthContext, body: dict) -> dict:
     """Отмена приглашения"""
-    if payload['role'] not in ['owner', 'admin']:
+    if auth.role not in ['owner', 'admin']:
         return {
             'statusCode': 403,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -366,7 +352,7 @@ def handle_cancel(payload: dict, body: dict) -> dict:
             'body': json.dumps({'error': 'invitation_id is required'})
         }
     
-    organization_id = payload['organization_id']
+    organization_id = auth.organization_id
     
     conn = get_db_connection()
     cur = conn.cursor()
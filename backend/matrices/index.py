@@ -4,25 +4,16 @@ API для управления матрицами приоритизации.
 редактировать, деактивировать и получать список всех матриц организации.
 """
 import json
-import os
-import jwt
-import psycopg2
-from typing import Optional
-
-
-def verify_jwt_token(token: str) -> Optional[dict]:
-    """Проверка JWT токена"""
-    try:
-        secret = os.environ.get('JWT_SECRET')
-        return jwt.decode(token, secret, algorithms=['HS256'])
-    except:
-        return None
-
-
-def get_db_connection():
-    """Подключение к базе данных"""
-    dsn = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(dsn)
+from scoring import rescore_matrix
+from matrix_loader import cached_matrix_criteria, cached_quadrant_rules, bump_matrix_version
+from client_stats import apply_rescore_moves
+from matrix_purge import (
+    purge_matrix, purge_expired_matrices, estimate_matrix_delete, start_matrix_delete_job,
+    run_matrix_delete_job, run_pending_delete_jobs, get_matrix_delete_job
+)
+from db import get_db_connection
+from auth import authenticate, AuthError, AuthContext
+from usage_limits import reserve_usage, release_usage, UsageLimitExceeded
 
 
 def handler(event: dict, context) -> dict:
@@ -33,6 +24,8 @@ def handler(event: dict, context) -> dict:
     POST /create - создать новую матрицу с критериями
     POST /update - обновить матрицу и критерии
     POST /delete - деактивировать матрицу
+    POST /purge_expired - удалить матрицы, пролежавшие в корзине больше 3 дней
+    Вызов по таймеру запускает ту же очистку для всех организаций.
     """
     method = event.get('httpMethod', 'GET')
     
@@ -49,23 +42,16 @@ def handler(event: dict, context) -> dict:
             'isBase64Encoded': False
         }
     
-    auth_header = event.get('headers', {}).get('X-Authorization', '')
-    token = auth_header.replace('Bearer ', '') if auth_header else ''
+    if is_timer_event(event):
+        return handle_timer()
     
-    if not token:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Authorization required'}),
-            'isBase64Encoded': False
-        }
-    
-    payload = verify_jwt_token(token)
-    if not payload:
+    try:
+        auth = authenticate(event)
+    except AuthError as e:
         return {
             'statusCode': 401,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Invalid token'}),
+            'body': json.dumps({'error': 'Authorization required' if e.reason == 'missing' else 'Invalid token'}),
             'isBase64Encoded': False
         }
     
@@ -75,36 +61,47 @@ def handler(event: dict, context) -> dict:
             matrix_id = query_params.get('id')
             
             if matrix_id:
-                return handle_get(payload, matrix_id)
+                return handle_get(auth, matrix_id)
             else:
-                return handle_list(payload)
+                return handle_list(auth)
         
         elif method == 'POST':
             body = json.loads(event.get('body', '{}'))
             action = body.get('action')
             
             if action == 'create':
-                return handle_create(payload, body)
+                return handle_create(auth, body)
             elif action == 'update':
-                return handle_update(payload, body)
+                return handle_update(auth, body)
             elif action == 'delete':
-                return handle_delete(payload, body)
+                return handle_delete(auth, body)
             elif action == 'delete_permanently':
-                return handle_delete_permanently(payload, body)
+                return handle_delete_permanently(auth, body)
             elif action == 'update_axis_names':
-                return handle_update_axis_names(payload, body)
+                return handle_update_axis_names(auth, body)
             elif action == 'update_quadrant_rules':
-                return handle_update_quadrant_rules(payload, body)
+                return handle_update_quadrant_rules(auth, body)
             elif action == 'get':
                 matrix_id = body.get('matrix_id')
-                return handle_get(payload, matrix_id)
+                return handle_get(auth, matrix_id)
             elif action == 'get_delete_stats':
-                return handle_get_delete_stats(payload, body)
+                return handle_get_delete_stats(auth, body)
+            elif action == 'delete_job_status':
+                return handle_delete_job_status(auth, body)
+            elif action == 'purge_expired':
+                if auth.role not in ['owner', 'admin']:
+                    return {
+                        'statusCode': 403,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Only owner and admin can purge matrices'}),
+                        'isBase64Encoded': False
+                    }
+                return handle_purge_expired(auth.organization_id)
             else:
                 return {
                     'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Invalid action. Use: create, update, delete, delete_permanently, update_axis_names, update_quadrant_rules, get, or get_delete_stats'}),
+                    'body': json.dumps({'error': 'Invalid action. Use: create, update, delete, delete_permanently, update_axis_names, update_quadrant_rules, get, get_delete_stats, delete_job_status or purge_expired'}),
                     'isBase64Encoded': False
                 }
         else:
@@ -127,19 +124,57 @@ def handler(event: dict, context) -> dict:
         }
 
 
-def handle_list(payload: dict) -> dict:
+def is_timer_event(event: dict) -> bool:
+    """Вызов от триггера-таймера, а не HTTP-запрос"""
+    messages = event.get('messages') or []
+    return bool(messages) and all(
+        str((m.get('event_metadata') or {}).get('event_type', '')).endswith('TimerMessage')
+        for m in messages
+    )
+
+
+def handle_timer() -> dict:
+    """Таймер: продвинуть задачи удаления и очистить корзину матриц"""
+    conn = get_db_connection()
+    try:
+        jobs = run_pending_delete_jobs(conn)
+        result = purge_expired_matrices(conn)
+    finally:
+        conn.close()
+    
+    result['delete_jobs'] = jobs
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps(result),
+        'isBase64Encoded': False
+    }
+
+
+def handle_purge_expired(organization_id: int) -> dict:
+    """Очистка корзины матриц организации"""
+    conn = get_db_connection()
+    try:
+        result = purge_expired_matrices(conn, organization_id)
+    finally:
+        conn.close()
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps(result),
+        'isBase64Encoded': False
+    }
+
+
+def handle_list(auth: AuthContext) -> dict:
     """Список всех матриц организации"""
-    organization_id = payload['organization_id']
+    organization_id = auth.organization_id
     
     conn = get_db_connection()
     cur = conn.cursor()
     
     try:
-        cur.execute(
-            "DELETE FROM matrices WHERE deleted_at < NOW() - INTERVAL '3 days'"
-        )
-        conn.commit()
-        
         cur.execute(
             """
             SELECT m.id, m.name, m.description, m.is_active, m.created_at, m.deleted_at, u.full_name,
@@ -181,9 +216,9 @@ def handle_list(payload: dict) -> dict:
         conn.close()
 
 
-def handle_get(payload: dict, matrix_id: str) -> dict:
+def handle_get(auth: AuthContext, matrix_id: str) -> dict:
     """Получить матрицу с критериями"""
-    organization_id = payload['organization_id']
+    organization_id = auth.organization_id
     
     conn = get_db_connection()
     cur = conn.cursor()
@@ -191,7 +226,7 @@ def handle_get(payload: dict, matrix_id: str) -> dict:
     try:
         cur.execute(
             """
-            SELECT m.id, m.name, m.description, m.is_active, m.created_at, u.full_name, m.axis_x_name, m.axis_y_name
+            SELECT m.id, m.name, m.description, m.is_active, m.created_at, u.full_name, m.axis_x_name, m.axis_y_name, m.definition_version
             FROM matrices m
             LEFT JOIN users u ON m.created_by = u.id
             WHERE m.id = %s AND m.organization_id = %s
@@ -219,68 +254,9 @@ def handle_get(payload: dict, matrix_id: str) -> dict:
             'axis_y_name': result[7] or 'Ось Y'
         }
         
-        cur.execute(
-            """
-            SELECT id, axis, name, description, weight, min_value, max_value, sort_order
-            FROM matrix_criteria
-            WHERE matrix_id = %s
-            ORDER BY axis, sort_order
-            """,
-            (matrix_id,)
-        )
-        
-        criteria = []
-        for row in cur.fetchall():
-            criterion_id = row[0]
-            
-            cur.execute(
-                """SELECT label, weight, sort_order FROM criterion_statuses 
-                   WHERE criterion_id = %s ORDER BY sort_order""",
-                (criterion_id,)
-            )
-            statuses = []
-            for status_row in cur.fetchall():
-                statuses.append({
-                    'label': status_row[0],
-                    'weight': status_row[1],
-                    'sort_order': status_row[2]
-                })
-            
-            criteria.append({
-                'id': criterion_id,
-                'axis': row[1],
-                'name': row[2],
-                'description': row[3],
-                'weight': row[4],
-                'min_value': row[5],
-                'max_value': row[6],
-                'sort_order': row[7],
-                'statuses': statuses
-            })
-        
-        matrix['criteria'] = criteria
-        
-        cur.execute(
-            """
-            SELECT quadrant, x_min, y_min, x_operator, priority
-            FROM matrix_quadrant_rules
-            WHERE matrix_id = %s
-            ORDER BY priority
-            """,
-            (matrix_id,)
-        )
-        
-        quadrant_rules = []
-        for row in cur.fetchall():
-            quadrant_rules.append({
-                'quadrant': row[0],
-                'x_min': float(row[1]),
-                'y_min': float(row[2]),
-                'x_operator': row[3],
-                'priority': row[4]
-            })
-        
-        matrix['quadrant_rules'] = quadrant_rules
+        # Версия уже прочитана вместе с матрицей - кэш не делает отдельного запроса
+        matrix['criteria'] = cached_matrix_criteria(cur, result[0], result[8])
+        matrix['quadrant_rules'] = cached_quadrant_rules(cur, result[0], result[8])
         
         return {
             'statusCode': 200,
@@ -294,9 +270,9 @@ def handle_get(payload: dict, matrix_id: str) -> dict:
         conn.close()
 
 
-def handle_create(payload: dict, body: dict) -> dict:
+def handle_create(auth: AuthContext, body: dict) -> dict:
     """Создание новой матрицы с критериями"""
-    if payload['role'] not in ['owner', 'admin', 'manager']:
+    if auth.role not in ['owner', 'admin', 'manager']:
         return {
             'statusCode': 403,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -324,13 +300,23 @@ def handle_create(payload: dict, body: dict) -> dict:
             'isBase64Encoded': False
         }
     
-    organization_id = payload['organization_id']
-    created_by = payload['user_id']
+    organization_id = auth.organization_id
+    created_by = auth.user_id
     
     conn = get_db_connection()
     cur = conn.cursor()
     
     try:
+        try:
+            reserve_usage(cur, organization_id, 'matrices')
+        except UsageLimitExceeded as e:
+            return {
+                'statusCode': 403,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': str(e)}),
+                'isBase64Encoded': False
+            }
+        
         cur.execute(
             "INSERT INTO matrices (organization_id, name, description, created_by) VALUES (%s, '%s', '%s', %s) RETURNING id" % (organization_id, name.replace("'", "''"), description.replace("'", "''"), created_by)
         )
@@ -385,9 +371,9 @@ def handle_create(payload: dict, body: dict) -> dict:
         conn.close()
 
 
-def handle_update(payload: dict, body: dict) -> dict:
+def handle_update(auth: AuthContext, body: dict) -> dict:
     """Обновление матрицы и критериев"""
-    if payload['role'] not in ['owner', 'admin', 'manager']:
+    if auth.role not in ['owner', 'admin', 'manager']:
         return {
             'statusCode': 403,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -408,7 +394,7 @@ def handle_update(payload: dict, body: dict) -> dict:
             'isBase64Encoded': False
         }
     
-    organization_id = payload['organization_id']
+    organization_id = auth.organization_id
     
     conn = get_db_connection()
     cur = conn.cursor()
@@ -490,6 +476,12 @@ def handle_update(payload: dict, body: dict) -> dict:
                             "INSERT INTO criterion_statuses (criterion_id, label, weight, sort_order) VALUES (%s, '%s', %s, %s)" % (crit_id, status_label.replace("'", "''"), status_weight, status_sort)
                         )
         
+        rescore_stats = {'rescored_clients': 0, 'moved_clients': 0}
+        if criteria:
+            bump_matrix_version(cur, matrix_id)
+            rescore_stats = rescore_matrix(cur, matrix_id)
+            apply_rescore_moves(cur, matrix_id, rescore_stats['moves'])
+        
         conn.commit()
         
         return {
@@ -497,7 +489,9 @@ def handle_update(payload: dict, body: dict) -> dict:
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({
                 'success': True,
-                'message': 'Matrix updated successfully'
+                'message': 'Matrix updated successfully',
+                'rescored_clients': rescore_stats['rescored_clients'],
+                'moved_clients': rescore_stats['moved_clients']
             }),
             'isBase64Encoded': False
         }
@@ -507,9 +501,9 @@ def handle_update(payload: dict, body: dict) -> dict:
         conn.close()
 
 
-def handle_delete(payload: dict, body: dict) -> dict:
+def handle_delete(auth: AuthContext, body: dict) -> dict:
     """Деактивация матрицы (мягкое удаление)"""
-    if payload['role'] not in ['owner', 'admin']:
+    if auth.role not in ['owner', 'admin']:
         return {
             'statusCode': 403,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -527,7 +521,7 @@ def handle_delete(payload: dict, body: dict) -> dict:
             'isBase64Encoded': False
         }
     
-    organization_id = payload['organization_id']
+    organization_id = auth.organization_id
     
     conn = get_db_connection()
     cur = conn.cursor()
@@ -554,7 +548,14 @@ def handle_delete(payload: dict, body: dict) -> dict:
                 'isBase64Encoded': False
             }
         
-        cur.execute("UPDATE matrices SET deleted_at = CURRENT_TIMESTAMP WHERE id = %s" % matrix_id)
+        # Матрица в корзине не занимает место в лимите тарифа
+        cur.execute(
+            "UPDATE matrices SET deleted_at = CURRENT_TIMESTAMP WHERE id = %s AND deleted_at IS NULL RETURNING is_template",
+            (matrix_id,)
+        )
+        row = cur.fetchone()
+        if row and not row[0]:
+            release_usage(cur, organization_id, 'matrices')
         conn.commit()
         
         return {
@@ -572,9 +573,9 @@ def handle_delete(payload: dict, body: dict) -> dict:
         conn.close()
 
 
-def handle_update_axis_names(payload: dict, body: dict) -> dict:
+def handle_update_axis_names(auth: AuthContext, body: dict) -> dict:
     """Обновление названий осей матрицы"""
-    if payload['role'] not in ['owner', 'admin', 'manager']:
+    if auth.role not in ['owner', 'admin', 'manager']:
         return {
             'statusCode': 403,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -594,7 +595,7 @@ def handle_update_axis_names(payload: dict, body: dict) -> dict:
             'isBase64Encoded': False
         }
     
-    organization_id = payload['organization_id']
+    organization_id = auth.organization_id
     
     conn = get_db_connection()
     cur = conn.cursor()
@@ -641,9 +642,9 @@ def handle_update_axis_names(payload: dict, body: dict) -> dict:
         conn.close()
 
 
-def handle_delete_permanently(payload: dict, body: dict) -> dict:
+def handle_delete_permanently(auth: AuthContext, body: dict) -> dict:
     """Полное удаление матрицы"""
-    if payload['role'] not in ['owner', 'admin']:
+    if auth.role not in ['owner', 'admin']:
         return {
             'statusCode': 403,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -661,7 +662,7 @@ def handle_delete_permanently(payload: dict, body: dict) -> dict:
             'isBase64Encoded': False
         }
     
-    organization_id = payload['organization_id']
+    organization_id = auth.organization_id
     
     conn = get_db_connection()
     cur = conn.cursor()
@@ -696,40 +697,18 @@ def handle_delete_permanently(payload: dict, body: dict) -> dict:
                 'isBase64Encoded': False
             }
         
-        # Каскадное удаление в правильном порядке
-        
-        # 1. Удаляем оценки клиентов по критериям (client_scores и client_criterion_scores)
-        cur.execute(
-            "DELETE FROM client_scores WHERE criterion_id IN (SELECT id FROM matrix_criteria WHERE matrix_id = %s)" % matrix_id
-        )
-        deleted_client_scores = cur.rowcount
-        
-        cur.execute(
-            "DELETE FROM client_criterion_scores WHERE criterion_id IN (SELECT id FROM matrix_criteria WHERE matrix_id = %s)" % matrix_id
-        )
-        deleted_criterion_scores = cur.rowcount
-        
-        # 2. Удаляем статусы критериев
-        cur.execute(
-            "DELETE FROM criterion_statuses WHERE criterion_id IN (SELECT id FROM matrix_criteria WHERE matrix_id = %s)" % matrix_id
-        )
-        deleted_statuses = cur.rowcount
-        
-        # 3. Удаляем критерии матрицы
-        cur.execute(
-            "DELETE FROM matrix_criteria WHERE matrix_id = %s" % matrix_id
-        )
-        deleted_criteria = cur.rowcount
-        
-        # 4. Отвязываем клиентов от матрицы (НЕ удаляем их!)
-        cur.execute(
-            "UPDATE clients SET matrix_id = NULL, score_x = 0, score_y = 0, quadrant = NULL WHERE matrix_id = %s" % matrix_id
-        )
-        unlinked_clients = cur.rowcount
-        
-        # 5. Удаляем саму матрицу
-        cur.execute("DELETE FROM matrices WHERE id = %s" % matrix_id)
+        # Большие матрицы - задачей с чанками и контрольными точками
+        if body.get('mode') == 'job':
+            job = start_matrix_delete_job(conn, int(matrix_id), organization_id)
+            job = run_matrix_delete_job(conn, job['id'])
+            return {
+                'statusCode': 200 if job['status'] == 'done' else 202,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'job': job}),
+                'isBase64Encoded': False
+            }
         
+        counts = purge_matrix(cur, int(matrix_id))
         conn.commit()
         
         return {
@@ -738,9 +717,9 @@ def handle_delete_permanently(payload: dict, body: dict) -> dict:
             'body': json.dumps({
                 'success': True,
                 'message': 'Матрица удалена навсегда',
-                'deleted_criteria': deleted_criteria,
-                'deleted_statuses': deleted_statuses,
-                'unlinked_clients': unlinked_clients
+                'deleted_criteria': counts['deleted_criteria'],
+                'deleted_statuses': counts['deleted_statuses'],
+                'unlinked_clients': counts['unlinked_clients']
             }),
             'isBase64Encoded': False
         }
@@ -750,9 +729,9 @@ def handle_delete_permanently(payload: dict, body: dict) -> dict:
         conn.close()
 
 
-def handle_update_quadrant_rules(payload: dict, body: dict) -> dict:
+def handle_update_quadrant_rules(auth: AuthContext, body: dict) -> dict:
     """Обновление правил квадрантов матрицы"""
-    if payload['role'] not in ['owner', 'admin', 'manager']:
+    if auth.role not in ['owner', 'admin', 'manager']:
         return {
             'statusCode': 403,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -779,7 +758,7 @@ def handle_update_quadrant_rules(payload: dict, body: dict) -> dict:
             'isBase64Encoded': False
         }
     
-    organization_id = payload['organization_id']
+    organization_id = auth.organization_id
     
     conn = get_db_connection()
     cur = conn.cursor()
@@ -819,6 +798,10 @@ def handle_update_quadrant_rules(payload: dict, body: dict) -> dict:
                 "INSERT INTO matrix_quadrant_rules (matrix_id, quadrant, x_min, y_min, x_operator, priority) VALUES (%s, '%s', %s, %s, '%s', %s)" % (matrix_id, quadrant, x_min, y_min, x_operator, priority)
             )
         
+        bump_matrix_version(cur, matrix_id)
+        rescore_stats = rescore_matrix(cur, matrix_id)
+        apply_rescore_moves(cur, matrix_id, rescore_stats['moves'])
+        
         conn.commit()
         
         return {
@@ -826,7 +809,9 @@ def handle_update_quadrant_rules(payload: dict, body: dict) -> dict:
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({
                 'success': True,
-                'message': 'Quadrant rules updated successfully'
+                'message': 'Quadrant rules updated successfully',
+                'rescored_clients': rescore_stats['rescored_clients'],
+                'moved_clients': rescore_stats['moved_clients']
             }),
             'isBase64Encoded': False
         }
@@ -836,9 +821,9 @@ def handle_update_quadrant_rules(payload: dict, body: dict) -> dict:
         conn.close()
 
 
-def handle_get_delete_stats(payload: dict, body: dict) -> dict:
+def handle_get_delete_stats(auth: AuthContext, body: dict) -> dict:
     """Получить статистику для предупреждения перед удалением матрицы"""
-    if payload['role'] not in ['owner', 'admin']:
+    if auth.role not in ['owner', 'admin']:
         return {
             'statusCode': 403,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -856,7 +841,7 @@ def handle_get_delete_stats(payload: dict, body: dict) -> dict:
             'isBase64Encoded': False
         }
     
-    organization_id = payload['organization_id']
+    organization_id = auth.organization_id
     
     conn = get_db_connection()
     cur = conn.cursor()
@@ -878,36 +863,69 @@ def handle_get_delete_stats(payload: dict, body: dict) -> dict:
         
         matrix_name = result[0]
         
-        # Подсчёт критериев
-        cur.execute(
-            "SELECT COUNT(*) FROM matrix_criteria WHERE matrix_id = %s" % matrix_id
-        )
-        criteria_count = cur.fetchone()[0]
-        
-        # Подсчёт статусов критериев
-        cur.execute(
-            "SELECT COUNT(*) FROM criterion_statuses WHERE criterion_id IN (SELECT id FROM matrix_criteria WHERE matrix_id = %s)" % matrix_id
-        )
-        statuses_count = cur.fetchone()[0]
-        
-        # Подсчёт клиентов
-        cur.execute(
-            "SELECT COUNT(*) FROM clients WHERE matrix_id = %s" % matrix_id
-        )
-        clients_count = cur.fetchone()[0]
+        estimate = estimate_matrix_delete(cur, int(matrix_id))
         
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({
                 'matrix_name': matrix_name,
-                'criteria_count': criteria_count,
-                'statuses_count': statuses_count,
-                'clients_count': clients_count
+                **estimate
             }),
             'isBase64Encoded': False
         }
     
     finally:
         cur.close()
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+
+
+def handle_delete_job_status(auth: AuthContext, body: dict) -> dict:
+    """Прогресс задачи удаления матрицы; незавершённая задача продвигается дальше"""
+    if auth.role not in ['owner', 'admin']:
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Only owner and admin can permanently delete matrices'}),
+            'isBase64Encoded': False
+        }
+    
+    job_id = body.get('job_id')
+    
+    if not job_id:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'job_id is required'}),
+            'isBase64Encoded': False
+        }
+    
+    conn = get_db_connection()
+    cur = conn.cursor()
+    
+    try:
+        job = get_matrix_delete_job(cur, int(job_id), auth.organization_id)
+        
+        if not job:
+            return {
+                'statusCode': 404,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Delete job not found'}),
+                'isBase64Encoded': False
+            }
+        
+        if job['status'] == 'running' and body.get('advance', True):
+            conn.rollback()
+            job = run_matrix_delete_job(conn, job['id'])
+        
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'job': job}),
+            'isBase64Encoded': False
+        }
+    
+    finally:
+        cur.close()
+        conn.close()
@@ -0,0 +1,387 @@
+"""
+Удаление матриц навсегда: каскад по критериям, статусам и оценкам
+с отвязкой клиентов, и фоновая очистка матриц, удалённых больше
+MATRIX_PURGE_AFTER_DAYS дней назад.
+
+Очистка запускается таймером (или действием purge_expired) и идёт
+пачками: каждая матрица удаляется в своей транзакции, за один запуск
+обрабатывается не больше MATRIX_PURGE_BATCH * MATRIX_PURGE_MAX_BATCHES
+матриц, остаток доберёт следующий запуск.
+
+Большие матрицы удаляются задачей (matrix_delete_jobs): зависимые таблицы
+чистятся чанками по диапазонам id в коротких транзакциях, после каждого
+чанка сохраняется контрольная точка (phase, last_id). Задача продолжается
+с неё при следующем вызове или по таймеру.
+"""
+import os
+import time
+from typing import Optional
+
+from client_stats import (
+    client_stats_snapshot, detach_matrix_client_stats, record_client_stats_change
+)
+
+MATRIX_PURGE_AFTER_DAYS = 3
+MATRIX_PURGE_BATCH = int(os.environ.get('MATRIX_PURGE_BATCH', '20'))
+MATRIX_PURGE_MAX_BATCHES = int(os.environ.get('MATRIX_PURGE_MAX_BATCHES', '10'))
+MATRIX_DELETE_CHUNK = int(os.environ.get('MATRIX_DELETE_CHUNK', '5000'))
+MATRIX_DELETE_TIME_BUDGET = float(os.environ.get('MATRIX_DELETE_TIME_BUDGET', '20'))
+
+# Фазы задачи удаления по порядку
+DELETE_PHASES = ('client_scores', 'client_criterion_scores', 'clients', 'criteria', 'done')
+
+JOB_FIELDS = (
+    'id', 'matrix_id', 'organization_id', 'status', 'phase', 'last_id',
+    'estimated_rows', 'processed_rows', 'deleted_scores', 'unlinked_clients',
+    'deleted_statuses', 'deleted_criteria', 'error'
+)
+
+
+def purge_matrix(cur, matrix_id: int) -> dict:
+    """Удалить матрицу со всеми зависимыми данными; коммит делает вызывающий"""
+    # 1. Оценки клиентов по критериям (client_scores и client_criterion_scores)
+    cur.execute(
+        "DELETE FROM client_scores WHERE criterion_id IN (SELECT id FROM matrix_criteria WHERE matrix_id = %s)",
+        (matrix_id,)
+    )
+    deleted_client_scores = cur.rowcount
+
+    cur.execute(
+        "DELETE FROM client_criterion_scores WHERE criterion_id IN (SELECT id FROM matrix_criteria WHERE matrix_id = %s)",
+        (matrix_id,)
+    )
+    deleted_criterion_scores = cur.rowcount
+
+    # 2. Статусы критериев
+    cur.execute(
+        "DELETE FROM criterion_statuses WHERE criterion_id IN (SELECT id FROM matrix_criteria WHERE matrix_id = %s)",
+        (matrix_id,)
+    )
+    deleted_statuses = cur.rowcount
+
+    # 3. Критерии матрицы
+    cur.execute("DELETE FROM matrix_criteria WHERE matrix_id = %s", (matrix_id,))
+    deleted_criteria = cur.rowcount
+
+    # 4. Отвязываем клиентов от матрицы (НЕ удаляем их!)
+    cur.execute(
+        "UPDATE clients SET matrix_id = NULL, score_x = 0, score_y = 0, quadrant = NULL WHERE matrix_id = %s",
+        (matrix_id,)
+    )
+    unlinked_clients = cur.rowcount
+    detach_matrix_client_stats(cur, matrix_id)
+
+    # 5. Сама матрица (место в лимите тарифа освобождено ещё при переносе в корзину)
+    cur.execute("DELETE FROM matrices WHERE id = %s", (matrix_id,))
+
+    return {
+        'deleted_client_scores': deleted_client_scores + deleted_criterion_scores,
+        'deleted_criteria': deleted_criteria,
+        'deleted_statuses': deleted_statuses,
+        'unlinked_clients': unlinked_clients
+    }
+
+
+def purge_expired_matrices(conn, organization_id: Optional[int] = None,
+                           batch_size: int = MATRIX_PURGE_BATCH,
+                           max_batches: int = MATRIX_PURGE_MAX_BATCHES) -> dict:
+    """
+    Удалить матрицы с истёкшим сроком в корзине. Возвращает прогресс:
+    сколько удалено за запуск, сколько осталось и сколько упало с ошибкой.
+    """
+    # Матрицы с незавершённой задачей удаления дочищает сама задача
+    scope = (
+        "deleted_at < NOW() - %s * INTERVAL '1 day' AND NOT EXISTS ("
+        "SELECT 1 FROM matrix_delete_jobs j WHERE j.matrix_id = matrices.id AND j.status = 'running')"
+    )
+    scope_params = [MATRIX_PURGE_AFTER_DAYS]
+    if organization_id is not None:
+        scope += " AND organization_id = %s"
+        scope_params.append(organization_id)
+
+    purged = 0
+    failed = []
+    totals = {'deleted_client_scores': 0, 'deleted_criteria': 0, 'deleted_statuses': 0, 'unlinked_clients': 0}
+
+    cur = conn.cursor()
+    try:
+        for _ in range(max_batches):
+            cur.execute(
+                f"SELECT id FROM matrices WHERE {scope} AND NOT (id = ANY(%s)) ORDER BY deleted_at, id LIMIT %s",
+                scope_params + [failed, batch_size]
+            )
+            matrix_ids = [row[0] for row in cur.fetchall()]
+            if not matrix_ids:
+                break
+
+            for matrix_id in matrix_ids:
+                try:
+                    # Строка матрицы блокируется, параллельный запуск её пропустит
+                    cur.execute(
+                        f"SELECT id FROM matrices WHERE id = %s AND {scope} FOR UPDATE SKIP LOCKED",
+                        [matrix_id] + scope_params
+                    )
+                    if cur.fetchone() is None:
+                        conn.rollback()
+                        failed.append(matrix_id)
+                        continue
+                    counts = purge_matrix(cur, matrix_id)
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    print(f"[MATRIX_PURGE] matrix {matrix_id} failed: {type(e).__name__}: {e}")
+                    failed.append(matrix_id)
+                    continue
+
+                purged += 1
+                for key, value in counts.items():
+                    totals[key] += value
+
+        cur.execute(f"SELECT COUNT(*) FROM matrices WHERE {scope}", scope_params)
+        remaining = cur.fetchone()[0]
+    finally:
+        cur.close()
+
+    print(f"[MATRIX_PURGE] purged={purged} remaining={remaining} skipped={len(failed)}")
+    return {
+        'purged_matrices': purged,
+        'remaining_matrices': remaining,
+        'skipped_matrices': failed,
+        **totals
+    }
+
+
+def estimate_matrix_delete(cur, matrix_id: int) -> dict:
+    """Сколько строк затронет удаление матрицы"""
+    cur.execute("SELECT COUNT(*) FROM matrix_criteria WHERE matrix_id = %s", (matrix_id,))
+    criteria_count = cur.fetchone()[0]
+
+    cur.execute(
+        "SELECT COUNT(*) FROM criterion_statuses WHERE criterion_id IN (SELECT id FROM matrix_criteria WHERE matrix_id = %s)",
+        (matrix_id,)
+    )
+    statuses_count = cur.fetchone()[0]
+
+    cur.execute("SELECT COUNT(*) FROM clients WHERE matrix_id = %s", (matrix_id,))
+    clients_count = cur.fetchone()[0]
+
+    cur.execute(
+        """
+        SELECT (SELECT COUNT(*) FROM client_scores WHERE criterion_id IN (SELECT id FROM matrix_criteria WHERE matrix_id = %s))
+             + (SELECT COUNT(*) FROM client_criterion_scores WHERE criterion_id IN (SELECT id FROM matrix_criteria WHERE matrix_id = %s))
+        """,
+        (matrix_id, matrix_id)
+    )
+    scores_count = cur.fetchone()[0]
+
+    return {
+        'criteria_count': criteria_count,
+        'statuses_count': statuses_count,
+        'clients_count': clients_count,
+        'scores_count': scores_count
+    }
+
+
+def job_to_dict(row) -> dict:
+    job = dict(zip(JOB_FIELDS, row))
+    estimated = job['estimated_rows'] or 0
+    job['progress'] = 1.0 if job['phase'] == 'done' else (
+        round(min(job['processed_rows'] / estimated, 0.99), 4) if estimated else 0.0
+    )
+    return job
+
+
+def get_matrix_delete_job(cur, job_id: int, organization_id: int) -> Optional[dict]:
+    cur.execute(
+        f"SELECT {', '.join(JOB_FIELDS)} FROM matrix_delete_jobs WHERE id = %s AND organization_id = %s",
+        (job_id, organization_id)
+    )
+    row = cur.fetchone()
+    return job_to_dict(row) if row else None
+
+
+def start_matrix_delete_job(conn, matrix_id: int, organization_id: int) -> dict:
+    """
+    Создать задачу удаления или вернуть уже запущенную для этой матрицы.
+    Упавшая задача перезапускается с сохранённой контрольной точки.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            UPDATE matrix_delete_jobs SET status = 'running', error = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE id = (
+                SELECT id FROM matrix_delete_jobs
+                WHERE matrix_id = %s AND status = 'failed'
+                ORDER BY id DESC LIMIT 1
+            )
+            AND NOT EXISTS (SELECT 1 FROM matrix_delete_jobs WHERE matrix_id = %s AND status = 'running')
+            """,
+            (matrix_id, matrix_id)
+        )
+        cur.execute(
+            f"SELECT {', '.join(JOB_FIELDS)} FROM matrix_delete_jobs WHERE matrix_id = %s AND status = 'running'",
+            (matrix_id,)
+        )
+        row = cur.fetchone()
+        if row:
+            conn.commit()
+            return job_to_dict(row)
+
+        estimate = estimate_matrix_delete(cur, matrix_id)
+        estimated_rows = sum(estimate.values())
+        cur.execute(
+            f"""
+            INSERT INTO matrix_delete_jobs (matrix_id, organization_id, status, phase, estimated_rows)
+            VALUES (%s, %s, 'running', %s, %s)
+            ON CONFLICT (matrix_id) WHERE status = 'running' DO NOTHING
+            RETURNING {', '.join(JOB_FIELDS)}
+            """,
+            (matrix_id, organization_id, DELETE_PHASES[0], estimated_rows)
+        )
+        row = cur.fetchone()
+        if row is None:
+            # Параллельный запрос успел создать задачу
+            cur.execute(
+                f"SELECT {', '.join(JOB_FIELDS)} FROM matrix_delete_jobs WHERE matrix_id = %s AND status = 'running'",
+                (matrix_id,)
+            )
+            row = cur.fetchone()
+        conn.commit()
+        return job_to_dict(row)
+    finally:
+        cur.close()
+
+
+def run_matrix_delete_job(conn, job_id: int, time_budget: float = MATRIX_DELETE_TIME_BUDGET) -> Optional[dict]:
+    """
+    Продвинуть задачу чанками, пока не кончится time_budget. Каждый чанк -
+    отдельная транзакция под блокировкой строки задачи; если задачу уже
+    выполняет другой запрос, возвращается её текущее состояние.
+    """
+    deadline = time.monotonic() + time_budget
+    cur = conn.cursor()
+    try:
+        while True:
+            cur.execute(
+                f"SELECT {', '.join(JOB_FIELDS)} FROM matrix_delete_jobs WHERE id = %s FOR UPDATE SKIP LOCKED",
+                (job_id,)
+            )
+            row = cur.fetchone()
+            if row is None:
+                conn.rollback()
+                cur.execute(f"SELECT {', '.join(JOB_FIELDS)} FROM matrix_delete_jobs WHERE id = %s", (job_id,))
+                row = cur.fetchone()
+                return job_to_dict(row) if row else None
+
+            job = job_to_dict(row)
+            if job['status'] != 'running' or time.monotonic() >= deadline:
+                conn.rollback()
+                return job
+
+            try:
+                _run_delete_chunk(cur, job)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                print(f"[MATRIX_DELETE] job {job_id} failed in {job['phase']}: {type(e).__name__}: {e}")
+                cur.execute(
+                    "UPDATE matrix_delete_jobs SET status = 'failed', error = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
+                    (str(e)[:500], job_id)
+                )
+                conn.commit()
+                raise
+    finally:
+        cur.close()
+
+
+def run_pending_delete_jobs(conn, time_budget: float = MATRIX_DELETE_TIME_BUDGET) -> list:
+    """Продвинуть незавершённые задачи (вызов по таймеру)"""
+    deadline = time.monotonic() + time_budget
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT id FROM matrix_delete_jobs WHERE status = 'running' ORDER BY id")
+        job_ids = [row[0] for row in cur.fetchall()]
+    finally:
+        cur.close()
+
+    jobs = []
+    for job_id in job_ids:
+        left = deadline - time.monotonic()
+        if left <= 0:
+            break
+        try:
+            job = run_matrix_delete_job(conn, job_id, left)
+        except Exception:
+            continue
+        if job:
+            jobs.append(job)
+    return jobs
+
+
+def _run_delete_chunk(cur, job: dict):
+    """Один чанк текущей фазы; обновляет контрольную точку в matrix_delete_jobs"""
+    matrix_id = job['matrix_id']
+    phase = job['phase']
+    last_id = job['last_id']
+    counters = {}
+
+    if phase in ('client_scores', 'client_criterion_scores'):
+        cur.execute(
+            f"""
+            DELETE FROM {phase} WHERE id IN (
+                SELECT id FROM {phase}
+                WHERE criterion_id IN (SELECT id FROM matrix_criteria WHERE matrix_id = %s) AND id > %s
+                ORDER BY id
+                LIMIT %s
+            )
+            RETURNING id
+            """,
+            (matrix_id, last_id, MATRIX_DELETE_CHUNK)
+        )
+        ids = [row[0] for row in cur.fetchall()]
+        counters['deleted_scores'] = len(ids)
+
+    elif phase == 'clients':
+        cur.execute(
+            "SELECT id FROM clients WHERE matrix_id = %s AND id > %s ORDER BY id LIMIT %s FOR UPDATE",
+            (matrix_id, last_id, MATRIX_DELETE_CHUNK)
+        )
+        ids = [row[0] for row in cur.fetchall()]
+        if ids:
+            before = client_stats_snapshot(cur, ids)
+            cur.execute(
+                "UPDATE clients SET matrix_id = NULL, score_x = 0, score_y = 0, quadrant = NULL WHERE id = ANY(%s)",
+                (ids,)
+            )
+            record_client_stats_change(cur, before, client_stats_snapshot(cur, ids))
+        counters['unlinked_clients'] = len(ids)
+
+    else:
+        # Остаток: статусы, критерии и сама матрица - немного строк, одной транзакцией
+        counts = purge_matrix(cur, matrix_id)
+        counters = {
+            'deleted_scores': counts['deleted_client_scores'],
+            'unlinked_clients': counts['unlinked_clients'],
+            'deleted_statuses': counts['deleted_statuses'],
+            'deleted_criteria': counts['deleted_criteria'],
+        }
+        ids = []
+
+    if phase != 'criteria' and len(ids) == MATRIX_DELETE_CHUNK:
+        next_phase, next_last_id = phase, ids[-1]
+    else:
+        next_phase, next_last_id = DELETE_PHASES[DELETE_PHASES.index(phase) + 1], 0
+
+    cur.execute(
+        f"""
+        UPDATE matrix_delete_jobs
+        SET phase = %s, last_id = %s, status = %s,
+            processed_rows = processed_rows + %s,
+            {', '.join(f"{key} = {key} + %s" for key in counters)}{',' if counters else ''}
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s
+        """,
+        [next_phase, next_last_id, 'done' if next_phase == 'done' else 'running', sum(counters.values())]
+        + list(counters.values()) + [job['id']]
+    )
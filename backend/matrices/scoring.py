@@ -0,0 +1,196 @@
+"""
+Единое ядро расчёта оценок клиентов по матрице приоритизации.
+Одинаковая копия модуля лежит в каждой функции, которая считает оценки
+(clients, import, matrices, telegram-bot): функции деплоятся независимо.
+
+Формула: по каждой оси взвешенная сумма оценок делится на максимально
+возможную взвешенную сумму и приводится к шкале 0-10. Квадрант — первое
+подходящее правило matrix_quadrant_rules по priority, иначе 'archive'.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+def round_score(value: float) -> float:
+    """Округление до 2 знаков как у ROUND() в PostgreSQL"""
+    return float(Decimal(str(value)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+
+
+def load_matrix_definition(cur, matrix_id: int) -> dict:
+    """Загрузить критерии (axis, weight, max_value) и правила квадрантов матрицы"""
+    cur.execute(
+        """
+        SELECT id, axis, weight, max_value
+        FROM matrix_criteria
+        WHERE matrix_id = %s AND axis IN ('x', 'y')
+        """,
+        (matrix_id,)
+    )
+    criteria = {
+        row[0]: (row[1], float(row[2]), float(row[3]))
+        for row in cur.fetchall()
+    }
+
+    cur.execute(
+        """
+        SELECT quadrant, x_min, y_min, x_operator
+        FROM matrix_quadrant_rules
+        WHERE matrix_id = %s
+        ORDER BY priority ASC
+        """,
+        (matrix_id,)
+    )
+    rules = [
+        (row[0], float(row[1]), float(row[2]), row[3])
+        for row in cur.fetchall()
+    ]
+
+    return {'criteria': criteria, 'rules': rules}
+
+
+def determine_quadrant(rules: List[tuple], score_x: float, score_y: float) -> str:
+    """Определяет квадрант по правилам матрицы (гибкая логика AND/OR)"""
+    for quadrant, x_min, y_min, x_operator in rules:
+        if x_operator == 'AND':
+            if score_x >= x_min and score_y >= y_min:
+                return quadrant
+        else:  # OR
+            if score_x >= x_min or score_y >= y_min:
+                return quadrant
+
+    return 'archive'  # fallback на случай если правил нет
+
+
+def score_clients(rows: Iterable[tuple], definition: dict) -> Dict[int, Tuple[float, float, str]]:
+    """
+    Пакетный расчёт оценок за один проход по строкам.
+    rows - последовательность (client_id, criterion_id, score).
+    Возвращает {client_id: (score_x, score_y, quadrant)}; оценки по критериям
+    не из этой матрицы игнорируются.
+    """
+    criteria = definition['criteria']
+    rules = definition['rules']
+
+    # Колонки сумм по клиентам: [x_sum, x_max, y_sum, y_max]
+    totals: Dict[int, List[float]] = {}
+
+    for client_id, criterion_id, score in rows:
+        criterion = criteria.get(criterion_id)
+        if criterion is None:
+            totals.setdefault(client_id, [0.0, 0.0, 0.0, 0.0])
+            continue
+
+        axis, weight, max_value = criterion
+        acc = totals.get(client_id)
+        if acc is None:
+            acc = totals[client_id] = [0.0, 0.0, 0.0, 0.0]
+
+        offset = 0 if axis == 'x' else 2
+        acc[offset] += float(score) * weight
+        acc[offset + 1] += max_value * weight
+
+    results = {}
+    for client_id, (x_sum, x_max, y_sum, y_max) in totals.items():
+        score_x = round_score(x_sum / x_max * 10) if x_max > 0 else 0
+        score_y = round_score(y_sum / y_max * 10) if y_max > 0 else 0
+        results[client_id] = (score_x, score_y, determine_quadrant(rules, score_x, score_y))
+
+    return results
+
+
+def score_client(scores: Iterable[tuple], definition: dict) -> Tuple[float, float, str]:
+    """Расчёт для одного клиента: scores - последовательность (criterion_id, score)"""
+    result = score_clients(((0, criterion_id, score) for criterion_id, score in scores), definition)
+    return result.get(0, (0, 0, determine_quadrant(definition['rules'], 0, 0)))
+
+
+def calculate_client_scores(cur, client_id: int, matrix_id: Optional[int], definition: dict = None) -> Tuple[float, float, Optional[str]]:
+    """Пересчитать оценки сохранённого клиента по его client_scores"""
+    if not matrix_id:
+        return 0, 0, None
+
+    if definition is None:
+        definition = load_matrix_definition(cur, matrix_id)
+
+    cur.execute(
+        "SELECT criterion_id, score FROM client_scores WHERE client_id = %s",
+        (client_id,)
+    )
+
+    return score_client(cur.fetchall(), definition)
+
+
+def rescore_matrix(cur, matrix_id: int) -> dict:
+    """
+    Пересчёт всех клиентов матрицы одним SQL-запросом (та же формула, что
+    в score_clients). Выполняется внутри текущей транзакции, без commit.
+    Возвращает количество перезаписанных клиентов и сменивших квадрант, а в
+    moves - переходы учитываемых в client_stats клиентов:
+    (organization_id, deal_status_id, old_quadrant, new_quadrant, count).
+    """
+    cur.execute(
+        """
+        WITH client_totals AS (
+            SELECT c.id AS client_id,
+                   c.quadrant AS old_quadrant,
+                   c.organization_id, c.deal_status_id,
+                   (c.is_active AND c.deleted_at IS NULL) AS counted,
+                   SUM(CASE WHEN mc.axis = 'x' THEN cs.score * mc.weight END) AS x_sum,
+                   SUM(CASE WHEN mc.axis = 'x' THEN mc.max_value * mc.weight END) AS x_max,
+                   SUM(CASE WHEN mc.axis = 'y' THEN cs.score * mc.weight END) AS y_sum,
+                   SUM(CASE WHEN mc.axis = 'y' THEN mc.max_value * mc.weight END) AS y_max
+            FROM clients c
+            LEFT JOIN client_scores cs ON cs.client_id = c.id
+            LEFT JOIN matrix_criteria mc ON mc.id = cs.criterion_id AND mc.matrix_id = c.matrix_id
+            WHERE c.matrix_id = %(matrix_id)s
+            GROUP BY c.id, c.quadrant, c.organization_id, c.deal_status_id, c.is_active, c.deleted_at
+        ),
+        client_scores_xy AS (
+            SELECT client_id, old_quadrant, organization_id, deal_status_id, counted,
+                   COALESCE(ROUND(x_sum / NULLIF(x_max, 0) * 10, 2), 0) AS score_x,
+                   COALESCE(ROUND(y_sum / NULLIF(y_max, 0) * 10, 2), 0) AS score_y
+            FROM client_totals
+        ),
+        new_values AS (
+            SELECT s.client_id, s.old_quadrant, s.organization_id, s.deal_status_id, s.counted,
+                   s.score_x, s.score_y,
+                   COALESCE((
+                       SELECT r.quadrant
+                       FROM matrix_quadrant_rules r
+                       WHERE r.matrix_id = %(matrix_id)s
+                         AND CASE WHEN r.x_operator = 'AND'
+                                  THEN s.score_x >= r.x_min AND s.score_y >= r.y_min
+                                  ELSE s.score_x >= r.x_min OR s.score_y >= r.y_min
+                             END
+                       ORDER BY r.priority ASC
+                       LIMIT 1
+                   ), 'archive') AS quadrant
+            FROM client_scores_xy s
+        ),
+        updated AS (
+            UPDATE clients c
+            SET score_x = v.score_x, score_y = v.score_y, quadrant = v.quadrant
+            FROM new_values v
+            WHERE c.id = v.client_id
+              AND (c.score_x, c.score_y, c.quadrant) IS DISTINCT FROM (v.score_x, v.score_y, v.quadrant)
+            RETURNING v.organization_id, v.deal_status_id, v.old_quadrant, v.quadrant AS new_quadrant,
+                      v.counted, v.old_quadrant IS DISTINCT FROM v.quadrant AS moved
+        )
+        SELECT organization_id, deal_status_id, old_quadrant, new_quadrant, counted, moved, COUNT(*)
+        FROM updated
+        GROUP BY organization_id, deal_status_id, old_quadrant, new_quadrant, counted, moved
+        """,
+        {'matrix_id': matrix_id}
+    )
+
+    rescored = 0
+    moved = 0
+    moves = []
+    for organization_id, deal_status_id, old_quadrant, new_quadrant, counted, is_moved, count in cur.fetchall():
+        rescored += count
+        if is_moved:
+            moved += count
+            if counted:
+                moves.append((organization_id, deal_status_id, old_quadrant, new_quadrant, count))
+
+    return {'rescored_clients': rescored, 'moved_clients': moved, 'moves': moves}
@@ -1,8 +1,8 @@
 import json
-import os
-import jwt
-import psycopg2
 from psycopg2.extras import RealDictCursor
+from db import get_db_connection
+from auth import authenticate, AuthError
+from usage_limits import reserve_usage, UsageLimitExceeded
 
 def handler(event: dict, context) -> dict:
     '''API для управления шаблонами матриц и критериями'''
@@ -22,20 +22,19 @@ def handler(event: dict, context) -> dict:
         }
     
     try:
-        dsn = os.environ.get('DATABASE_URL')
-        conn = psycopg2.connect(dsn)
+        conn = get_db_connection()
         
         body = json.loads(event.get('body', '{}')) if event.get('body') else {}
         action = body.get('action', 'list')
         
-        auth_header = event.get('headers', {}).get('X-Authorization', '')
-        token = auth_header.replace('Bearer ', '') if auth_header else None
+        # Список шаблонов доступен и без авторизации
+        try:
+            auth = authenticate(event)
+        except AuthError:
+            auth = None
         
-        user_id = None
-        organization_id = None
-        
-        if token:
-            user_id, organization_id = get_user_from_token(token)
+        user_id = auth.user_id if auth else None
+        organization_id = auth.organization_id if auth else None
         
         if action == 'list':
             result = list_templates(conn, organization_id)
@@ -106,6 +105,14 @@ def handler(event: dict, context) -> dict:
             'isBase64Encoded': False
         }
         
+    except UsageLimitExceeded as e:
+        conn.close()
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
@@ -119,15 +126,6 @@ def handler(event: dict, context) -> dict:
         }
 
 
-def get_user_from_token(token: str):
-    try:
-        secret = os.environ.get('JWT_SECRET')
-        payload = jwt.decode(token, secret, algorithms=['HS256'])
-        return payload['user_id'], payload['organization_id']
-    except:
-        return None, None
-
-
 def list_templates(conn, organization_id: int):
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
         cur.execute('''
@@ -185,6 +183,8 @@ def create_matrix_from_template(conn, template_id: int, matrix_name: str, matrix
         if not axis_y_name:
             axis_y_name = template['axis_y_name'] if template else 'Ось Y'
         
+        reserve_usage(cur, organization_id, 'matrices')
+        
         cur.execute('''
             INSERT INTO matrices (organization_id, name, description, template_id, created_by, axis_x_name, axis_y_name, is_template)
             VALUES (%s, %s, %s, %s, %s, %s, %s, FALSE)
@@ -256,6 +256,8 @@ def create_matrix_from_template(conn, template_id: int, matrix_name: str, matrix
 
 def create_custom_matrix(conn, matrix_name: str, matrix_description: str, organization_id: int, user_id: int, axis_x_name: str = 'Ось X', axis_y_name: str = 'Ось Y', quadrant_rules: list = None):
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        reserve_usage(cur, organization_id, 'matrices')
+        
         cur.execute('''
             INSERT INTO matrices (organization_id, name, description, created_by, axis_x_name, axis_y_name, is_template)
             VALUES (%s, %s, %s, %s, %s, %s, FALSE)
@@ -305,6 +307,10 @@ def add_criterion_to_matrix(conn, matrix_id: int, axis: str, name: str, weight:
         ''', (matrix_id, axis, name, weight, min_value, max_value, hint, next_order))
         criterion_id = cur.fetchone()['id']
         
+        cur.execute('''
+            UPDATE matrices SET definition_version = definition_version + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+        ''', (matrix_id,))
         conn.commit()
         return {'criterion_id': criterion_id, 'message': 'Критерий добавлен'}
 
@@ -312,13 +318,15 @@ def add_criterion_to_matrix(conn, matrix_id: int, axis: str, name: str, weight:
 def update_criterion(conn, criterion_id: int, updates: dict, organization_id: int):
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
         cur.execute('''
-            SELECT mc.id
+            SELECT mc.id, mc.matrix_id
             FROM matrix_criteria mc
             JOIN matrices m ON mc.matrix_id = m.id
             WHERE mc.id = %s AND m.organization_id = %s AND m.is_template = FALSE
         ''', (criterion_id, organization_id))
-        if not cur.fetchone():
+        criterion = cur.fetchone()
+        if not criterion:
             raise ValueError('Критерий не найден')
+        matrix_id = criterion['matrix_id']
         
         allowed_fields = ['name', 'weight', 'min_value', 'max_value', 'description']
         set_clause = ', '.join([f"{field} = %s" for field in updates.keys() if field in allowed_fields])
@@ -327,6 +335,10 @@ def update_criterion(conn, criterion_id: int, updates: dict, organization_id: in
         
         if set_clause:
             cur.execute(f'UPDATE matrix_criteria SET {set_clause} WHERE id = %s', values)
+            cur.execute('''
+                UPDATE matrices SET definition_version = definition_version + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            ''', (matrix_id,))
             conn.commit()
         
         return {'message': 'Критерий обновлён'}
@@ -335,15 +347,21 @@ def update_criterion(conn, criterion_id: int, updates: dict, organization_id: in
 def remove_criterion(conn, criterion_id: int, organization_id: int):
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
         cur.execute('''
-            SELECT mc.id
+            SELECT mc.id, mc.matrix_id
             FROM matrix_criteria mc
             JOIN matrices m ON mc.matrix_id = m.id
             WHERE mc.id = %s AND m.organization_id = %s AND m.is_template = FALSE
         ''', (criterion_id, organization_id))
-        if not cur.fetchone():
+        criterion = cur.fetchone()
+        if not criterion:
             raise ValueError('Критерий не найден')
+        matrix_id = criterion['matrix_id']
         
         cur.execute('UPDATE matrix_criteria SET is_active = FALSE WHERE id = %s', (criterion_id,))
+        cur.execute('''
+            UPDATE matrices SET definition_version = definition_version + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+        ''', (matrix_id,))
         conn.commit()
         
         return {'message': 'Критерий удалён'}
\ No newline at end of file
@@ -0,0 +1,133 @@
+"""
+Счётчики использования тарифа по организации (organization_usage) и
+проверка лимитов users_limit, matrices_limit, clients_limit.
+Одинаковая копия модуля лежит в каждой функции, которая создаёт или
+удаляет пользователей, матрицы и клиентов: функции деплоятся независимо.
+
+Счётчик меняется в той же транзакции, что и вставка/удаление. Резерв -
+один условный UPDATE: строка счётчика блокируется, и параллельные запросы
+(например, два импорта) не превысят лимит. Откат транзакции откатывает и резерв.
+
+Что считается: users - активные пользователи, matrices - матрицы
+организации вне корзины, clients - клиенты с is_active = true вне корзины.
+Перенос в корзину освобождает место, восстановление из корзины занимает его.
+"""
+
+USAGE_KINDS = {
+    'users': ('users_count', 'users_limit'),
+    'matrices': ('matrices_count', 'matrices_limit'),
+    'clients': ('clients_count', 'clients_limit'),
+}
+
+LIMIT_MESSAGES = {
+    'users': 'Достигнут лимит пользователей ({limit}). Обновите тариф.',
+    'matrices': 'Достигнут лимит матриц ({limit}). Обновите тариф.',
+    'clients': 'Достигнут лимит клиентов ({limit}). Обновите тариф.',
+}
+
+
+def _values(row):
+    """Строка результата как кортеж - и для обычного курсора, и для RealDictCursor"""
+    if isinstance(row, dict):
+        return tuple(row.values())
+    return row
+
+
+class UsageLimitExceeded(Exception):
+    """Резерв превышает лимит тарифа"""
+
+    def __init__(self, kind: str, limit: int, used: int, requested: int):
+        self.kind = kind
+        self.limit = limit
+        self.used = used
+        self.requested = requested
+        super().__init__(LIMIT_MESSAGES[kind].format(limit=limit))
+
+
+def ensure_usage_row(cur, organization_id: int):
+    """Строка счётчиков для организации (для новых организаций - с нулями)"""
+    cur.execute(
+        """
+        INSERT INTO organization_usage (organization_id)
+        SELECT id FROM organizations WHERE id = %s
+        ON CONFLICT (organization_id) DO NOTHING
+        """,
+        (organization_id,)
+    )
+
+
+def reserve_usage(cur, organization_id: int, kind: str, count: int = 1) -> int:
+    """
+    Занять count единиц лимита. Возвращает новое значение счётчика или
+    бросает UsageLimitExceeded (LookupError - нет организации).
+    NULL в лимите - без ограничения.
+    """
+    count_field, limit_field = USAGE_KINDS[kind]
+    if count <= 0:
+        return get_usage(cur, organization_id).get(kind, 0)
+
+    ensure_usage_row(cur, organization_id)
+    cur.execute(
+        f"""
+        UPDATE organization_usage u
+        SET {count_field} = u.{count_field} + %s, updated_at = CURRENT_TIMESTAMP
+        FROM organizations o
+        WHERE u.organization_id = %s AND o.id = u.organization_id
+          AND (o.{limit_field} IS NULL OR u.{count_field} + %s <= o.{limit_field})
+        RETURNING u.{count_field}
+        """,
+        (count, organization_id, count)
+    )
+    row = _values(cur.fetchone())
+    if row:
+        return row[0]
+
+    cur.execute(
+        f"""
+        SELECT o.{limit_field}, u.{count_field}
+        FROM organizations o
+        JOIN organization_usage u ON u.organization_id = o.id
+        WHERE o.id = %s
+        """,
+        (organization_id,)
+    )
+    row = _values(cur.fetchone())
+    if not row:
+        raise LookupError('Организация не найдена')
+    raise UsageLimitExceeded(kind, row[0], row[1], count)
+
+
+def release_usage(cur, organization_id: int, kind: str, count: int = 1):
+    """Вернуть count единиц лимита после удаления/деактивации"""
+    count_field, _ = USAGE_KINDS[kind]
+    if count <= 0:
+        return
+    cur.execute(
+        f"""
+        UPDATE organization_usage
+        SET {count_field} = GREATEST({count_field} - %s, 0), updated_at = CURRENT_TIMESTAMP
+        WHERE organization_id = %s
+        """,
+        (count, organization_id)
+    )
+
+
+def get_usage(cur, organization_id: int) -> dict:
+    """Текущее использование и лимиты организации"""
+    cur.execute(
+        """
+        SELECT COALESCE(u.users_count, 0), COALESCE(u.matrices_count, 0), COALESCE(u.clients_count, 0),
+               o.users_limit, o.matrices_limit, o.clients_limit
+        FROM organizations o
+        LEFT JOIN organization_usage u ON u.organization_id = o.id
+        WHERE o.id = %s
+        """,
+        (organization_id,)
+    )
+    row = _values(cur.fetchone())
+    if not row:
+        return {}
+    return {
+        'users': row[0], 'matrices': row[1], 'clients': row[2],
+        'users_limit': row[3], 'matrices_limit': row[4], 'clients_limit': row[5],
+    }
@@ -1,8 +1,7 @@
 import json
-import os
-import jwt
-import psycopg2
 from psycopg2.extras import RealDictCursor
+from db import get_db_connection
+from auth import authenticate, AuthError
 
 def handler(event: dict, context) -> dict:
     """API для управления настройками организации и статусами сделок"""
@@ -21,34 +20,22 @@ def handler(event: dict, context) -> dict:
             'isBase64Encoded': False
         }
     
-    auth_header = event.get('headers', {}).get('X-Authorization', '')
-    token = auth_header.replace('Bearer ', '') if auth_header else ''
-    
-    if not token:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Требуется авторизация'}),
-            'isBase64Encoded': False
-        }
-    
     try:
-        secret = os.environ.get('JWT_SECRET')
-        payload = jwt.decode(token, secret, algorithms=['HS256'])
-        user_id = payload['user_id']
-        organization_id = payload['organization_id']
-        role = payload.get('role', 'viewer')
-    except:
+        auth = authenticate(event)
+    except AuthError as e:
         return {
             'statusCode': 401,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Неверный токен'}),
+            'body': json.dumps({'error': 'Требуется авторизация' if e.reason == 'missing' else 'Неверный токен'}),
             'isBase64Encoded': False
         }
     
+    user_id = auth.user_id
+    organization_id = auth.organization_id
+    role = auth.role
+    
     try:
-        dsn = os.environ.get('DATABASE_URL')
-        conn = psycopg2.connect(dsn)
+        conn = get_db_connection()
         
         body = json.loads(event.get('body', '{}')) if event.get('body') else {}
         action = body.get('action', 'get_settings')
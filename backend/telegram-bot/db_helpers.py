@@ -2,17 +2,28 @@
 Вспомогательные функции для работы с БД
 """
 import os
-import psycopg2
 from typing import Optional
+from db import get_db_connection
+from ttl_cache import TTLCache
 
 
-def get_db_connection():
-    dsn = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(dsn)
+# Кэш telegram_id -> пользователь. Привязка меняется только через бот
+# (link_user_telegram сбрасывает кэш). Деактивацию в CRM кэш видит не позже
+# чем через TTL, поэтому записи перепроверяют пользователя в своей
+# транзакции (require_active_user) и сбрасывают кэш, если доступ закрыт.
+TELEGRAM_USER_CACHE_TTL = int(os.environ.get('TELEGRAM_USER_CACHE_TTL', '300'))
+# Непривязанный telegram_id кэшируется короче: его могут привязать на другом инстансе
+TELEGRAM_USER_MISS_TTL = 30
+_telegram_users = TTLCache(max_size=5000, ttl=TELEGRAM_USER_CACHE_TTL)
+_NOT_LINKED = object()
 
 
 def get_user_by_telegram_id(telegram_id: int) -> Optional[dict]:
     """Получить пользователя по telegram_id"""
+    cached = _telegram_users.get(telegram_id)
+    if cached is not None:
+        return dict(cached) if cached is not _NOT_LINKED else None
+    
     conn = get_db_connection()
     cur = conn.cursor()
     
@@ -25,20 +36,43 @@ def get_user_by_telegram_id(telegram_id: int) -> Optional[dict]:
             """, (telegram_id,)
         )
         result = cur.fetchone()
-        
-        if result:
-            return {
-                'id': result[0],
-                'organization_id': result[1],
-                'username': result[2],
-                'full_name': result[3],
-                'role': result[4],
-                'telegram_id': result[5]
-            }
-        return None
     finally:
         cur.close()
         conn.close()
+    
+    if not result:
+        _telegram_users.set(telegram_id, _NOT_LINKED, ttl=TELEGRAM_USER_MISS_TTL)
+        return None
+    
+    user = {
+        'id': result[0],
+        'organization_id': result[1],
+        'username': result[2],
+        'full_name': result[3],
+        'role': result[4],
+        'telegram_id': result[5]
+    }
+    _telegram_users.set(telegram_id, user)
+    return dict(user)
+
+
+def invalidate_telegram_user(telegram_id: int):
+    """Сбросить закэшированного пользователя для telegram_id"""
+    _telegram_users.invalidate(telegram_id)
+
+
+def require_active_user(cur, user_id: int, telegram_id: int):
+    """
+    Убедиться в транзакции записи, что пользователь активен и привязан к
+    telegram_id. PermissionError - доступ закрыт, запись кэша сброшена.
+    """
+    cur.execute(
+        "SELECT 1 FROM users WHERE id = %s AND telegram_id = %s AND is_active = true FOR SHARE",
+        (user_id, telegram_id)
+    )
+    if cur.fetchone() is None:
+        invalidate_telegram_user(telegram_id)
+        raise PermissionError('доступ к боту закрыт, пользователь деактивирован')
 
 
 def link_user_telegram(user_id: int, telegram_id: int, telegram_username: str = None) -> bool:
@@ -49,16 +83,24 @@ def link_user_telegram(user_id: int, telegram_id: int, telegram_username: str =
     try:
         cur.execute(
             """
-            UPDATE users 
+            UPDATE users u
             SET telegram_id = %s
-            WHERE id = %s AND is_active = true
+            FROM (SELECT id, telegram_id FROM users WHERE id = %s FOR UPDATE) previous
+            WHERE u.id = previous.id AND u.is_active = true
+            RETURNING previous.telegram_id
             """, (telegram_id, user_id)
         )
+        previous = cur.fetchone()
         conn.commit()
-        return cur.rowcount > 0
     finally:
         cur.close()
         conn.close()
+    
+    invalidate_telegram_user(telegram_id)
+    if previous and previous[0]:
+        invalidate_telegram_user(previous[0])
+    
+    return previous is not None
 
 
 def create_support_thread(telegram_id: int, username: str = None, full_name: str = None, first_message: str = None) -> int:
@@ -4,6 +4,11 @@
 import json
 from typing import Optional
 from telegram_api import send_message, send_message_with_buttons
+from scoring import score_client
+from matrix_loader import cached_matrix_definition
+from client_stats import add_clients_to_stats
+from usage_limits import reserve_usage
+from db_helpers import require_active_user
 from fsm_client import get_user_state, set_user_state, clear_user_state, get_db_connection, get_matrix_criteria, save_client_without_assessment
 
 
@@ -103,39 +108,20 @@ def save_client_with_assessment(chat_id: int, telegram_id: int, data: dict, scor
         conn = get_db_connection()
         cur = conn.cursor()
         
-        # Вычислить score_x и score_y
-        score_x = 0
-        score_y = 0
-        total_weight_x = 0
-        total_weight_y = 0
-        
         matrix_id = data.get('matrix_id')
-        criteria = data.get('criteria', [])
         
-        for score in scores:
-            criterion = next((c for c in criteria if c['id'] == score['criterion_id']), None)
-            if criterion:
-                if criterion['axis'] == 'x':
-                    score_x += score['score'] * criterion['weight']
-                    total_weight_x += criterion['weight']
-                elif criterion['axis'] == 'y':
-                    score_y += score['score'] * criterion['weight']
-                    total_weight_y += criterion['weight']
-        
-        # Нормализовать оценки (0-10)
-        final_score_x = (score_x / total_weight_x) if total_weight_x > 0 else 0
-        final_score_y = (score_y / total_weight_y) if total_weight_y > 0 else 0
-        
-        # Определить квадрант
-        quadrant = ''
-        if final_score_x >= 5 and final_score_y >= 5:
-            quadrant = 'focus'
-        elif final_score_x >= 5 and final_score_y < 5:
-            quadrant = 'grow'
-        elif final_score_x < 5 and final_score_y >= 5:
-            quadrant = 'monitor'
-        else:
-            quadrant = 'archive'
+        # Кэш пользователя мог устареть - деактивированный не создаёт клиентов
+        require_active_user(cur, data['user_id'], telegram_id)
+        
+        # Вычислить score_x, score_y и квадрант по правилам матрицы
+        definition = cached_matrix_definition(cur, matrix_id)
+        final_score_x, final_score_y, quadrant = score_client(
+            [(score['criterion_id'], score['score']) for score in scores],
+            definition
+        )
+        
+        # Место в лимите тарифа; при превышении - сообщение об ошибке ниже
+        reserve_usage(cur, data['org_id'], 'clients')
         
         # Создать клиента
         cur.execute(
@@ -157,8 +143,8 @@ def save_client_with_assessment(chat_id: int, telegram_id: int, data: dict, scor
                 data.get('phone'),
                 data.get('email'),
                 data.get('description'),
-                round(final_score_x, 2),
-                round(final_score_y, 2),
+                final_score_x,
+                final_score_y,
                 quadrant,
                 data['user_id'],
                 data['user_id']
@@ -177,6 +163,8 @@ def save_client_with_assessment(chat_id: int, telegram_id: int, data: dict, scor
                 (client_id, score['criterion_id'], score['score'], '')
             )
         
+        add_clients_to_stats(cur, [client_id])
+        
         conn.commit()
         cur.close()
         conn.close()
@@ -1,44 +1,33 @@
 """
 FSM (Finite State Machine) для добавления клиента через бота
 """
-import json
-import psycopg2
-import os
-from typing import Optional, Dict
+from typing import Optional
 from telegram_api import send_message, send_message_with_buttons
+from db import get_db_connection
+from matrix_loader import cached_matrix_criteria
+from client_stats import add_clients_to_stats
+from usage_limits import reserve_usage
+from db_helpers import require_active_user
+from fsm_state import create_state_store
 
 
-# In-memory хранилище состояний (в production использовать Redis)
-user_states: Dict[int, dict] = {}
+# Хранилище состояний диалогов (PostgreSQL или память, см. fsm_state)
+state_store = create_state_store()
 
 
 def get_user_state(telegram_id: int) -> Optional[dict]:
     """Получить состояние пользователя"""
-    return user_states.get(telegram_id)
+    return state_store.get(telegram_id)
 
 
 def set_user_state(telegram_id: int, state: str, data: dict = None):
     """Установить состояние пользователя"""
-    if telegram_id not in user_states:
-        user_states[telegram_id] = {}
-    
-    user_states[telegram_id]['state'] = state
-    
-    if data:
-        if 'data' not in user_states[telegram_id]:
-            user_states[telegram_id]['data'] = {}
-        user_states[telegram_id]['data'].update(data)
+    state_store.set(telegram_id, state, data)
 
 
 def clear_user_state(telegram_id: int):
     """Очистить состояние пользователя"""
-    if telegram_id in user_states:
-        del user_states[telegram_id]
-
-
-def get_db_connection():
-    dsn = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(dsn)
+    state_store.clear(telegram_id)
 
 
 def get_user_matrices(org_id: int) -> list:
@@ -64,44 +53,9 @@ def get_matrix_criteria(matrix_id: int) -> list:
     cur = conn.cursor()
     
     try:
-        cur.execute(
-            """
-            SELECT c.id, c.name, c.description, c.axis, c.weight
-            FROM criteria c
-            WHERE c.matrix_id = %s
-            ORDER BY c.sort_order
-            """,
-            (matrix_id,)
-        )
-        criteria = []
-        for row in cur.fetchall():
-            criterion = {
-                'id': row[0],
-                'name': row[1],
-                'description': row[2],
-                'axis': row[3],
-                'weight': row[4],
-                'statuses': []
-            }
-            
-            cur.execute(
-                """
-                SELECT id, label, weight, sort_order
-                FROM criterion_statuses
-                WHERE criterion_id = %s
-                ORDER BY sort_order
-                """,
-                (criterion['id'],)
-            )
-            
-            criterion['statuses'] = [
-                {'id': s[0], 'label': s[1], 'weight': s[2], 'sort_order': s[3]}
-                for s in cur.fetchall()
-            ]
-            
-            criteria.append(criterion)
-        
-        return criteria
+        criteria = cached_matrix_criteria(cur, matrix_id)
+        # В боте критерии задаются по порядку sort_order без группировки по осям
+        return sorted(criteria, key=lambda c: c['sort_order'] or 0)
     finally:
         cur.close()
         conn.close()
@@ -230,6 +184,12 @@ def save_client_without_assessment(chat_id: int, telegram_id: int, data: dict, d
         conn = get_db_connection()
         cur = conn.cursor()
         
+        # Кэш пользователя мог устареть - деактивированный не создаёт клиентов
+        require_active_user(cur, data['user_id'], telegram_id)
+        
+        # Место в лимите тарифа; при превышении - сообщение об ошибке ниже
+        reserve_usage(cur, data['org_id'], 'clients')
+        
         cur.execute(
             """
             INSERT INTO clients (
@@ -253,6 +213,7 @@ def save_client_without_assessment(chat_id: int, telegram_id: int, data: dict, d
         )
         
         client_id = cur.fetchone()[0]
+        add_clients_to_stats(cur, [client_id])
         conn.commit()
         
         cur.close()
@@ -0,0 +1,217 @@
+"""
+Хранилище состояний диалогов FSM бота.
+
+MemoryStateStore - состояния в памяти процесса (тесты, локальный запуск).
+PostgresStateStore - таблица telegram_fsm_states: состояние переживает
+холодный старт и доступно с любого инстанса. Перед базой стоит небольшой
+кэш в памяти; брошенные диалоги истекают по TTL и периодически удаляются.
+
+Бэкенд выбирается переменной FSM_STATE_BACKEND (memory | postgres),
+по умолчанию postgres при наличии DATABASE_URL.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Optional
+
+from db import get_db_connection
+
+# Брошенный диалог удаляется через FSM_STATE_TTL секунд после последнего шага
+FSM_STATE_TTL = int(os.environ.get('FSM_STATE_TTL', '21600'))
+FSM_STATE_CACHE_TTL = float(os.environ.get('FSM_STATE_CACHE_TTL', '2'))
+FSM_STATE_CACHE_SIZE = 1000
+FSM_STATE_SWEEP_INTERVAL = 300
+
+
+def _json_default(value):
+    """Decimal и даты из БД в JSON-совместимые значения"""
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def serialize_state(state: dict) -> str:
+    """Компактная сериализация состояния"""
+    return json.dumps(state, ensure_ascii=False, separators=(',', ':'), default=_json_default)
+
+
+def merge_state(current: Optional[dict], state: str, data: Optional[dict]) -> dict:
+    """Новое состояние: state заменяется, data дополняется (как раньше в user_states)"""
+    merged = {'state': state}
+    if current and 'data' in current:
+        merged['data'] = dict(current['data'])
+    if data:
+        merged.setdefault('data', {}).update(data)
+    return merged
+
+
+class MemoryStateStore:
+    """Состояния в памяти процесса с TTL"""
+
+    def __init__(self, ttl: int = FSM_STATE_TTL):
+        self.ttl = ttl
+        self._states = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def get(self, telegram_id: int) -> Optional[dict]:
+        with self._lock:
+            entry = self._states.get(telegram_id)
+            if entry is None:
+                return None
+            payload, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._states[telegram_id]
+                return None
+            return json.loads(payload)
+
+    def set(self, telegram_id: int, state: str, data: dict = None):
+        merged = merge_state(self.get(telegram_id), state, data)
+        with self._lock:
+            self._states[telegram_id] = (serialize_state(merged), time.monotonic() + self.ttl)
+        self._maybe_sweep()
+
+    def clear(self, telegram_id: int):
+        with self._lock:
+            self._states.pop(telegram_id, None)
+
+    def sweep(self) -> int:
+        """Удалить истёкшие состояния, вернуть количество удалённых"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, (_, expires_at) in self._states.items() if expires_at < now]
+            for key in expired:
+                del self._states[key]
+            self._last_sweep = now
+        return len(expired)
+
+    def _maybe_sweep(self):
+        if time.monotonic() - self._last_sweep > FSM_STATE_SWEEP_INTERVAL:
+            self.sweep()
+
+
+class PostgresStateStore:
+    """
+    Состояния в таблице telegram_fsm_states с кэшем в памяти.
+    Кэш живёт FSM_STATE_CACHE_TTL секунд: запись на этом инстансе видна сразу,
+    запись с другого инстанса - не позже чем через FSM_STATE_CACHE_TTL.
+    """
+
+    def __init__(self, ttl: int = FSM_STATE_TTL, cache_ttl: float = FSM_STATE_CACHE_TTL):
+        self.ttl = ttl
+        self.cache_ttl = cache_ttl
+        self._cache: 'OrderedDict[int, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+
+    def _cache_get(self, telegram_id: int):
+        with self._lock:
+            entry = self._cache.get(telegram_id)
+            if entry is None:
+                return False, None
+            payload, cached_at = entry
+            if time.monotonic() - cached_at > self.cache_ttl:
+                del self._cache[telegram_id]
+                return False, None
+            self._cache.move_to_end(telegram_id)
+            return True, payload
+
+    def _cache_put(self, telegram_id: int, payload: Optional[str]):
+        with self._lock:
+            self._cache[telegram_id] = (payload, time.monotonic())
+            self._cache.move_to_end(telegram_id)
+            while len(self._cache) > FSM_STATE_CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    def get(self, telegram_id: int) -> Optional[dict]:
+        hit, payload = self._cache_get(telegram_id)
+        if not hit:
+            conn = get_db_connection()
+            cur = conn.cursor()
+            try:
+                cur.execute(
+                    """
+                    SELECT payload FROM telegram_fsm_states
+                    WHERE telegram_id = %s AND expires_at > CURRENT_TIMESTAMP
+                    """,
+                    (telegram_id,)
+                )
+                row = cur.fetchone()
+                payload = row[0] if row else None
+            finally:
+                cur.close()
+                conn.close()
+            self._cache_put(telegram_id, payload)
+
+        return json.loads(payload) if payload else None
+
+    def set(self, telegram_id: int, state: str, data: dict = None):
+        payload = serialize_state(merge_state(self.get(telegram_id), state, data))
+
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """
+                INSERT INTO telegram_fsm_states (telegram_id, payload, updated_at, expires_at)
+                VALUES (%s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')
+                ON CONFLICT (telegram_id) DO UPDATE
+                SET payload = EXCLUDED.payload, updated_at = EXCLUDED.updated_at, expires_at = EXCLUDED.expires_at
+                """,
+                (telegram_id, payload, self.ttl)
+            )
+            self._maybe_sweep(cur)
+            conn.commit()
+        finally:
+            cur.close()
+            conn.close()
+
+        self._cache_put(telegram_id, payload)
+
+    def clear(self, telegram_id: int):
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("DELETE FROM telegram_fsm_states WHERE telegram_id = %s", (telegram_id,))
+            conn.commit()
+        finally:
+            cur.close()
+            conn.close()
+
+        self._cache_put(telegram_id, None)
+
+    def sweep(self) -> int:
+        """Удалить истёкшие состояния, вернуть количество удалённых"""
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            deleted = self._sweep(cur)
+            conn.commit()
+            return deleted
+        finally:
+            cur.close()
+            conn.close()
+
+    def _sweep(self, cur) -> int:
+        cur.execute("DELETE FROM telegram_fsm_states WHERE expires_at < CURRENT_TIMESTAMP")
+        self._last_sweep = time.monotonic()
+        return cur.rowcount
+
+    def _maybe_sweep(self, cur):
+        if time.monotonic() - self._last_sweep > FSM_STATE_SWEEP_INTERVAL:
+            self._sweep(cur)
+
+
+def create_state_store():
+    """Хранилище по FSM_STATE_BACKEND"""
+    backend = os.environ.get('FSM_STATE_BACKEND') or ('postgres' if os.environ.get('DATABASE_URL') else 'memory')
+    if backend == 'memory':
+        return MemoryStateStore()
+    return PostgresStateStore()
+
@@ -3,8 +3,8 @@
 """
 import os
 import json
-import requests
 from typing import Optional
+from telegram_api import dispatcher, flush_webhook_reply
 
 
 def get_bot_token() -> str:
@@ -53,7 +53,6 @@ def forward_to_support_channel(
     # Без кнопок - администратор сам свяжется с пользователем
     keyboard = None
     
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
     payload = {
         'chat_id': channel_id,
         'text': message,
@@ -63,21 +62,16 @@ def forward_to_support_channel(
     print(f"[SUPPORT_FORWARD] Sending request to Telegram API...")
     
     try:
-        response = requests.post(url, json=payload, timeout=10)
+        flush_webhook_reply()
+        ok, response_data = dispatcher.call('sendMessage', payload, channel_id)
         
-        print(f"[SUPPORT_FORWARD] Response status: {response.status_code}")
-        print(f"[SUPPORT_FORWARD] Response body: {response.text}")
+        print(f"[SUPPORT_FORWARD] Response body: {response_data}")
         
-        if response.status_code == 200:
+        if ok:
             print(f"[SUPPORT_FORWARD] SUCCESS: Message forwarded to channel")
             return True
         else:
-            print(f"[SUPPORT_FORWARD] ERROR: Failed with status {response.status_code}")
-            try:
-                error_data = response.json()
-                print(f"[SUPPORT_FORWARD] Error details: {error_data}")
-            except:
-                pass
+            print(f"[SUPPORT_FORWARD] ERROR: Failed, details: {response_data}")
             return False
             
     except Exception as e:
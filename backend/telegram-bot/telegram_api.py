@@ -1,35 +1,209 @@
 """
 API методы для работы с Telegram Bot API
+
+Все запросы идут через общий TelegramDispatcher: keep-alive сессия requests,
+явные таймауты, ограничение частоты (глобально и на чат) и повтор ответов
+429 через retry_after. Адрес API задаётся TELEGRAM_API_URL - в тестах его
+можно направить на локальный HTTP-сервер.
 """
 import os
+import threading
+import time
 import requests
-from typing import List, Dict
+from requests.adapters import HTTPAdapter
+from typing import List, Dict, Optional, Tuple
+
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org')
+
+# (connect, read) секунд: вебхук не должен зависать на медленном API
+TELEGRAM_TIMEOUT = (3.05, 10)
+
+# Лимиты Telegram: ~30 сообщений/с на бота, ~1/с в личный чат, ~20/мин в группу
+TELEGRAM_GLOBAL_RATE = 30
+TELEGRAM_CHAT_RATE = 1
+TELEGRAM_CHAT_BURST = 3
+TELEGRAM_GROUP_RATE = 20 / 60
+
+TELEGRAM_MAX_RETRIES = 3
+# Дольше ждать в рамках вебхука нет смысла - Telegram повторит апдейт сам
+TELEGRAM_MAX_RETRY_AFTER = 10
 
 
 def get_bot_token() -> str:
     return os.environ.get('TELEGRAM_BOT_TOKEN')
 
 
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше burst подряд"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def reserve(self) -> float:
+        """Забрать токен, вернуть сколько секунд подождать до отправки"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class TelegramDispatcher:
+    """Отправка запросов в Bot API с общим пулом соединений и лимитами частоты"""
+
+    CHAT_BUCKETS_LIMIT = 10000
+
+    def __init__(self, base_url: str = None, token: str = None):
+        self.base_url = (base_url or TELEGRAM_API_URL).rstrip('/')
+        self.token = token
+        self._session = None
+        self._lock = threading.Lock()
+        self._global_bucket = TokenBucket(TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_RATE)
+        self._chat_buckets: Dict[str, TokenBucket] = {}
+
+    @property
+    def session(self) -> requests.Session:
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    session = requests.Session()
+                    session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=10))
+                    session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=10))
+                    self._session = session
+        return self._session
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        key = str(chat_id)
+        bucket = self._chat_buckets.get(key)
+        if bucket is None:
+            if len(self._chat_buckets) >= self.CHAT_BUCKETS_LIMIT:
+                self._chat_buckets.clear()
+            # Группы и каналы: отрицательный id или @username
+            if key.startswith('-') or key.startswith('@'):
+                bucket = TokenBucket(TELEGRAM_GROUP_RATE, TELEGRAM_CHAT_BURST)
+            else:
+                bucket = TokenBucket(TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST)
+            self._chat_buckets[key] = bucket
+        return bucket
+
+    def _throttle(self, chat_id):
+        with self._lock:
+            delay = self._global_bucket.reserve()
+            if chat_id is not None:
+                delay = max(delay, self._chat_bucket(chat_id).reserve())
+        if delay > 0:
+            time.sleep(delay)
+
+    def call(self, method: str, payload: dict, chat_id=None) -> Tuple[bool, Optional[dict]]:
+        """
+        Вызвать метод Bot API. chat_id - получатель для лимита на чат
+        (None для методов без сообщения в чат, например answerCallbackQuery).
+        Возвращает (ok, JSON ответа или None).
+        """
+        url = f"{self.base_url}/bot{self.token or get_bot_token()}/{method}"
+
+        for attempt in range(TELEGRAM_MAX_RETRIES + 1):
+            self._throttle(chat_id)
+
+            try:
+                response = self.session.post(url, json=payload, timeout=TELEGRAM_TIMEOUT)
+            except requests.RequestException as e:
+                print(f"[TELEGRAM_API] {method} failed: {type(e).__name__}: {e}")
+                return False, None
+
+            try:
+                data = response.json()
+            except ValueError:
+                data = None
+
+            if response.status_code != 429 or attempt == TELEGRAM_MAX_RETRIES:
+                return response.status_code == 200, data
+
+            retry_after = ((data or {}).get('parameters') or {}).get('retry_after', 1)
+            if retry_after > TELEGRAM_MAX_RETRY_AFTER:
+                print(f"[TELEGRAM_API] {method} rate limited for {retry_after}s, giving up")
+                return False, data
+
+            print(f"[TELEGRAM_API] {method} rate limited, retry in {retry_after}s")
+            time.sleep(retry_after)
+
+        return False, None
+
+
+dispatcher = TelegramDispatcher()
+
+# Ответ вебхуку текущего апдейта: Telegram выполняет метод из тела HTTP-ответа
+# сам, без отдельного исходящего запроса. Отложенный вызов отправляется через
+# API, как только появляется следующий - порядок сообщений сохраняется, а
+# последний вызов уходит в ответе вебхука.
+_webhook = threading.local()
+
+
+def begin_webhook_reply():
+    """Начать сбор ответа вебхука для текущего апдейта"""
+    _webhook.active = True
+    _webhook.pending = None
+
+
+def flush_webhook_reply():
+    """Отправить отложенный вызов через API (нужен результат или порядок)"""
+    pending = getattr(_webhook, 'pending', None)
+    if pending:
+        _webhook.pending = None
+        method, payload, chat_id = pending
+        dispatcher.call(method, payload, chat_id)
+
+
+def take_webhook_reply() -> Optional[dict]:
+    """Завершить сбор: тело ответа вебхука с методом или None"""
+    pending = getattr(_webhook, 'pending', None)
+    _webhook.active = False
+    _webhook.pending = None
+    if not pending:
+        return None
+    method, payload, _ = pending
+    return dict(payload, method=method)
+
+
+def call_api(method: str, payload: dict, chat_id=None) -> bool:
+    """
+    Вызвать метод Bot API через общий диспетчер. Внутри обработки апдейта
+    вызов откладывается и может уйти в ответе вебхука; результат в этом
+    случае неизвестен и считается успешным - только для ответов в текущий
+    чат, результат которых не проверяется. Остальное - через call_api_now.
+    """
+    if getattr(_webhook, 'active', False):
+        flush_webhook_reply()
+        _webhook.pending = (method, payload, chat_id)
+        return True
+
+    return call_api_now(method, payload, chat_id)
+
+
+def call_api_now(method: str, payload: dict, chat_id=None) -> bool:
+    """Вызвать метод Bot API сразу и вернуть настоящий результат"""
+    # Отложенный ответ уходит первым, чтобы сохранить порядок сообщений
+    flush_webhook_reply()
+    ok, _ = dispatcher.call(method, payload, chat_id)
+    return ok
+
+
 def send_message(chat_id: int, text: str) -> bool:
     """Отправить текстовое сообщение"""
-    token = get_bot_token()
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
-    
     payload = {
         'chat_id': chat_id,
         'text': text,
         'parse_mode': 'HTML'
     }
     
-    response = requests.post(url, json=payload)
-    return response.status_code == 200
+    return call_api('sendMessage', payload, chat_id)
 
 
 def send_message_with_buttons(chat_id: int, text: str, buttons: List[List[Dict]]) -> bool:
     """Отправить сообщение с inline кнопками"""
-    token = get_bot_token()
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
-    
     payload = {
         'chat_id': chat_id,
         'text': text,
@@ -39,14 +213,13 @@ def send_message_with_buttons(chat_id: int, text: str, buttons: List[List[Dict]]
         }
     }
     
-    response = requests.post(url, json=payload)
-    return response.status_code == 200
+    return call_api('sendMessage', payload, chat_id)
 
 
-def answer_callback_query(callback_query_id: int, text: str = None) -> bool:
+def answer_callback_query(callback_query_id: str, text: str = None) -> bool:
     """Ответить на callback query (убрать часики)"""
-    token = get_bot_token()
-    url = f"https://api.telegram.org/bot{token}/answerCallbackQuery"
+    if not callback_query_id:
+        return False
     
     payload = {
         'callback_query_id': callback_query_id
@@ -55,40 +228,32 @@ def answer_callback_query(callback_query_id: int, text: str = None) -> bool:
     if text:
         payload['text'] = text
     
-    response = requests.post(url, json=payload)
-    return response.status_code == 200
+    return call_api('answerCallbackQuery', payload)
 
 
 def forward_message_to_channel(chat_id: int, message_id: int) -> bool:
     """Переслать сообщение в канал поддержки"""
-    token = get_bot_token()
     channel_id = os.environ.get('TELEGRAM_SUPPORT_CHANNEL_ID')
     
     if not channel_id:
         return False
     
-    url = f"https://api.telegram.org/bot{token}/forwardMessage"
-    
     payload = {
         'chat_id': channel_id,
         'from_chat_id': chat_id,
         'message_id': message_id
     }
     
-    response = requests.post(url, json=payload)
-    return response.status_code == 200
+    return call_api_now('forwardMessage', payload, channel_id)
 
 
 def send_message_to_channel(text: str, buttons: List[List[Dict]] = None) -> bool:
     """Отправить сообщение в канал поддержки"""
-    token = get_bot_token()
     channel_id = os.environ.get('TELEGRAM_SUPPORT_CHANNEL_ID')
     
     if not channel_id:
         return False
     
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
-    
     payload = {
         'chat_id': channel_id,
         'text': text,
@@ -100,5 +265,4 @@ def send_message_to_channel(text: str, buttons: List[List[Dict]] = None) -> bool
             'inline_keyboard': buttons
         }
     
-    response = requests.post(url, json=payload)
-    return response.status_code == 200
+    return call_api_now('sendMessage', payload, channel_id)
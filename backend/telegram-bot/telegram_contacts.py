@@ -0,0 +1,104 @@
+"""
+Агрегация контактов из Telegram с объединением записей.
+
+Каждое сообщение обновляет last_contact_at, но писать в БД на каждое
+сообщение не нужно: контакт, обновлённый на этом инстансе меньше
+TELEGRAM_CONTACT_REFRESH_WINDOW секунд назад с теми же именем и username,
+пропускается. Обновления известных контактов копятся в буфере и пишутся
+одним многострочным INSERT ... ON CONFLICT; новые и изменившиеся контакты
+пишутся сразу вместе с накопленным буфером.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+from psycopg2.extras import execute_values
+
+from db import get_db_connection
+
+TELEGRAM_CONTACT_REFRESH_WINDOW = int(os.environ.get('TELEGRAM_CONTACT_REFRESH_WINDOW', '300'))
+TELEGRAM_CONTACT_FLUSH_BATCH = 100
+TELEGRAM_CONTACT_FLUSH_INTERVAL = 30
+TELEGRAM_CONTACTS_TRACKED = 10000
+
+# telegram_id -> (username, full_name, когда записан в БД)
+_written: 'OrderedDict[int, Tuple[str, str, float]]' = OrderedDict()
+# telegram_id -> (username, full_name, когда пришло сообщение)
+_pending: Dict[int, Tuple[str, str, float]] = {}
+_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+
+def save_telegram_contact(telegram_id: int, username: str = None, full_name: str = None):
+    """Сохранить контакт из Telegram для агрегации"""
+    username = username or ''
+    full_name = full_name or ''
+    now = time.monotonic()
+
+    with _lock:
+        written = _written.get(telegram_id)
+        known = written is not None and written[:2] == (username, full_name)
+        if known and now - written[2] < TELEGRAM_CONTACT_REFRESH_WINDOW:
+            return
+
+        _pending[telegram_id] = (username, full_name, now)
+        flush_now = (
+            not known
+            or len(_pending) >= TELEGRAM_CONTACT_FLUSH_BATCH
+            or now - _last_flush >= TELEGRAM_CONTACT_FLUSH_INTERVAL
+        )
+
+    if flush_now:
+        flush_telegram_contacts()
+
+
+def flush_telegram_contacts():
+    """Записать накопленные контакты одним запросом"""
+    global _last_flush
+
+    with _lock:
+        batch = dict(_pending)
+        _pending.clear()
+        _last_flush = time.monotonic()
+
+    if not batch:
+        return
+
+    now = time.monotonic()
+    values = [
+        (telegram_id, username, full_name, now - seen_at, now - seen_at)
+        for telegram_id, (username, full_name, seen_at) in batch.items()
+    ]
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        execute_values(cur, """
+            INSERT INTO telegram_contacts (telegram_id, telegram_username, full_name, first_contact_at, last_contact_at)
+            VALUES %s
+            ON CONFLICT (telegram_id)
+            DO UPDATE SET
+                telegram_username = EXCLUDED.telegram_username,
+                full_name = EXCLUDED.full_name,
+                last_contact_at = GREATEST(telegram_contacts.last_contact_at, EXCLUDED.last_contact_at)
+        """, values,
+            template="(%s, %s, %s, CURRENT_TIMESTAMP - %s * INTERVAL '1 second', CURRENT_TIMESTAMP - %s * INTERVAL '1 second')")
+        conn.commit()
+    except Exception:
+        # Вернуть в буфер то, что не было перезаписано более свежими сообщениями
+        with _lock:
+            for telegram_id, entry in batch.items():
+                _pending.setdefault(telegram_id, entry)
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+    with _lock:
+        for telegram_id, (username, full_name, _) in batch.items():
+            _written[telegram_id] = (username, full_name, now)
+            _written.move_to_end(telegram_id)
+        while len(_written) > TELEGRAM_CONTACTS_TRACKED:
+            _written.popitem(last=False)
@@ -151,7 +151,7 @@ def handle_message(chat_id: int, telegram_id: int, text: str, username: str = No
     }
 
 
-def handle_callback(chat_id: int, telegram_id: int, callback_data: str, message_id: int) -> dict:
+def handle_callback(chat_id: int, telegram_id: int, callback_data: str, message_id: int, callback_query_id: str = None) -> dict:
     """Обработка нажатий на inline кнопки"""
     
     user = get_user_by_telegram_id(telegram_id)
@@ -159,7 +159,7 @@ def handle_callback(chat_id: int, telegram_id: int, callback_data: str, message_
     if callback_data == 'add_client':
         if not user:
             send_message(chat_id, "⚠️ Привяжите бота к аккаунту в CRM для добавления клиентов.")
-            answer_callback_query(telegram_id)
+            answer_callback_query(callback_query_id)
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json'},
@@ -168,7 +168,7 @@ def handle_callback(chat_id: int, telegram_id: int, callback_data: str, message_
         
         # Запустить FSM для добавления клиента
         start_client_creation(chat_id, telegram_id, user['id'], user['organization_id'])
-        answer_callback_query(telegram_id)
+        answer_callback_query(callback_query_id)
     
     elif callback_data == 'support':
         send_message(
@@ -177,17 +177,17 @@ def handle_callback(chat_id: int, telegram_id: int, callback_data: str, message_
             "Напишите ваш вопрос, и мы ответим в ближайшее время.\n\n"
             "Если вы уже писали ранее, просто отправьте новое сообщение - оно добавится в ваш тред."
         )
-        answer_callback_query(telegram_id)
+        answer_callback_query(callback_query_id)
     
     elif callback_data == 'cancel_client':
         cancel_client_creation(chat_id, telegram_id)
-        answer_callback_query(telegram_id)
+        answer_callback_query(callback_query_id)
     
     elif callback_data.startswith('matrix_'):
         # Выбор матрицы для оценки: matrix_123
         matrix_id = int(callback_data.split('_')[1])
         start_assessment(chat_id, telegram_id, matrix_id)
-        answer_callback_query(telegram_id)
+        answer_callback_query(callback_query_id)
     
     elif callback_data == 'skip_assessment':
         # Пропустить оценку и сохранить клиента
@@ -195,7 +195,7 @@ def handle_callback(chat_id: int, telegram_id: int, callback_data: str, message_
         if state_data:
             data = state_data.get('data', {})
             save_client_without_assessment(chat_id, telegram_id, data, data.get('description'))
-        answer_callback_query(telegram_id)
+        answer_callback_query(callback_query_id)
     
     elif callback_data.startswith('score_'):
         # Оценка критерия: score_criterion_id_status_id_weight
@@ -205,11 +205,11 @@ def handle_callback(chat_id: int, telegram_id: int, callback_data: str, message_
             status_id = int(parts[2])
             weight = int(parts[3])
             handle_criterion_score(chat_id, telegram_id, criterion_id, status_id, weight)
-        answer_callback_query(telegram_id)
+        answer_callback_query(callback_query_id)
     
     elif callback_data == 'cancel_assessment':
         cancel_assessment(chat_id, telegram_id)
-        answer_callback_query(telegram_id)
+        answer_callback_query(callback_query_id)
     
     elif callback_data.startswith('reply_'):
         # Кнопка "Ответить" в канале поддержки: reply_thread_id_user_telegram_id
@@ -223,7 +223,7 @@ def handle_callback(chat_id: int, telegram_id: int, callback_data: str, message_
                 f"✍️ Введите ваш ответ для треда #{thread_id}\n\n"
                 f"Формат: `/reply {thread_id} текст вашего ответа`"
             )
-        answer_callback_query(telegram_id)
+        answer_callback_query(callback_query_id)
     
     elif callback_data.startswith('close_'):
         # Закрыть тред поддержки: close_thread_id
@@ -234,7 +234,7 @@ def handle_callback(chat_id: int, telegram_id: int, callback_data: str, message_
         # notify_channel_thread_closed будет вызван отдельно
         
         send_message(chat_id, f"✅ Тред #{thread_id} закрыт.")
-        answer_callback_query(telegram_id)
+        answer_callback_query(callback_query_id)
     
     elif callback_data == 'how_to_link':
         send_message(
@@ -245,7 +245,7 @@ def handle_callback(chat_id: int, telegram_id: int, callback_data: str, message_
             "3. Нажмите на неё и следуйте инструкциям\n\n"
             "Если у вас ещё нет аккаунта, обратитесь в поддержку."
         )
-        answer_callback_query(telegram_id)
+        answer_callback_query(callback_query_id)
     
     elif callback_data == 'menu':
         user = get_user_by_telegram_id(telegram_id)
@@ -273,7 +273,7 @@ def handle_callback(chat_id: int, telegram_id: int, callback_data: str, message_
                 f"📋 **Главное меню**\n\nВыберите действие:",
                 buttons
             )
-        answer_callback_query(telegram_id)
+        answer_callback_query(callback_query_id)
     
     elif callback_data == 'help':
         help_text = (
@@ -289,7 +289,7 @@ def handle_callback(chat_id: int, telegram_id: int, callback_data: str, message_
             "Для привязки бота к вашему аккаунту зайдите в CRM и нажмите на плитку 'Telegram' на главном дашборде."
         )
         send_message(chat_id, help_text)
-        answer_callback_query(telegram_id)
+        answer_callback_query(callback_query_id)
     
     return {
         'statusCode': 200,
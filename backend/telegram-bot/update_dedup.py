@@ -0,0 +1,135 @@
+"""
+Защита от повторной обработки апдейтов Telegram.
+Telegram повторяет доставку, если вебхук ответил медленно или с ошибкой;
+повтор с тем же update_id подтверждается сразу, без вызова обработчиков.
+
+Недавние update_id хранятся в памяти процесса (ограниченное множество),
+все - в таблице telegram_processed_updates с очисткой по TTL. Запись
+занимается со статусом processing на время аренды и после process_update
+помечается done. Если функцию убили посреди обработки (таймаут, память),
+отметка done не ставится, и повтор от Telegram после аренды проходит.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from db import get_db_connection
+
+RECENT_UPDATES_LIMIT = 10000
+# Telegram повторяет апдейт до суток - храним с запасом
+TELEGRAM_UPDATE_TTL_HOURS = int(os.environ.get('TELEGRAM_UPDATE_TTL_HOURS', '48'))
+TELEGRAM_UPDATE_SWEEP_INTERVAL = 600
+# Аренда дольше таймаута функции: живой обработчик не должен потерять апдейт
+TELEGRAM_UPDATE_LEASE_SECONDS = int(os.environ.get('TELEGRAM_UPDATE_LEASE_SECONDS', '120'))
+
+_recent: 'OrderedDict[int, None]' = OrderedDict()
+_recent_lock = threading.Lock()
+_last_sweep = 0.0
+
+
+def _remember(update_id: int):
+    with _recent_lock:
+        _recent[update_id] = None
+        _recent.move_to_end(update_id)
+        while len(_recent) > RECENT_UPDATES_LIMIT:
+            _recent.popitem(last=False)
+
+
+def _forget(update_id: int):
+    with _recent_lock:
+        _recent.pop(update_id, None)
+
+
+def claim_update(update_id: int) -> bool:
+    """
+    Занять update_id для обработки. False - апдейт уже обработан или его
+    обрабатывает другой запрос с неистёкшей арендой. Если БД недоступна,
+    решает только память процесса: лучше обработать повтор, чем потерять апдейт.
+    """
+    with _recent_lock:
+        if update_id in _recent:
+            return False
+
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """
+                INSERT INTO telegram_processed_updates (update_id, status, claimed_at)
+                VALUES (%s, 'processing', CURRENT_TIMESTAMP)
+                ON CONFLICT (update_id) DO UPDATE SET claimed_at = CURRENT_TIMESTAMP
+                WHERE telegram_processed_updates.status = 'processing'
+                AND telegram_processed_updates.claimed_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+                RETURNING update_id
+                """,
+                (update_id, TELEGRAM_UPDATE_LEASE_SECONDS)
+            )
+            claimed = cur.fetchone() is not None
+            _maybe_sweep(cur)
+            conn.commit()
+        finally:
+            cur.close()
+            conn.close()
+    except Exception as e:
+        print(f"[UPDATE_DEDUP] claim failed for {update_id}: {type(e).__name__}: {e}")
+        claimed = True
+
+    _remember(update_id)
+    return claimed
+
+
+def complete_update(update_id: int):
+    """Отметить апдейт обработанным - повторы больше не проходят"""
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """
+                UPDATE telegram_processed_updates
+                SET status = 'done', processed_at = CURRENT_TIMESTAMP
+                WHERE update_id = %s
+                """,
+                (update_id,)
+            )
+            conn.commit()
+        finally:
+            cur.close()
+            conn.close()
+    except Exception as e:
+        print(f"[UPDATE_DEDUP] complete failed for {update_id}: {type(e).__name__}: {e}")
+
+
+def release_update(update_id: int):
+    """Снять отметку, если обработка упала - повтор от Telegram должен пройти"""
+    _forget(update_id)
+
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("DELETE FROM telegram_processed_updates WHERE update_id = %s", (update_id,))
+            conn.commit()
+        finally:
+            cur.close()
+            conn.close()
+    except Exception as e:
+        print(f"[UPDATE_DEDUP] release failed for {update_id}: {type(e).__name__}: {e}")
+
+
+def sweep_processed_updates(cur) -> int:
+    """Удалить отметки старше TTL"""
+    global _last_sweep
+    cur.execute(
+        "DELETE FROM telegram_processed_updates WHERE claimed_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 hour'",
+        (TELEGRAM_UPDATE_TTL_HOURS,)
+    )
+    _last_sweep = time.monotonic()
+    return cur.rowcount
+
+
+def _maybe_sweep(cur):
+    if time.monotonic() - _last_sweep > TELEGRAM_UPDATE_SWEEP_INTERVAL:
+        sweep_processed_updates(cur)
@@ -1,8 +1,7 @@
 import json
-import os
-import jwt
-import psycopg2
 from psycopg2.extras import RealDictCursor
+from db import get_db_connection
+from auth import authenticate, AuthError, invalidate_user_access
 
 def handler(event: dict, context) -> dict:
     """API для управления правами доступа пользователей"""
@@ -37,46 +36,33 @@ def handler(event: dict, context) -> dict:
     except:
         pass
     
-    auth_header = event.get('headers', {}).get('X-Authorization', '')
-    token = auth_header.replace('Bearer ', '') if auth_header else ''
-    
-    if not token:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Требуется авторизация'}),
-            'isBase64Encoded': False
-        }
-    
     try:
-        secret = os.environ.get('JWT_SECRET')
-        payload = jwt.decode(token, secret, algorithms=['HS256'])
-        user_id = payload['user_id']
-        organization_id = payload['organization_id']
-        role = payload.get('role', 'manager')
-    except:
+        auth = authenticate(event, default_role='manager')
+    except AuthError as e:
         return {
             'statusCode': 401,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Неверный токен'}),
+            'body': json.dumps({'error': 'Требуется авторизация' if e.reason == 'missing' else 'Неверный токен'}),
             'isBase64Encoded': False
         }
     
     try:
-        dsn = os.environ.get('DATABASE_URL')
-        conn = psycopg2.connect(dsn)
+        conn = get_db_connection()
         
         body = json.loads(event.get('body', '{}')) if event.get('body') else {}
         action = body.get('action', 'get_permissions')
         
         if action == 'get_permissions':
-            target_user_id = body.get('user_id', user_id)
-            result = get_permissions(conn, target_user_id, organization_id)
+            target_user_id = body.get('user_id', auth.user_id)
+            if target_user_id == auth.user_id:
+                result = {'permissions': auth.permissions}
+            else:
+                result = get_permissions(conn, target_user_id, auth.organization_id)
         elif action == 'update_permissions':
-            if role not in ['owner', 'admin']:
+            if auth.role not in ['owner', 'admin']:
                 conn.close()
                 return {'statusCode': 403, 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}, 'body': json.dumps({'error': 'Недостаточно прав'}), 'isBase64Encoded': False}
-            result = update_permissions(conn, body, organization_id)
+            result = update_permissions(conn, body, auth.organization_id)
         else:
             conn.close()
             return {
@@ -190,6 +176,7 @@ def update_permissions(conn, body: dict, organization_id: int):
             ))
         
         conn.commit()
+        invalidate_user_access(int(target_user_id), organization_id)
         return {'message': 'Права обновлены'}
 
 
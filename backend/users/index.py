@@ -4,25 +4,9 @@ API для управления пользователями в организа
 Доступ только для owner и admin ролей.
 """
 import json
-import os
-import jwt
-import psycopg2
-from typing import Optional
-
-
-def verify_jwt_token(token: str) -> Optional[dict]:
-    """Проверка JWT токена"""
-    try:
-        secret = os.environ.get('JWT_SECRET')
-        return jwt.decode(token, secret, algorithms=['HS256'])
-    except:
-        return None
-
-
-def get_db_connection():
-    """Подключение к базе данных"""
-    dsn = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(dsn)
+from db import get_db_connection
+from auth import authenticate, AuthError, AuthContext, invalidate_user_access
+from usage_limits import reserve_usage, release_usage, UsageLimitExceeded
 
 
 def check_permission(user_role: str, required_roles: list) -> bool:
@@ -52,37 +36,27 @@ def handler(event: dict, context) -> dict:
             'isBase64Encoded': False
         }
     
-    auth_header = event.get('headers', {}).get('X-Authorization', '')
-    token = auth_header.replace('Bearer ', '') if auth_header else ''
-    
-    if not token:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Authorization required'}),
-            'isBase64Encoded': False
-        }
-    
-    payload = verify_jwt_token(token)
-    if not payload:
+    try:
+        auth = authenticate(event)
+    except AuthError as e:
         return {
             'statusCode': 401,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Invalid token'}),
+            'body': json.dumps({'error': 'Authorization required' if e.reason == 'missing' else 'Invalid token'}),
             'isBase64Encoded': False
         }
     
     try:
         if method == 'GET':
-            return handle_list(payload)
+            return handle_list(auth)
         elif method == 'POST':
             body = json.loads(event.get('body', '{}'))
             action = body.get('action')
             
             if action == 'update':
-                return handle_update(payload, body)
+                return handle_update(auth, body)
             elif action == 'delete':
-                return handle_delete(payload, body)
+                return handle_delete(auth, body)
             else:
                 return {
                     'statusCode': 400,
@@ -107,9 +81,9 @@ def handler(event: dict, context) -> dict:
         }
 
 
-def handle_list(payload: dict) -> dict:
+def handle_list(auth: AuthContext) -> dict:
     """Получение списка пользователей организации"""
-    organization_id = payload['organization_id']
+    organization_id = auth.organization_id
     
     conn = get_db_connection()
     cur = conn.cursor()
@@ -149,9 +123,9 @@ def handle_list(payload: dict) -> dict:
         conn.close()
 
 
-def handle_update(payload: dict, body: dict) -> dict:
+def handle_update(auth: AuthContext, body: dict) -> dict:
     """Обновление роли или статуса пользователя"""
-    if not check_permission(payload['role'], ['owner', 'admin']):
+    if not check_permission(auth.role, ['owner', 'admin']):
         return {
             'statusCode': 403,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -169,14 +143,14 @@ def handle_update(payload: dict, body: dict) -> dict:
             'body': json.dumps({'error': 'user_id is required'})
         }
     
-    organization_id = payload['organization_id']
+    organization_id = auth.organization_id
     
     conn = get_db_connection()
     cur = conn.cursor()
     
     try:
         cur.execute(
-            "SELECT id, role, organization_id FROM users WHERE id = %s" % user_id
+            "SELECT id, role, organization_id, is_active FROM users WHERE id = %s FOR UPDATE" % user_id
         )
         result = cur.fetchone()
         
@@ -189,6 +163,7 @@ def handle_update(payload: dict, body: dict) -> dict:
         
         target_role = result[1]
         target_org_id = result[2]
+        was_active = bool(result[3])
         
         if target_org_id != organization_id:
             return {
@@ -197,7 +172,7 @@ def handle_update(payload: dict, body: dict) -> dict:
                 'body': json.dumps({'error': 'Cannot modify user from different organization'})
             }
         
-        if target_role == 'owner' and payload['role'] != 'owner':
+        if target_role == 'owner' and auth.role != 'owner':
             return {
                 'statusCode': 403,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -212,7 +187,7 @@ def handle_update(payload: dict, body: dict) -> dict:
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                     'body': json.dumps({'error': 'Invalid role'})
                 }
-            if new_role == 'owner' and payload['role'] != 'owner':
+            if new_role == 'owner' and auth.role != 'owner':
                 return {
                     'statusCode': 403,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -222,6 +197,19 @@ def handle_update(payload: dict, body: dict) -> dict:
         
         if is_active is not None:
             updates.append("is_active = %s" % ('true' if is_active else 'false'))
+            
+            # Активация занимает место в лимите тарифа, деактивация освобождает
+            if is_active and not was_active:
+                try:
+                    reserve_usage(cur, organization_id, 'users')
+                except UsageLimitExceeded as e:
+                    return {
+                        'statusCode': 403,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': str(e)})
+                    }
+            elif was_active and not is_active:
+                release_usage(cur, organization_id, 'users')
         
         if not updates:
             return {
@@ -234,6 +222,7 @@ def handle_update(payload: dict, body: dict) -> dict:
             "UPDATE users SET %s WHERE id = %s" % (', '.join(updates), user_id)
         )
         conn.commit()
+        invalidate_user_access(int(user_id), organization_id)
         
         return {
             'statusCode': 200,
@@ -246,9 +235,9 @@ def handle_update(payload: dict, body: dict) -> dict:
         conn.close()
 
 
-def handle_delete(payload: dict, body: dict) -> dict:
+def handle_delete(auth: AuthContext, body: dict) -> dict:
     """Деактивация пользователя"""
-    if not check_permission(payload['role'], ['owner', 'admin']):
+    if not check_permission(auth.role, ['owner', 'admin']):
         return {
             'statusCode': 403,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -264,21 +253,21 @@ def handle_delete(payload: dict, body: dict) -> dict:
             'body': json.dumps({'error': 'user_id is required'})
         }
     
-    if user_id == payload['user_id']:
+    if user_id == auth.user_id:
         return {
             'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': 'Cannot delete yourself'})
         }
     
-    organization_id = payload['organization_id']
+    organization_id = auth.organization_id
     
     conn = get_db_connection()
     cur = conn.cursor()
     
     try:
         cur.execute(
-            "SELECT role, organization_id FROM users WHERE id = %s" % user_id
+            "SELECT role, organization_id, is_active FROM users WHERE id = %s FOR UPDATE" % user_id
         )
         result = cur.fetchone()
         
@@ -307,7 +296,10 @@ def handle_delete(payload: dict, body: dict) -> dict:
             }
         
         cur.execute("UPDATE users SET is_active = false WHERE id = %s" % user_id)
+        if result[2]:
+            release_usage(cur, organization_id, 'users')
         conn.commit()
+        invalidate_user_access(int(user_id), organization_id)
         
         return {
             'statusCode': 200,
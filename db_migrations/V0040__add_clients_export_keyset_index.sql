@@ -0,0 +1,4 @@
+-- Индекс для keyset-пагинации потокового экспорта клиентов
+-- Порядок совпадает с ORDER BY в export: score_x DESC, score_y DESC, id DESC
+CREATE INDEX IF NOT EXISTS idx_clients_export_keyset
+  ON clients (organization_id, COALESCE(score_x, 0) DESC, COALESCE(score_y, 0) DESC, id DESC);
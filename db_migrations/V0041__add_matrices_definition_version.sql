@@ -0,0 +1,3 @@
+-- Версия определения матрицы (критерии, статусы, правила квадрантов)
+-- Увеличивается при каждом изменении, по ней инвалидируется кэш определений в функциях
+ALTER TABLE matrices ADD COLUMN IF NOT EXISTS definition_version INTEGER NOT NULL DEFAULT 1;
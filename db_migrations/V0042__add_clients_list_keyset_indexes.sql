@@ -0,0 +1,9 @@
+-- Индексы для keyset-пагинации списков клиентов (clients: list, list_unrated, list_deleted)
+-- Активные клиенты: WHERE organization_id = ? AND deleted_at IS NULL ORDER BY created_at DESC, id DESC
+CREATE INDEX IF NOT EXISTS idx_clients_org_deleted_created
+  ON clients (organization_id, deleted_at, created_at DESC, id DESC);
+
+-- Корзина: WHERE organization_id = ? AND deleted_at IS NOT NULL ORDER BY deleted_at DESC, id DESC
+CREATE INDEX IF NOT EXISTS idx_clients_org_deleted_keyset
+  ON clients (organization_id, deleted_at DESC, id DESC)
+  WHERE deleted_at IS NOT NULL;
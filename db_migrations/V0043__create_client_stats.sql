@@ -0,0 +1,22 @@
+-- Материализованные счётчики клиентов для дашборда
+-- Ключ (organization, matrix, quadrant, deal_status); NULL хранится как 0 / ''
+-- Учитываются клиенты с is_active = true AND deleted_at IS NULL
+CREATE TABLE IF NOT EXISTS client_stats (
+    organization_id INTEGER NOT NULL REFERENCES organizations(id),
+    matrix_id INTEGER NOT NULL DEFAULT 0,
+    quadrant VARCHAR(20) NOT NULL DEFAULT '',
+    deal_status_id INTEGER NOT NULL DEFAULT 0,
+    clients_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (organization_id, matrix_id, quadrant, deal_status_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_client_stats_matrix ON client_stats(matrix_id);
+
+-- Начальное заполнение по текущим клиентам
+INSERT INTO client_stats (organization_id, matrix_id, quadrant, deal_status_id, clients_count)
+SELECT organization_id, COALESCE(matrix_id, 0), COALESCE(quadrant, ''), COALESCE(deal_status_id, 0), COUNT(*)
+FROM clients
+WHERE is_active = true AND deleted_at IS NULL
+GROUP BY organization_id, COALESCE(matrix_id, 0), COALESCE(quadrant, ''), COALESCE(deal_status_id, 0)
+ON CONFLICT (organization_id, matrix_id, quadrant, deal_status_id)
+DO UPDATE SET clients_count = EXCLUDED.clients_count;
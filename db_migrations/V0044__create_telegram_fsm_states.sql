@@ -0,0 +1,10 @@
+-- Состояния диалогов Telegram-бота (добавление и оценка клиента)
+-- Хранятся в БД, чтобы переживать холодный старт и работать на нескольких инстансах
+CREATE TABLE IF NOT EXISTS telegram_fsm_states (
+    telegram_id BIGINT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_telegram_fsm_states_expires ON telegram_fsm_states(expires_at);
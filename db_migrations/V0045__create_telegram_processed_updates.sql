@@ -0,0 +1,13 @@
+-- Апдейты Telegram для защиты от повторной доставки
+-- processing - апдейт занят обработчиком до claimed_at + аренда, после неё повтор
+-- может занять его снова (функцию убили по таймауту); done - обработан
+-- Записи старше TTL удаляет сам бот (update_dedup.sweep_processed_updates)
+CREATE TABLE IF NOT EXISTS telegram_processed_updates (
+    update_id BIGINT PRIMARY KEY,
+    status VARCHAR(20) NOT NULL DEFAULT 'processing',
+    claimed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    processed_at TIMESTAMP,
+    CONSTRAINT chk_telegram_update_status CHECK (status IN ('processing', 'done'))
+);
+
+CREATE INDEX IF NOT EXISTS idx_telegram_processed_updates_claimed ON telegram_processed_updates(claimed_at);
@@ -0,0 +1,4 @@
+-- Индекс для фоновой очистки корзины матриц (matrix_purge.purge_expired_matrices)
+CREATE INDEX IF NOT EXISTS idx_matrices_deleted_at
+  ON matrices(deleted_at, id)
+  WHERE deleted_at IS NOT NULL;
@@ -0,0 +1,29 @@
+-- Задачи удаления матриц навсегда чанками (matrix_purge.run_matrix_delete_job)
+-- phase + last_id - контрольная точка: с неё задача продолжается после обрыва
+CREATE TABLE IF NOT EXISTS matrix_delete_jobs (
+    id SERIAL PRIMARY KEY,
+    matrix_id INTEGER NOT NULL,
+    organization_id INTEGER NOT NULL REFERENCES organizations(id),
+    status VARCHAR(20) NOT NULL DEFAULT 'running',
+    phase VARCHAR(30) NOT NULL,
+    last_id INTEGER NOT NULL DEFAULT 0,
+    estimated_rows INTEGER NOT NULL DEFAULT 0,
+    processed_rows INTEGER NOT NULL DEFAULT 0,
+    deleted_scores INTEGER NOT NULL DEFAULT 0,
+    unlinked_clients INTEGER NOT NULL DEFAULT 0,
+    deleted_statuses INTEGER NOT NULL DEFAULT 0,
+    deleted_criteria INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT chk_matrix_delete_job_status CHECK (status IN ('running', 'done', 'failed'))
+);
+
+-- Не больше одной активной задачи на матрицу
+CREATE UNIQUE INDEX IF NOT EXISTS idx_matrix_delete_jobs_running
+  ON matrix_delete_jobs (matrix_id)
+  WHERE status = 'running';
+
+-- Чанки по оценкам критериев идут по id внутри criterion_id
+CREATE INDEX IF NOT EXISTS idx_client_criterion_scores_criterion_id
+  ON client_criterion_scores (criterion_id, id);
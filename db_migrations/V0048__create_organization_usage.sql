@@ -0,0 +1,23 @@
+-- Счётчики использования тарифа по организации (usage_limits.py)
+-- Меняются в одной транзакции с созданием/удалением; лимит проверяется условным UPDATE
+CREATE TABLE IF NOT EXISTS organization_usage (
+    organization_id INTEGER PRIMARY KEY REFERENCES organizations(id),
+    users_count INTEGER NOT NULL DEFAULT 0,
+    matrices_count INTEGER NOT NULL DEFAULT 0,
+    clients_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Начальное заполнение: активные пользователи, матрицы и активные клиенты вне корзины
+INSERT INTO organization_usage (organization_id, users_count, matrices_count, clients_count)
+SELECT
+    o.id,
+    (SELECT COUNT(*) FROM users u WHERE u.organization_id = o.id AND u.is_active = true),
+    (SELECT COUNT(*) FROM matrices m WHERE m.organization_id = o.id AND m.is_template IS NOT TRUE AND m.deleted_at IS NULL),
+    (SELECT COUNT(*) FROM clients c WHERE c.organization_id = o.id AND c.is_active = true AND c.deleted_at IS NULL)
+FROM organizations o
+ON CONFLICT (organization_id) DO UPDATE SET
+    users_count = EXCLUDED.users_count,
+    matrices_count = EXCLUDED.matrices_count,
+    clients_count = EXCLUDED.clients_count,
+    updated_at = CURRENT_TIMESTAMP;
@@ -0,0 +1,26 @@
+-- Загрузка файлов импорта частями (import/import_uploads.py)
+-- Чанки хранятся в БД: у инстансов функции нет общего диска
+CREATE TABLE IF NOT EXISTS import_uploads (
+    id SERIAL PRIMARY KEY,
+    organization_id INTEGER NOT NULL REFERENCES organizations(id),
+    user_id INTEGER NOT NULL,
+    file_name VARCHAR(255),
+    file_type VARCHAR(10) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'uploading',
+    chunks_count INTEGER NOT NULL DEFAULT 0,
+    total_bytes BIGINT NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT chk_import_upload_status CHECK (status IN ('uploading', 'committed'))
+);
+
+CREATE TABLE IF NOT EXISTS import_upload_chunks (
+    upload_id INTEGER NOT NULL REFERENCES import_uploads(id) ON DELETE CASCADE,
+    chunk_index INTEGER NOT NULL,
+    data BYTEA NOT NULL,
+    PRIMARY KEY (upload_id, chunk_index)
+);
+
+-- Очистка брошенных загрузок по updated_at
+CREATE INDEX IF NOT EXISTS idx_import_uploads_org_updated
+  ON import_uploads (organization_id, updated_at);
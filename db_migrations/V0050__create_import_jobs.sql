@@ -0,0 +1,36 @@
+-- Фоновые задачи импорта клиентов (import/import_jobs.py)
+-- rows_done - контрольная точка: пачка клиентов коммитится вместе с ней,
+-- задача продолжается с неё при следующем вызове или по таймеру
+CREATE TABLE IF NOT EXISTS import_jobs (
+    id SERIAL PRIMARY KEY,
+    organization_id INTEGER NOT NULL REFERENCES organizations(id),
+    user_id INTEGER NOT NULL,
+    upload_id INTEGER REFERENCES import_uploads(id) ON DELETE SET NULL,
+    matrix_id INTEGER NOT NULL,
+    mapping JSONB NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'running',
+    rows_done INTEGER NOT NULL DEFAULT 0,
+    bytes_done BIGINT NOT NULL DEFAULT 0,
+    total_bytes BIGINT NOT NULL DEFAULT 0,
+    imported_count INTEGER NOT NULL DEFAULT 0,
+    skipped_count INTEGER NOT NULL DEFAULT 0,
+    failed_count INTEGER NOT NULL DEFAULT 0,
+    -- {причина: число строк} и первые примеры [{row, reason, message}]
+    error_summary JSONB NOT NULL DEFAULT '{}',
+    errors JSONB NOT NULL DEFAULT '[]',
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP,
+    CONSTRAINT chk_import_job_status CHECK (status IN ('running', 'done', 'failed'))
+);
+
+-- Не больше одной активной задачи на загруженный файл
+CREATE UNIQUE INDEX IF NOT EXISTS idx_import_jobs_running
+  ON import_jobs (upload_id)
+  WHERE status = 'running';
+
+-- Поиск незавершённых задач таймером
+CREATE INDEX IF NOT EXISTS idx_import_jobs_status
+  ON import_jobs (status, id);
+
@@ -16,13 +16,13 @@ const ImportStepOne = ({ file, loading, parseFile, handleFileChange }: ImportSte
       
       <div className="mb-6">
         <label className="block text-sm font-medium mb-3">
-          Выберите файл для импорта (CSV или JSON)
+          Выберите файл для импорта (CSV, Excel или JSON)
         </label>
         
         <div className="border-2 border-dashed border-border rounded-lg p-8 text-center hover:border-primary transition-colors cursor-pointer">
           <input
             type="file"
-            accept=".csv,.json"
+            accept=".csv,.xlsx,.json"
             onChange={handleFileChange}
             className="hidden"
             id="file-upload"
@@ -35,7 +35,7 @@ const ImportStepOne = ({ file, loading, parseFile, handleFileChange }: ImportSte
               {file ? file.name : 'Выберите файл или перетащите сюда'}
             </p>
             <p className="text-sm text-muted-foreground">
-              Поддерживаются форматы: CSV, JSON
+              Поддерживаются форматы: CSV, Excel (.xlsx), JSON
             </p>
           </label>
         </div>
@@ -18,6 +18,19 @@ interface Template {
   mapping: Record<string, string>;
 }
 
+interface ImportJob {
+  id: number;
+  status: 'running' | 'done' | 'failed';
+  rows_done: number;
+  imported_count: number;
+  skipped_count: number;
+  failed_count: number;
+  progress: number;
+  error: string | null;
+}
+
+const IMPORT_POLL_INTERVAL = 1500;
+
 const IMPORT_FUNCTION_URL = 'https://functions.poehali.dev/33290691-9470-4059-a482-08ce98ddf826';
 const MATRICES_FUNCTION_URL = 'https://functions.poehali.dev/574d8d38-81d5-49c7-b625-a170daa667bc';
 
@@ -30,7 +43,7 @@ const Import = () => {
   const [success, setSuccess] = useState('');
   
   const [file, setFile] = useState<File | null>(null);
-  const [fileType, setFileType] = useState<'csv' | 'json'>('csv');
+  const [fileType, setFileType] = useState<'csv' | 'json' | 'xlsx'>('csv');
   const [fileContent, setFileContent] = useState('');
   
   const [columns, setColumns] = useState<string[]>([]);
@@ -108,16 +121,19 @@ const Import = () => {
       const extension = selectedFile.name.split('.').pop()?.toLowerCase();
       if (extension === 'json') {
         setFileType('json');
+      } else if (extension === 'xlsx') {
+        setFileType('xlsx');
       } else {
         setFileType('csv');
       }
       
+      // data URL сохраняет байты файла как есть: Excel - бинарный, CSV может быть в UTF-8
       const reader = new FileReader();
       reader.onload = (event) => {
-        const base64 = btoa(event.target?.result as string);
-        setFileContent(base64);
+        const dataUrl = event.target?.result as string;
+        setFileContent(dataUrl.split(',')[1] || '');
       };
-      reader.readAsText(selectedFile);
+      reader.readAsDataURL(selectedFile);
     }
   };
 
@@ -222,8 +238,10 @@ const Import = () => {
         },
         body: JSON.stringify({
           action: 'import',
+          async: true,
           file_content: fileContent,
           file_type: fileType,
+          file_name: file?.name,
           mapping: mapping,
           matrix_id: parseInt(selectedMatrix),
         }),
@@ -235,7 +253,14 @@ const Import = () => {
         throw new Error(data.error || 'Ошибка импорта');
       }
 
-      setSuccess(`Успешно импортировано ${data.imported} из ${data.total} клиентов (пропущено: ${data.skipped})`);
+      const job = await waitForImportJob(data.job, token);
+
+      if (job.status === 'failed') {
+        throw new Error(job.error || 'Ошибка импорта');
+      }
+
+      const failed = job.failed_count ? `, с ошибками: ${job.failed_count}` : '';
+      setSuccess(`Успешно импортировано ${job.imported_count} из ${job.rows_done} клиентов (пропущено: ${job.skipped_count}${failed})`);
       
       setTimeout(() => {
         navigate('/clients');
@@ -247,6 +272,31 @@ const Import = () => {
     }
   };
 
+  const waitForImportJob = async (job: ImportJob, token: string | null): Promise<ImportJob> => {
+    while (job.status === 'running') {
+      setSuccess(`Импорт: обработано строк ${job.rows_done} (${Math.round(job.progress * 100)}%)`);
+      await new Promise((resolve) => setTimeout(resolve, IMPORT_POLL_INTERVAL));
+
+      const response = await fetch(IMPORT_FUNCTION_URL, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          'Authorization': `Bearer ${token}`,
+        },
+        body: JSON.stringify({ action: 'import_job_status', job_id: job.id }),
+      });
+
+      const data = await response.json();
+
+      if (!response.ok) {
+        throw new Error(data.error || 'Ошибка импорта');
+      }
+
+      job = data.job;
+    }
+    return job;
+  };
+
   const saveTemplate = async () => {
     if (!templateName) {
       setError('Введите название шаблона');